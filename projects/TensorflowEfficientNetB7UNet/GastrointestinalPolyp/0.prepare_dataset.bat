@@ -0,0 +1 @@
+python ../../../src/TensorflowUNetDatasetPreparer.py ./train_eval_infer.config
@@ -0,0 +1,2 @@
+python ../../../src/TensorflowUNetTFLiteConverter.py ./train_eval_infer.config
+
@@ -0,0 +1,2 @@
+python ../../../src/TensorflowUNetSavedModelExporter.py ./train_eval_infer.config
+
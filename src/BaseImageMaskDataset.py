@@ -16,8 +16,28 @@
 # ImageMaskDataset.py
 # 2023/05/31 to-arai Modified to use config_file
 # 2023/10/02 Updated to call self.read_image_file, and self.read_mask_file in create nethod.
+# 2024/04    Added [dataset] store = "memmap" to build X and Y once into .npy memmaps
+#            and return the memmap-backed arrays from create method.
+# 2024/04    Added [dataset] num_workers to read the image and mask files in parallel.
+# 2024/04    Modified create method to take the image and mask files from DatasetIndex.
+# 2024/04    Modified create method to read the prepared copy of the dataset written by
+#            TensorflowUNetDatasetPreparer.py, if it has been prepared with the same preprocessing.
+"""
+[dataset]
+; "memory" or "memmap"
+store     = "memmap"
+store_dir = "./dataset_store"
+; Number of workers to read files, 0 or 1 means sequential reading
+num_workers = 8
+; "thread" or "process", the default is "process" for skimage of this class,
+; and "thread" for cv2 of ImageMaskDataset, which releases the GIL
+worker_pool = "thread"
+"""
 
 import os
+import hashlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import numpy as np
 import cv2
 from tqdm import tqdm
@@ -30,6 +50,8 @@ from skimage.transform import resize
 from skimage.io import imread
 import traceback
 from ConfigParser import ConfigParser
+from DatasetIndex import DatasetIndex
+from PreparedDataset import PreparedDataset
 
 MODEL  = "model"
 TRAIN  = "train"
@@ -37,12 +59,16 @@ EVAL   = "eval"
 TEST   = "test"
 MASK   = "mask"
 IMAGE  = "image"
+DATASET = "dataset"
 
 class BaseImageMaskDataset:
+  # Default [dataset] worker_pool, skimage's imread and resize hold the GIL.
+  WORKER_POOL = "process"
 
   def __init__(self, config_file):
     print("=== BaseImageMaskDataset.constructor")
 
+    self.config_file = config_file
     self.config = ConfigParser(config_file)
     self.image_width    = self.config.get(MODEL, "image_width")
     self.image_height   = self.config.get(MODEL, "image_height")
@@ -59,6 +85,28 @@ class BaseImageMaskDataset:
   
     self.blur_size = self.config.get(MASK, "blur_size", dvalue=(3,3))
 
+    self.store      = self.config.get(DATASET, "store",     dvalue="memory")
+    self.store_dir  = self.config.get(DATASET, "store_dir", dvalue="./dataset_store")
+    if not self.store in ["memory", "memmap"]:
+      raise Exception("Invalid [dataset] store " + str(self.store))
+    self.num_workers = self.config.get(DATASET, "num_workers", dvalue=0)
+    self.worker_pool = self.config.get(DATASET, "worker_pool", dvalue=self.WORKER_POOL)
+    if not self.worker_pool in ["thread", "process"]:
+      raise Exception("Invalid [dataset] worker_pool " + str(self.worker_pool))
+    self.prepared_dataset = PreparedDataset(config_file)
+    self.prepared = False
+
+  # Return the preprocessing config which the arrays created by create method depend on.
+  # If needed, please override this method in a subclass which has another preprocessing setting.
+  def signature(self):
+    return (self.__class__.__name__, self.image_width, self.image_height, self.image_channels,
+            self.binarize, self.algorithm, self.threshold, self.blur_mask, self.blur_size)
+
+  # Return the preprocessing config of read_pair as a dict for PreparedDataset,
+  # or None if the dataset cannot be prepared.
+  # The resized images of skimage of this class are float, which are not saved as uint8 images.
+  def preprocessing(self):
+    return None
 
   # If needed, please override this method in a subclass derived from this class.
   def create(self, dataset = TRAIN,  debug=False):
@@ -67,35 +115,34 @@ class BaseImageMaskDataset:
     print("=== BaseImagMaskDataset.create dataset {}".format(dataset))
     image_datapath = self.config.get(dataset, "image_datapath")
     mask_datapath  = self.config.get(dataset, "mask_datapath")
-    
-    image_files  = glob.glob(image_datapath + "/*.jpg")
-    image_files += glob.glob(image_datapath + "/*.png")
-    image_files += glob.glob(image_datapath + "/*.bmp")
-    image_files += glob.glob(image_datapath + "/*.tif")
-    image_files  = sorted(image_files)
-
-    mask_files   = None
-    if os.path.exists(mask_datapath):
-      mask_files  = glob.glob(mask_datapath + "/*.jpg")
-      mask_files += glob.glob(mask_datapath + "/*.png")
-      mask_files += glob.glob(mask_datapath + "/*.bmp")
-      mask_files += glob.glob(mask_datapath + "/*.tif")
-      mask_files  = sorted(mask_files)
-      
-      if len(image_files) != len(mask_files):
-        raise Exception("FATAL: Images and masks unmatched")
-      
+
+    # 2024/04 Read the prepared copy instead of the source files if it is up to date.
+    self.prepared = False
+    if self.preprocessing() != None:
+      prepared_datapaths = self.prepared_dataset.find(dataset, image_datapath, mask_datapath, self.preprocessing(),
+                                                      ordered=True)
+      if prepared_datapaths != None:
+        (image_datapath, mask_datapath) = prepared_datapaths
+        self.prepared = True
+
+    # 2024/04 Take the sorted image and mask pairs from a persistent DatasetIndex
+    # instead of globbing the directories.
+    # The images and masks of other basenames are paired in order as before.
+    index       = DatasetIndex(self.config_file, image_datapath, mask_datapath, ordered=True)
+    image_files = index.image_files()
+    mask_files  = index.mask_files()
     num_images  = len(image_files)
-    if num_images == 0:
-      raise Exception("FATAL: Not found image files")
     
+    if self.store == "memmap":
+      return self.create_memmap(dataset, index)
+
     X = np.zeros((num_images, self.image_height, self.image_width, self.image_channels), dtype=np.uint8)
 
     Y = np.zeros((num_images, self.image_height, self.image_width, 1                ), dtype=bool)
 
-    for n, image_file in tqdm(enumerate(image_files), total=len(image_files)):
-      X[n]  = self.read_image_file(image_file)
-      Y[n]  = self.read_mask_file(mask_files[n])
+    for n, (image, mask) in tqdm(enumerate(self.read_files(image_files, mask_files)), total=len(image_files)):
+      X[n]  = image
+      Y[n]  = mask
 
       if debug:
           cv2.imshow("---", Y[n])
@@ -105,6 +152,80 @@ class BaseImageMaskDataset:
   
     return X, Y
 
+  # Return X and Y as read-only memmaps of .npy files in store_dir.
+  # They are built only once for the image and mask files (paths and content hashes of DatasetIndex)
+  # and the preprocessing signature, and reruns load them without reading any image file.
+  def create_memmap(self, dataset, index):
+    image_files = index.image_files()
+    mask_files  = index.mask_files()
+    stamps = [(image["path"], image["sha1"], mask["path"], mask["sha1"]) for (image, mask) in index.pairs]
+    key    = hashlib.sha1((str(stamps) + str(self.signature())).encode("utf-8")).hexdigest()[:16]
+    x_file = os.path.join(self.store_dir, dataset + "_" + key + "_X.npy")
+    y_file = os.path.join(self.store_dir, dataset + "_" + key + "_Y.npy")
+
+    if not (os.path.exists(x_file) and os.path.exists(y_file)):
+      if not os.path.exists(self.store_dir):
+        os.makedirs(self.store_dir)
+      num_images = len(image_files)
+      print("--- Building {} and {}".format(x_file, y_file))
+      # Write to temporary files and rename them, so that an interrupted build is never loaded.
+      x_temp = x_file + ".tmp"
+      y_temp = y_file + ".tmp"
+      X = np.lib.format.open_memmap(x_temp, mode="w+", dtype=np.uint8,
+                 shape=(num_images, self.image_height, self.image_width, self.image_channels))
+      Y = np.lib.format.open_memmap(y_temp, mode="w+", dtype=bool,
+                 shape=(num_images, self.image_height, self.image_width, 1))
+      for n, (image, mask) in tqdm(enumerate(self.read_files(image_files, mask_files)), total=len(image_files)):
+        X[n]  = image
+        Y[n]  = mask
+      X.flush()
+      Y.flush()
+      del X, Y
+      os.replace(x_temp, x_file)
+      os.replace(y_temp, y_file)
+
+    print("--- Loading memmaps {} and {}".format(x_file, y_file))
+    X = np.load(x_file, mmap_mode="r")
+    Y = np.load(y_file, mmap_mode="r")
+    return X, Y
+
+  def read_files(self, image_files, mask_files):
+    """
+    Yield (image, mask) of image_files and mask_files in the order of the files.
+    If num_workers > 1, chunks of the files are read by a pool of worker_pool in parallel,
+    and the results are yielded in the order of the chunks, so that X and Y are the same as
+    the sequential reading. Only num_workers * 2 chunks are submitted ahead of the consumer,
+    so that the decoded images never pile up in memory while they are written to memmaps.
+    """
+    if self.num_workers <= 1:
+      for (image_file, mask_file) in zip(image_files, mask_files):
+        yield self.read_pair(image_file, mask_file)
+      return
+    Executor  = ThreadPoolExecutor
+    chunksize = 1
+    if self.worker_pool == "process":
+      Executor  = ProcessPoolExecutor
+      # A chunk is a task of a worker process to reduce the pickling of self and the results.
+      chunksize = max(1, min(16, len(image_files) // (self.num_workers * 4)))
+    with Executor(max_workers=self.num_workers) as executor:
+      futures = deque()
+      for i in range(0, len(image_files), chunksize):
+        futures.append(executor.submit(self.read_chunk, image_files[i:i+chunksize], mask_files[i:i+chunksize]))
+        if len(futures) >= self.num_workers * 2:
+          for pair in futures.popleft().result():
+            yield pair
+      while len(futures) > 0:
+        for pair in futures.popleft().result():
+          yield pair
+
+  def read_chunk(self, image_files, mask_files):
+    return [self.read_pair(image_file, mask_file) for (image_file, mask_file) in zip(image_files, mask_files)]
+
+  def read_pair(self, image_file, mask_file):
+    if self.prepared:
+      return self.prepared_dataset.read(image_file, mask_file)
+    return (self.read_image_file(image_file), self.read_mask_file(mask_file))
+
   def read_image_file(self, image_file):
     image = imread(image_file)
     image = resize(image, (self.image_height, self.image_width, self.image_channels), 
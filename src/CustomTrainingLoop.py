@@ -0,0 +1,104 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# CustomTrainingLoop.py
+#
+# A training loop which runs train_step and test_step of a compiled Keras model as
+# tf.function (XLA compiled by [runtime] jit_compile = True), in place of model.fit
+# of the graph mode, which feeds every batch of a Python generator through feed_dict
+# of a tf.compat.v1 session.
+#
+# The loop uses the optimizer, loss and metrics of model.compile through train_step
+# (GradientAccumulationModel.train_step for [train] accumulation_steps), and calls the callbacks
+# (EpochChangeCallback, ModelCheckpoint, EarlyStopping, ReduceLROnPlateau) through
+# tf.keras.callbacks.CallbackList with the same logs as model.fit:
+#   loss, val_loss, and each metric and "val_" + metric at the end of an epoch.
+#
+# You can select this by the following settings.
+"""
+[runtime]
+execution   = "function"
+jit_compile = True
+
+[train]
+; "fit"(model.fit) or "custom"(CustomTrainingLoop)
+loop = "custom"
+"""
+
+import tensorflow as tf
+
+class CustomTrainingLoop:
+
+  def __init__(self, model, jit_compile=False):
+    self.model = model
+    self.train_function = tf.function(model.train_step, jit_compile=jit_compile)
+    self.test_function  = tf.function(model.test_step,  jit_compile=jit_compile)
+
+  # Return an endless generator of the batches of arrays X and Y in order, and the number of
+  # the batches of an epoch, to train on the arrays as model.fit(x, y, shuffle=False) does.
+  @staticmethod
+  def batches(X, Y, batch_size):
+    def generate():
+      while True:
+        for i in range(0, len(X), batch_size):
+          yield (X[i:i + batch_size], Y[i:i + batch_size])
+    return (generate(), (len(X) + batch_size - 1) // batch_size)
+
+  def to_floats(self, logs):
+    return {name: float(value) for (name, value) in logs.items()}
+
+  def fit(self, train_data, steps_per_epoch, epochs, validation_data=None, validation_steps=None,
+          callbacks=None, verbose=1, initial_epoch=0):
+    callbacks = tf.keras.callbacks.CallbackList(callbacks, add_history=True, add_progbar=verbose != 0,
+                                                model=self.model, verbose=verbose,
+                                                epochs=epochs, steps=steps_per_epoch)
+    train_iterator = iter(train_data)
+    valid_iterator = None
+    if validation_data is not None:
+      valid_iterator = iter(validation_data)
+    self.model.stop_training = False
+    callbacks.on_train_begin()
+    epoch_logs = {}
+    for epoch in range(initial_epoch, epochs):
+      self.model.reset_metrics()
+      callbacks.on_epoch_begin(epoch)
+      logs = {}
+      for step in range(steps_per_epoch):
+        callbacks.on_train_batch_begin(step)
+        logs = self.train_function(next(train_iterator))
+        callbacks.on_train_batch_end(step, logs)
+        if self.model.stop_training:
+          break
+      epoch_logs = self.to_floats(logs)
+      if valid_iterator is not None:
+        valid_logs = self.evaluate(valid_iterator, validation_steps, callbacks)
+        epoch_logs.update({"val_" + name: value for (name, value) in valid_logs.items()})
+      callbacks.on_epoch_end(epoch, epoch_logs)
+      if self.model.stop_training:
+        break
+    callbacks.on_train_end(epoch_logs)
+    return getattr(self.model, "history", None)
+
+  def evaluate(self, valid_iterator, validation_steps, callbacks):
+    self.model.reset_metrics()
+    callbacks.on_test_begin()
+    logs = {}
+    for step in range(validation_steps):
+      callbacks.on_test_batch_begin(step)
+      logs = self.test_function(next(valid_iterator))
+      callbacks.on_test_batch_end(step, logs)
+    logs = self.to_floats(logs)
+    callbacks.on_test_end(logs)
+    return logs
@@ -0,0 +1,158 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# DatasetIndex.py
+#
+# A persistent index (manifest) of image and mask pairs of an image_datapath and a mask_datapath.
+# Each pair has the paths, sizes, modification times and a content hash of the image and mask
+# files, and the width and height of the image.
+# The index is built once into a JSON file in index_dir, and validated on loading by
+# the modification times of the directories and os.stat of the files, so that only
+# added or changed files are read again.
+#
+# A mask is paired with the image of the same basename, and an image without a mask of
+# the same basename raises "Not found" as ImageMaskDatasetGenerator did.
+# Only with ordered = True, for BaseImageMaskDataset which paired the sorted images and
+# the sorted masks in order, such images are paired in order with a warning.
+#
+# Example of the settings in [dataset] section.
+"""
+[dataset]
+index_dir = "./dataset_index"
+"""
+
+import os
+import glob
+import json
+import hashlib
+from PIL import Image
+
+from ConfigParser import ConfigParser
+
+DATASET    = "dataset"
+EXTENSIONS = ["jpg", "png", "bmp", "tif"]
+VERSION    = 2
+
+class DatasetIndex:
+
+  def __init__(self, config_file, image_datapath, mask_datapath, ordered=False):
+    config = ConfigParser(config_file)
+    self.index_dir      = config.get(DATASET, "index_dir", dvalue="./dataset_index")
+    self.image_datapath = os.path.abspath(image_datapath)
+    self.mask_datapath  = os.path.abspath(mask_datapath)
+    self.ordered        = ordered
+    key = self.image_datapath + "|" + self.mask_datapath
+    if ordered:
+      key += "|ordered"
+    key = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+    self.index_file = os.path.join(self.index_dir, "index_" + key + ".json")
+    self.pairs = self.load()
+
+  def list_files(self, datapath):
+    files = []
+    for extension in EXTENSIONS:
+      files += glob.glob(datapath + "/*." + extension)
+    return sorted(files)
+
+  def hash(self, file):
+    sha1 = hashlib.sha1()
+    with open(file, "rb") as f:
+      for chunk in iter(lambda: f.read(1024 * 1024), b""):
+        sha1.update(chunk)
+    return sha1.hexdigest()
+
+  # Return an entry of a file, reusing the entry of the previous index if the file is unchanged.
+  def entry(self, file, previous):
+    stat = os.stat(file)
+    if previous != None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime:
+      return previous
+    return {"path": file, "size": stat.st_size, "mtime": stat.st_mtime, "sha1": self.hash(file)}
+
+  def unchanged(self, entry):
+    try:
+      stat = os.stat(entry["path"])
+    except FileNotFoundError:
+      return False
+    return entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime
+
+  def stamp(self):
+    return [os.stat(self.image_datapath).st_mtime, os.stat(self.mask_datapath).st_mtime]
+
+  def load(self):
+    if not os.path.exists(self.mask_datapath):
+      raise Exception("Not found mask_datapath " + self.mask_datapath)
+    index = None
+    if os.path.exists(self.index_file):
+      with open(self.index_file, "r", encoding="utf-8") as f:
+        index = json.load(f)
+      if index.get("version") != VERSION:
+        index = None
+    # If no file has been added, removed or modified, the index is valid without reading any file.
+    if index != None and index["stamp"] == self.stamp() and \
+       all(self.unchanged(entry) for pair in index["pairs"] for entry in pair):
+      return index["pairs"]
+    return self.build(index)
+
+  def build(self, previous_index):
+    print("=== DatasetIndex.build {} {}".format(self.image_datapath, self.mask_datapath))
+    PREVIOUS = {}
+    if previous_index != None:
+      for (image, mask) in previous_index["pairs"]:
+        PREVIOUS[image["path"]] = image
+        PREVIOUS[mask["path"]]  = mask
+    image_files = self.list_files(self.image_datapath)
+    mask_files  = self.list_files(self.mask_datapath)
+    if len(image_files) == 0:
+      raise Exception("FATAL: Not found image files")
+
+    MASKS = {os.path.basename(mask_file): mask_file for mask_file in mask_files}
+    unpaired = [image_file for image_file in image_files if not os.path.basename(image_file) in MASKS]
+    if len(unpaired) == 0:
+      mask_files = [MASKS[os.path.basename(image_file)] for image_file in image_files]
+    elif not self.ordered:
+      raise Exception("Not found " + os.path.join(self.mask_datapath, os.path.basename(unpaired[0])))
+    elif len(image_files) != len(mask_files):
+      raise Exception("FATAL: Images and masks unmatched")
+    else:
+      print("=== WARNING: {} images have no mask of the same basename, pairing sorted images and masks in order".format(
+            len(unpaired)))
+
+    pairs = []
+    for (image_file, mask_file) in zip(image_files, mask_files):
+      image = self.entry(image_file, PREVIOUS.get(image_file))
+      if not "width" in image:
+        with Image.open(image_file) as img:
+          # Image.open reads only the header of the file.
+          (image["width"], image["height"]) = img.size
+      pairs.append((image, self.entry(mask_file, PREVIOUS.get(mask_file))))
+
+    if not os.path.exists(self.index_dir):
+      os.makedirs(self.index_dir)
+    index = {"version": VERSION, "image_datapath": self.image_datapath, "mask_datapath": self.mask_datapath,
+             "stamp": self.stamp(), "pairs": pairs}
+    temp = self.index_file + "." + str(os.getpid())
+    with open(temp, "w", encoding="utf-8") as f:
+      json.dump(index, f)
+    os.replace(temp, self.index_file)
+    return index["pairs"]
+
+  def image_files(self):
+    return [image["path"] for (image, _) in self.pairs]
+
+  def mask_files(self):
+    return [mask["path"] for (_, mask) in self.pairs]
+
+  def __len__(self):
+    return len(self.pairs)
@@ -0,0 +1,122 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# DebugImageSink.py
+#
+# A sink of the debug images and masks of ImageMaskDatasetGenerator with [generator] debug = True.
+# Previously the generator wrote every original and augmented image and mask of every batch
+# by cv2.imwrite on the training thread. This sink
+#  - accepts only debug_samples examples per epoch (steps_per_epoch * batch_size examples),
+#    one in every examples_per_epoch / debug_samples examples, so that they are spread over the epoch,
+#  - writes them and the lines of generate_images.txt on a background writer thread
+#    through a bounded queue, dropping an example rather than blocking when it is full,
+#  - stops accepting examples when debug_max_mbytes have been written.
+# The owner of the sink must call close at the end of the training to write the queued examples.
+#
+# Example of the settings in [generator] section.
+"""
+[generator]
+debug            = True
+debug_samples    = 16
+debug_queue_size = 64
+debug_max_mbytes = 256
+"""
+
+import os
+import queue
+import threading
+import cv2
+import numpy as np
+
+from ConfigParser import ConfigParser
+
+GENERATOR = "generator"
+
+class DebugImageSink:
+
+  def __init__(self, config_file, examples_per_epoch, log_file="./generate_images.txt"):
+    config = ConfigParser(config_file)
+    self.samples      = config.get(GENERATOR, "debug_samples",    dvalue=16)
+    self.queue_size   = config.get(GENERATOR, "debug_queue_size", dvalue=64)
+    self.max_bytes    = config.get(GENERATOR, "debug_max_mbytes", dvalue=256) * 1024 * 1024
+    self.examples_per_epoch = max(1, examples_per_epoch)
+    self.stride       = max(1, self.examples_per_epoch // max(1, self.samples))
+    self.log_file     = log_file
+    self.seen         = 0
+    self.accepted     = 0
+    self.written_bytes = 0
+    self.dropped      = 0
+    # accept may be called by the threads of a tf.data parallel map.
+    self.lock         = threading.Lock()
+    self.queue        = queue.Queue(maxsize=self.queue_size)
+    self.thread       = None
+
+  # Return True if an example of the current epoch should be written.
+  # This must be called once for each example the generator produces.
+  def accept(self):
+    with self.lock:
+      self.seen += 1
+      if self.seen > self.examples_per_epoch:
+        self.seen     = 1
+        self.accepted = 0
+      if (self.seen - 1) % self.stride != 0:
+        return False
+      if self.accepted >= self.samples or self.written_bytes >= self.max_bytes:
+        return False
+      self.accepted += 1
+      return True
+
+  # Queue an image and its mask to be written by the writer thread.
+  def write(self, image_path, image, mask_path, mask, line=None):
+    with self.lock:
+      if self.thread is None:
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+    # Copy them, because the caller may reuse or modify the arrays.
+    item = (image_path, np.array(image), mask_path, np.array(mask), line)
+    try:
+      self.queue.put_nowait(item)
+    except queue.Full:
+      with self.lock:
+        self.dropped += 1
+
+  def run(self):
+    with open(self.log_file, "w", encoding="utf-8") as f:
+      while True:
+        item = self.queue.get()
+        if item is None:
+          break
+        (image_path, image, mask_path, mask, line) = item
+        cv2.imwrite(image_path, image)
+        cv2.imwrite(mask_path,  mask)
+        size = os.path.getsize(image_path) + os.path.getsize(mask_path)
+        if line != None:
+          f.writelines(line + "\n")
+          f.flush()
+          size += len(line) + 1
+        with self.lock:
+          self.written_bytes += size
+
+  # Write the queued examples, and stop the writer thread.
+  def close(self):
+    if self.thread != None:
+      self.queue.put(None)
+      self.thread.join()
+      self.thread = None
+
+  def stats(self):
+    with self.lock:
+      return {"written_mbytes": round(self.written_bytes / (1024 * 1024), 2),
+              "dropped": self.dropped, "queued": self.queue.qsize()}
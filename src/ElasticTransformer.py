@@ -0,0 +1,91 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ElasticTransformer.py
+#
+# Elastic deformation of images and masks as described in [Simard2003]
+# with a pool of cached displacement fields.
+#
+# ImageMaskAugmentor.elastic_transform used to build a meshgrid, two full resolution
+# gaussian_filter calls and a map_coordinates on each call, and repeated them for the mask
+# with other random fields. Since it reseeded RandomState(seed) on each call, the fields
+# were the same on every call anyway.
+# This generates a pool of smoothed displacement fields once for each image size,
+# optionally at a lower resolution upsampled to the image size, converts them to
+# remap maps, and applies one of them to an image and its mask jointly by cv2.remap,
+# so that the mask stays aligned with the image.
+#
+# Example of the settings in [augmentor] section.
+"""
+[augmentor]
+transformer    = True
+alpah          = 1300
+sigmoid        = 8
+; Number of displacement fields in the pool, 1 (default) means the same field for every image
+elastic_fields = 8
+; Scale of the resolution to generate the fields, 1.0 (default) means the image resolution
+elastic_scale  = 0.25
+"""
+# [Simard2003] Simard, Steinkraus and Platt, "Best Practices for Convolutional Neural Networks
+# applied to Visual Document Analysis", in Proc. of the International Conference on Document
+# Analysis and Recognition, 2003. https://cognitivemedium.com/assets/rmnist/Simard.pdf
+
+import numpy as np
+import cv2
+
+class ElasticTransformer:
+
+  def __init__(self, alpha=1300, sigma=8, num_fields=1, scale=1.0, seed=137):
+    self.alpha      = alpha
+    self.sigma      = sigma
+    self.num_fields = max(1, int(num_fields))
+    self.scale      = scale
+    self.seed       = seed
+    # A random state to pick a field from the pool on each deformation.
+    self.random_state = np.random.RandomState(seed)
+    # (H, W) -> a list of remap maps
+    self.pools = {}
+
+  # Return a smoothed random displacement field [H, W] in pixels.
+  def displacement(self, random_state, H, W):
+    h = max(1, int(round(H * self.scale)))
+    w = max(1, int(round(W * self.scale)))
+    d = (random_state.rand(h, w).astype(np.float32) * 2 - 1)
+    sigma = self.sigma * w / W
+    d = cv2.GaussianBlur(d, (0, 0), sigmaX=sigma, sigmaY=sigma, borderType=cv2.BORDER_CONSTANT)
+    if (h, w) != (H, W):
+      d = cv2.resize(d, dsize=(W, H), interpolation=cv2.INTER_LINEAR)
+    # The smoothed noise at the lower resolution is larger by W / w than at the image resolution.
+    return d * (self.alpha * w / W)
+
+  def pool(self, H, W):
+    if not (H, W) in self.pools:
+      random_state = np.random.RandomState(self.seed)
+      (x, y) = np.meshgrid(np.arange(W, dtype=np.float32), np.arange(H, dtype=np.float32))
+      MAPS = []
+      for i in range(self.num_fields):
+        dx = self.displacement(random_state, H, W)
+        dy = self.displacement(random_state, H, W)
+        # Fixed point maps are faster to remap than float maps.
+        MAPS.append(cv2.convertMaps(x + dx, y + dy, cv2.CV_16SC2))
+      self.pools[(H, W)] = MAPS
+    return self.pools[(H, W)]
+
+  # Deform an image [H, W, C] (or a joint array of an image and its mask) by a field of the pool.
+  def deform(self, image):
+    (H, W) = image.shape[:2]
+    MAPS = self.pool(H, W)
+    (map1, map2) = MAPS[self.random_state.randint(len(MAPS))]
+    return cv2.remap(image, map1, map2, interpolation=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
@@ -0,0 +1,217 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# GradientAccumulationModel.py
+#
+# A Keras Model which shares the layers of a model created by TensorflowUNet.create,
+# and of which train_step accumulates the gradients of accumulation_steps micro-batches
+# of [train] batch_size before the optimizer (Adam or AdamW) applies their mean,
+# so that an update has the effective batch size of batch_size * accumulation_steps
+# with the activation memory of batch_size.
+#
+# Notes:
+#  - A step of model.fit is a micro-batch, so that the optimizer updates the weights
+#    once in accumulation_steps of steps_per_epoch.
+#  - The gradient of each micro-batch is weighted by its number of samples, so that a short
+#    last batch of the arrays counts as many samples as it has.
+#  - AccumulationFlushCallback applies the remaining accumulated gradients at the end of
+#    the last step of an epoch, when steps_per_epoch (or the number of the batches of the
+#    arrays) is not a multiple of accumulation_steps, so that an epoch never leaks into the next.
+#  - BatchNormalization layers normalize each micro-batch by its own statistics.
+#  - The accumulated gradients are kept out of the weights of this model, and save and
+#    save_weights (called by ModelCheckpoint) save the wrapped model, so that the checkpoints
+#    are the same as those of the model without accumulation.
+#  - This requires TF2 behavior, [runtime] execution = "function" or "eager", because
+#    the Keras training loop of the graph mode never calls train_step.
+#
+# Example of the settings in [train] section.
+"""
+[train]
+batch_size         = 4
+accumulation_steps = 4
+"""
+
+import os
+import sys
+import traceback
+import numpy as np
+import tensorflow as tf
+
+# A plain Python object which Keras never tracks, unlike the attributes of a Model of
+# tf.Variable, list or Layer, which Keras adds to the weights and the layers of the Model.
+class AccumulationState:
+
+  def __init__(self, model, variables):
+    self.model       = model
+    self.accumulated = [tf.Variable(tf.zeros_like(variable), trainable=False,
+                                    name="accumulated_" + str(i))
+                        for (i, variable) in enumerate(variables)]
+    self.micro_step  = tf.Variable(0, dtype=tf.int64, trainable=False, name="micro_step")
+    self.samples     = tf.Variable(0.0, dtype=tf.float32, trainable=False, name="samples")
+
+
+class GradientAccumulationModel(tf.keras.Model):
+
+  def __init__(self, model, accumulation_steps):
+    # The functional model of the same inputs and outputs shares the layers and weights of model.
+    super().__init__(inputs=model.inputs, outputs=model.outputs, name=model.name)
+    self.accumulation_steps = accumulation_steps
+    self.state = AccumulationState(model, self.trainable_variables)
+
+  # Save the wrapped model, which has the same weights without the accumulated gradients.
+  def save(self, *args, **kwargs):
+    return self.state.model.save(*args, **kwargs)
+
+  def save_weights(self, *args, **kwargs):
+    return self.state.model.save_weights(*args, **kwargs)
+
+  # Create the slots of the optimizer before the training function is traced, because
+  # the optimizer cannot create them in the conditional branch of apply_accumulated.
+  def build_optimizer(self):
+    optimizer = self.optimizer
+    if hasattr(optimizer, "inner_optimizer"):
+      optimizer = optimizer.inner_optimizer
+    if hasattr(optimizer, "build"):
+      optimizer.build(self.trainable_variables)
+    elif hasattr(optimizer, "_create_all_weights"):
+      optimizer._create_all_weights(self.trainable_variables)
+
+  def train_step(self, data):
+    (x, y, sample_weight) = tf.keras.utils.unpack_x_y_sample_weight(data)
+    with tf.GradientTape() as tape:
+      y_pred = self(x, training=True)
+      loss   = self.compiled_loss(y, y_pred, sample_weight, regularization_losses=self.losses)
+      scaled_loss = loss
+      if hasattr(self.optimizer, "get_scaled_loss"):
+        # LossScaleOptimizer of [model] mixed_precision = "mixed_float16"
+        scaled_loss = self.optimizer.get_scaled_loss(loss)
+    gradients = tape.gradient(scaled_loss, self.trainable_variables)
+    if hasattr(self.optimizer, "get_unscaled_gradients"):
+      gradients = self.optimizer.get_unscaled_gradients(gradients)
+
+    # The loss is the mean of the micro-batch, and the sum of the gradients of its samples is accumulated.
+    samples = tf.cast(tf.shape(y)[0], tf.float32)
+    for (accumulated, gradient) in zip(self.state.accumulated, gradients):
+      if gradient is not None:
+        gradient = tf.convert_to_tensor(gradient)
+        accumulated.assign_add(gradient * tf.cast(samples, gradient.dtype))
+    self.state.samples.assign_add(samples)
+    self.state.micro_step.assign_add(1)
+    tf.cond(self.state.micro_step % self.accumulation_steps == 0, self.apply_accumulated, lambda: tf.constant(False))
+
+    self.compiled_metrics.update_state(y, y_pred, sample_weight)
+    return {metric.name: metric.result() for metric in self.metrics}
+
+  # Apply the mean of the accumulated gradients over the accumulated samples, and clear them.
+  def apply_accumulated(self):
+    gradients = [accumulated / tf.cast(self.state.samples, accumulated.dtype)
+                 for accumulated in self.state.accumulated]
+    self.optimizer.apply_gradients(zip(gradients, self.trainable_variables))
+    for accumulated in self.state.accumulated:
+      accumulated.assign(tf.zeros_like(accumulated))
+    self.state.samples.assign(0.0)
+    return tf.constant(True)
+
+  # Apply the remaining accumulated gradients of fewer than accumulation_steps micro-batches,
+  # and start the next accumulation from the first micro-batch.
+  def flush(self):
+    if float(self.state.samples.numpy()) > 0:
+      self.apply_accumulated()
+    self.state.micro_step.assign(0)
+
+
+# A callback to flush the accumulated gradients of a GradientAccumulationModel after the last
+# step of each epoch, before the validation and the callbacks of the epoch end.
+class AccumulationFlushCallback(tf.keras.callbacks.Callback):
+
+  def on_train_batch_end(self, batch, logs=None):
+    steps = self.params.get("steps")
+    if steps != None and batch + 1 >= steps:
+      self.flush()
+
+  def on_epoch_end(self, epoch, logs=None):
+    # An epoch stopped before its last step, for example, by the end of the arrays.
+    self.flush()
+
+  def flush(self):
+    if isinstance(self.model, GradientAccumulationModel):
+      self.model.flush()
+
+
+# A save and load round trip of the checkpoints of a model trained with accumulation_steps > 1.
+def round_trip(accumulation_steps=2, weights_file="./accumulation_round_trip.h5"):
+  def create():
+    inputs  = tf.keras.layers.Input((32, 32, 3))
+    x       = tf.keras.layers.Conv2D(8, 3, padding="same", activation="relu")(inputs)
+    x       = tf.keras.layers.BatchNormalization()(x)
+    outputs = tf.keras.layers.Conv2D(1, 1, activation="sigmoid")(x)
+    return tf.keras.Model(inputs, outputs)
+
+  X = np.random.randint(0, 256, size=(8, 32, 32, 3)).astype(np.float32) / 255.0
+  Y = np.random.randint(0, 2,   size=(8, 32, 32, 1)).astype(np.float32)
+  model = GradientAccumulationModel(create(), accumulation_steps)
+  model.compile(optimizer=tf.keras.optimizers.Adam(), loss="binary_crossentropy")
+  model.build_optimizer()
+  if len(model.weights) != len(model.state.model.weights):
+    raise Exception("The accumulated gradients are tracked as the weights of the model")
+  checkpoint = tf.keras.callbacks.ModelCheckpoint(weights_file, save_weights_only=False)
+  # The batches of 3, 3 and 2 samples leave a micro-batch to be flushed for an even accumulation_steps.
+  model.fit(X, Y, batch_size=3, epochs=1, callbacks=[AccumulationFlushCallback(), checkpoint], verbose=0)
+
+  # Load the checkpoint into a plain model as the evaluator and the inferencer do.
+  plain = create()
+  plain.load_weights(weights_file)
+  difference = np.abs(plain.predict(X, verbose=0) - model.predict(X, verbose=0)).max()
+  os.remove(weights_file)
+  if difference > 1e-6:
+    raise Exception("The loaded model differs from the trained model by " + str(difference))
+  print("=== GradientAccumulationModel round trip accumulation_steps {} OK".format(accumulation_steps))
+
+
+# The update of the micro-batches of 3 and 1 samples, applied by train_step or by the flush at
+# the end of the epoch, equals the SGD update of a plain model on the batch of the 4 samples.
+def equivalence(accumulation_steps=2):
+  def create():
+    inputs  = tf.keras.layers.Input((8, 8, 3))
+    outputs = tf.keras.layers.Conv2D(1, 3, padding="same", activation="sigmoid")(inputs)
+    return tf.keras.Model(inputs, outputs)
+
+  X = np.random.randint(0, 256, size=(4, 8, 8, 3)).astype(np.float32) / 255.0
+  Y = np.random.randint(0, 2,   size=(4, 8, 8, 1)).astype(np.float32)
+  plain = create()
+  model = GradientAccumulationModel(create(), accumulation_steps)
+  model.set_weights(plain.get_weights())
+  plain.compile(optimizer=tf.keras.optimizers.SGD(0.1), loss="binary_crossentropy")
+  model.compile(optimizer=tf.keras.optimizers.SGD(0.1), loss="binary_crossentropy")
+  model.build_optimizer()
+  plain.fit(X, Y, batch_size=4, epochs=1, shuffle=False, verbose=0)
+  model.fit(X, Y, batch_size=3, epochs=1, shuffle=False, verbose=0, callbacks=[AccumulationFlushCallback()])
+  difference = max(np.abs(a - b).max() for (a, b) in zip(plain.get_weights(), model.get_weights()))
+  if difference > 1e-5:
+    raise Exception("The accumulated update differs from the update of the whole batch by " + str(difference))
+  print("=== GradientAccumulationModel equivalence accumulation_steps {} OK".format(accumulation_steps))
+
+
+if __name__ == "__main__":
+  try:
+    accumulation_steps = 2
+    if len(sys.argv) == 2:
+      accumulation_steps = int(sys.argv[1])
+    round_trip(accumulation_steps)
+    # The 2 micro-batches are applied by train_step for 2, and by the flush for 3.
+    equivalence(2)
+    equivalence(3)
+  except:
+    traceback.print_exc()
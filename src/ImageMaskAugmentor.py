@@ -20,14 +20,16 @@
 # 2023/08/27 Added shear method to augment images and masks.
 # 2023/08/28 Added elastic_transorm method to augment images and masks.
 # 2024/02/12 Modified shear method to check self.hflip and self.vflip flags
+# 2024/04    Split augment method into operations and apply methods to apply a single operation.
+# 2024/04    Added apply_batch method to augment stacks of images and masks, warping them jointly.
+# 2024/04    Modified elastic_transform to use cached displacement fields of ElasticTransformer.
 
 import os
 import sys
 import numpy as np
 import cv2
-from scipy.ndimage.interpolation import map_coordinates
-from scipy.ndimage.filters import gaussian_filter
 from ConfigParser import ConfigParser
+from ElasticTransformer import ElasticTransformer
 
 MODEL     = "model"
 GENERATOR = "generator"
@@ -35,7 +37,8 @@ AUGMENTOR = "augmentor"
 
 class ImageMaskAugmentor:
   
-  def __init__(self, config_file):
+  # 2024/04 seed of the random states of the augmentation such as ElasticTransformer
+  def __init__(self, config_file, seed=137):
     self.config  = ConfigParser(config_file)
     self.debug    = self.config.get(GENERATOR, "debug",  dvalue=True)
     self.W        = self.config.get(MODEL,     "image_width")
@@ -54,9 +57,103 @@ class ImageMaskAugmentor:
     self.transformer = self.config.get(AUGMENTOR, "transformer", dvalue=False)
     self.alpha    = self.config.get(AUGMENTOR, "alpah", dvalue=1300)
     self.sigmoid  = self.config.get(AUGMENTOR, "sigmoid", dvalue=8)
-    self.seed     = 137
+    self.seed     = seed
+    # 2024/04 Pool of cached displacement fields for elastic_transform.
+    # One field at the image resolution deforms every image by the same field as before.
+    self.elastic_fields = self.config.get(AUGMENTOR, "elastic_fields", dvalue=1)
+    self.elastic_scale  = self.config.get(AUGMENTOR, "elastic_scale",  dvalue=1.0)
+    self.elastic_transformer = ElasticTransformer(alpha=self.alpha, sigma=self.sigmoid,
+                                   num_fields=self.elastic_fields, scale=self.elastic_scale, seed=self.seed)
   
-  # It applies  horizotanl and vertical flipping operations to image and mask repectively.
+  # 2024/04 Augmentation operations
+  # Each operation is a tuple of its name and a parameter, and augment applies all of them
+  # in this order. The generator may sample (image, operation) pairs first, and apply
+  # only the sampled operations to the images by apply method.
+  def operations(self):
+    OPS = []
+    if self.hflip:
+      OPS.append(("hflip", None))
+    if self.vflip:
+      OPS.append(("vflip", None))
+    if self.rotation:
+      OPS += [("rotate", angle) for angle in self.ANGLES]
+    if type(self.SHRINKS) is list:
+      OPS += [("shrink", shrink) for shrink in self.SHRINKS]
+    if type(self.SHEARS) is list:
+      for shear in self.SHEARS:
+        OPS.append(("shear", shear))
+        # 2024/02/12
+        if self.hflip:
+          OPS.append(("hflipped_shear", shear))
+        if self.vflip:
+          OPS.append(("vflipped_shear", shear))
+          if self.hflip:
+            OPS.append(("hvflipped_shear", shear))
+    # 2023/08/28
+    if self.transformer:
+      OPS.append(("elastic", None))
+    return OPS
+
+  # Return an augmented image and mask by an operation of operations()
+  def apply(self, op, image, mask):
+    (images, masks) = self.apply_batch(op, np.expand_dims(image, 0), np.expand_dims(mask, 0))
+    return (images[0], masks[0])
+
+  # 2024/04 Batched augmentation
+  def apply_batch(self, op, images, masks):
+    """
+    images: uint8 stack of images [N, H, W, C]
+    masks:  uint8 stack of masks  [N, H, W, 1]
+    Return the stacks of augmented images and masks by an operation of operations().
+    The flips are applied to the whole stacks at once, and the geometric transforms
+    warp each image and its mask jointly in one call with the mask as an extra channel.
+    """
+    (name, param) = op
+    if name == "hflip":
+      return (self.horizontal_flip(images), self.horizontal_flip(masks))
+    if name == "vflip":
+      return (self.vertical_flip(images), self.vertical_flip(masks))
+    if name == "rotate":
+      return self.rotate(images, masks, param)
+    if name == "shrink":
+      return self.shrink(images, masks, param)
+    if name.endswith("shear"):
+      (sheared_images, sheared_masks) = self.shear(images, masks, param)
+      if name.startswith("h"):
+        sheared_images = self.horizontal_flip(sheared_images)
+        sheared_masks  = self.horizontal_flip(sheared_masks)
+      if name.startswith("hv") or name.startswith("v"):
+        sheared_images = self.vertical_flip(sheared_images)
+        sheared_masks  = self.vertical_flip(sheared_masks)
+      return (sheared_images, sheared_masks)
+    if name == "elastic":
+      return self.elastic_transform(images, masks)
+    raise Exception("Invalid augmentation operation " + str(op))
+
+  # Return a filename prefix of an augmented image and mask for debugging
+  def prefix(self, op):
+    (name, param) = op
+    if name in ["hflip", "vflip"]:
+      return name[0] + "fliped_"
+    if name == "rotate":
+      return "rotated_" + str(param) + "_"
+    ratio = str(param).replace(".", "_")
+    if name == "shrink":
+      return "shrinked_" + ratio + "_"
+    if name.endswith("shear"):
+      return name.replace("shear", "sheared_") + ratio + "_"
+    return "elastic" + "_alpha_" + str(self.alpha) + "_sigmoid_" +str(self.sigmoid) + "_"
+
+  def save(self, op, image, mask,
+                generated_images_dir, image_basename,
+                generated_masks_dir,  mask_basename ):
+    prefix   = self.prefix(op)
+    filepath = os.path.join(generated_images_dir, prefix + image_basename)
+    cv2.imwrite(filepath, np.ascontiguousarray(image))
+    filepath = os.path.join(generated_masks_dir,  prefix + mask_basename)
+    cv2.imwrite(filepath, np.ascontiguousarray(mask))
+
+  # It applies all the operations to image and mask respectively.
   def augment(self, IMAGES, MASKS, image, mask,
                 generated_images_dir, image_basename,
                 generated_masks_dir,  mask_basename ):
@@ -66,133 +163,70 @@ class ImageMaskAugmentor:
     image:  OpenCV image
     mask:   OpenCV mask
     """
-    if self.hflip:
-      hflip_image = self.horizontal_flip(image) 
-      hflip_mask  = self.horizontal_flip(mask) 
-      #print("--- hflp_mask shape {}".format(hflip_mask.shape))
-      IMAGES.append(hflip_image )
-  
-      MASKS.append( hflip_mask  )
-      if self.debug:
-        filepath = os.path.join(generated_images_dir, "hfliped_" + image_basename)
-        cv2.imwrite(filepath, hflip_image)
-        filepath = os.path.join(generated_masks_dir,  "hfliped_" + mask_basename)
-        cv2.imwrite(filepath, hflip_mask)
-
-    if self.vflip:
-      vflip_image = self.vertical_flip(image)
-      vflip_mask  = self.vertical_flip(mask)
-      #print("== vflip shape {}".format(vflip_mask.shape))
-      
-      IMAGES.append(vflip_image )    
-      MASKS.append( vflip_mask  )
+    for op in self.operations():
+      (augmented_image, augmented_mask) = self.apply(op, image, mask)
+      IMAGES.append(augmented_image)
+      MASKS.append(augmented_mask)
       if self.debug:
-        filepath = os.path.join(generated_images_dir, "vfliped_" + image_basename)
-        cv2.imwrite(filepath, vflip_image)
-        filepath = os.path.join(generated_masks_dir,  "vfliped_" + mask_basename)
-        cv2.imwrite(filepath, vflip_mask)
-
-    if self.rotation:
-       self.rotate(IMAGES, MASKS, image, mask,
-                 generated_images_dir, image_basename,
-                 generated_masks_dir,  mask_basename )
-       
-    if type(self.SHRINKS) is list and len(self.SHRINKS)>0:
-       self.shrink(IMAGES, MASKS, image, mask,
-                 generated_images_dir, image_basename,
-                 generated_masks_dir,  mask_basename )
-
-    if type(self.SHEARS) is list and len(self.SHEARS)>0:
-       self.shear(IMAGES, MASKS, image, mask,
-                 generated_images_dir, image_basename,
-                 generated_masks_dir,  mask_basename )
-    # 2023/08/28
-    if self.transformer:
-      self.elastic_transform(IMAGES, MASKS, image, mask,
-                 generated_images_dir, image_basename,
-                 generated_masks_dir,  mask_basename )
+        self.save(op, augmented_image, augmented_mask,
+                  generated_images_dir, image_basename,
+                  generated_masks_dir,  mask_basename )
 
+  # The flips take an image [H, W, C] or a stack of images [N, H, W, C].
   def horizontal_flip(self, image): 
-    image = image[:, ::-1, :]
-    return image
+    return image[..., :, ::-1, :]
 
   def vertical_flip(self, image):
-    image = image[::-1, :, :]
-    return image
-  
-  
-  def rotate(self, IMAGES, MASKS, image, mask,
-                generated_images_dir, image_basename,
-                generated_masks_dir,  mask_basename ):
-    for angle in self.ANGLES:      
-
-      center = (self.W/2, self.H/2)
-      rotate_matrix = cv2.getRotationMatrix2D(center=center, angle=angle, scale=1)
-
-      rotated_image = cv2.warpAffine(src=image, M=rotate_matrix, dsize=(self.W, self.H))
-      rotated_mask  = cv2.warpAffine(src=mask, M=rotate_matrix, dsize=(self.W, self.H))
-      IMAGES.append(rotated_image)
-      rotated_mask  = np.expand_dims(rotated_mask, axis=-1) 
-      #print("rotated_mask shape {}".format(rotated_mask.shape))
-      MASKS.append(rotated_mask)
-
-      if self.debug:
-        filepath = os.path.join(generated_images_dir, "rotated_" + str(angle) + "_" + image_basename)
-        cv2.imwrite(filepath, rotated_image)
-        filepath = os.path.join(generated_masks_dir,  "rotated_" + str(angle) + "_" + mask_basename)
-        cv2.imwrite(filepath, rotated_mask)
-  
-
-  def shrink(self, IMAGES, MASKS, image, mask,
-                generated_images_dir, image_basename,
-                generated_masks_dir,  mask_basename ):
+    return image[..., ::-1, :, :]
+
+  # Apply a function to each image and its mask merged into one array [H, W, C+1],
+  # and return the stack of the results [N, H', W', C+1].
+  def joint_map(self, func, images, masks):
+    C = images.shape[-1]
+    results = None
+    for i in range(len(images)):
+      if C + 1 <= 4:
+        result = func(cv2.merge([images[i], masks[i]]))
+      else:
+        # OpenCV processes up to 4 channels in one call exactly as each channel.
+        result = cv2.merge([func(images[i]), func(masks[i])])
+      if results is None:
+        results = np.empty((len(images),) + result.shape, dtype=result.dtype)
+      results[i] = result
+    return results
+
+  # Split the stack of the joint arrays into the stacks of the images and the masks.
+  def split(self, joints):
+    return (joints[..., :-1], joints[..., -1:])
+
+  def rotate(self, images, masks, angle):
+    center = (self.W/2, self.H/2)
+    rotate_matrix = cv2.getRotationMatrix2D(center=center, angle=angle, scale=1)
+    warp = lambda joint: cv2.warpAffine(src=joint, M=rotate_matrix, dsize=(self.W, self.H))
+    return self.split(self.joint_map(warp, images, masks))
+
+  def shrink(self, images, masks, shrink):
     # 2023/08/26
     # Added the following shrinking augmentation.
-    h, w = image.shape[:2]
-  
-    for shrink in self.SHRINKS:
-      rw = int (w * shrink)
-      rh = int (h * shrink)
-      resized_image = cv2.resize(image, dsize= (rw, rh),  interpolation=cv2.INTER_NEAREST)
-      resized_mask  = cv2.resize(mask,  dsize= (rw, rh),  interpolation=cv2.INTER_NEAREST)
-      
-      squared_image = self.paste(resized_image, mask=False)
-      squared_mask  = self.paste(resized_mask,  mask=True)
-      IMAGES.append(squared_image)
-      MASKS.append(squared_mask)
-      if self.debug:
-        ratio   = str(shrink).replace(".", "_")
-        image_filename = "shrinked_" + ratio + "_" + image_basename
-        image_filepath  = os.path.join(generated_images_dir, image_filename)
-        cv2.imwrite(image_filepath, squared_image)
-        #print("=== Saved {}".format(image_filepath))
-    
-        mask_filename = "shrinked_" + ratio + "_" + mask_basename
-        mask_filepath  = os.path.join(generated_masks_dir, mask_filename)
-        cv2.imwrite(mask_filepath, squared_mask)
-        #print("=== Saved {}".format(mask_filepath))
-
-
-  def paste(self, image, mask=False):
-    l = len(image.shape)
-   
-    h, w,  = image.shape[:2]
-
-    if l==3:
-      background = np.zeros((self.H, self.W, 3), dtype=np.uint8)
-      (b, g, r) = image[h-10][w-10] 
-      #print("r:{} g:{} b:c{}".format(b,g,r))
-      background += [b, g, r][::-1]
-    else:
-      v =  image[h-10][w-10] 
-      #print("x {}".format(v))
-      image  = np.expand_dims(image, axis=-1) 
-      background = np.zeros((self.H, self.W, 1), dtype=np.uint8)
-      background[background !=v] = v
+    h, w = images.shape[1:3]
+    rw = int (w * shrink)
+    rh = int (h * shrink)
+    resize = lambda joint: cv2.resize(joint, dsize= (rw, rh),  interpolation=cv2.INTER_NEAREST)
+    return self.split(self.paste(self.joint_map(resize, images, masks)))
+
+  # Paste the stack of the shrinked images and masks [N, h, w, C+1] on the centers of
+  # the backgrounds [N, H, W, C+1] filled with the color of the pixel at (w-10, h-10).
+  def paste(self, joints):
+    (N, h, w, C) = joints.shape
+    colors = joints[:, h-10, w-10, :].copy()
+    # The original paste method filled the background of an image with (b, g, r)[::-1],
+    # and that of a mask with its value.
+    colors[:, :C-1] = colors[:, C-2::-1]
+    background = np.empty((N, self.H, self.W, C), dtype=np.uint8)
+    background[:] = colors[:, np.newaxis, np.newaxis, :]
     x = (self.W - w)//2
     y = (self.H - h)//2
-    background[y:y+h, x:x+w] = image
-
+    background[:, y:y+h, x:x+w] = joints
     return background
   
 
@@ -203,81 +237,17 @@ class ImageMaskAugmentor:
   
   # 2024/02/12 Modified to check self.hflip and self.vflip flags
 
-  def shear(self, IMAGES, MASKS, image, mask,
-                 generated_images_dir, image_basename,
-                 generated_masks_dir,  mask_basename ):
-
-    if self.SHEARS == None or len(self.SHEARS) == 0:
-      return
-   
-    H, W = image.shape[:2]
-    for shear in self.SHEARS:
-      ratio = str(shear).replace(".", "_")
-      M2 = np.float32([[1, 0, 0], [shear, 1,0]])
-      M2[0,2] = -M2[0,1] * H/2 
-      M2[1,2] = -M2[1,0] * W/2 
-
-      sheared_image = cv2.warpAffine(image, M2, (W, H))
-      sheared_mask  = cv2.warpAffine(mask,  M2, (W, H))
-
-      IMAGES.append(sheared_image)
-      #print(" shape {}".format(sheared_mask.shape))
-      sheared_mask  = np.expand_dims(sheared_mask, axis=-1) 
-
-      MASKS.append(sheared_mask)
-
-      # 2024/02/12
-      if self.hflip:
-        hflipped_image  = self.horizontal_flip(sheared_image)
-        hflipped_mask   = self.horizontal_flip(sheared_mask)
-
-        IMAGES.append(hflipped_image)
-        MASKS.append(hflipped_mask)
-      if self.vflip:
-        vflipped_image  = self.vertical_flip(sheared_image)
-        vflipped_mask   = self.vertical_flip(sheared_mask)
-
-        IMAGES.append(vflipped_image)
-        MASKS.append(vflipped_mask)
-
-        hvflipped_image = self.vertical_flip(hflipped_image)
-        hvflipped_mask  = self.vertical_flip(hflipped_mask)
-
-        IMAGES.append(hvflipped_image)
-        MASKS.append(hvflipped_mask)
-
-      if self.debug:
-        filepath = os.path.join(generated_images_dir, "sheared_" + ratio + "_" + image_basename)
-        cv2.imwrite(filepath, sheared_image)
-        #print("Saved {}".format(filepath))
-        filepath = os.path.join(generated_masks_dir,  "sheared_" + ratio + "_" + mask_basename)
-        cv2.imwrite(filepath, sheared_mask)
-        #print("Saved {}".format(filepath))
-        # 2024/02/12
-        if self.hflip:
-          filepath = os.path.join(generated_images_dir, "hflipped_sheared_" + ratio + "_" + image_basename)
-          cv2.imwrite(filepath, hflipped_image)
-          #print("Saved {}".format(filepath))
-          filepath = os.path.join(generated_masks_dir,  "hflipped_sheared_" + ratio + "_" + mask_basename)
-          cv2.imwrite(filepath, hflipped_mask)
-          #print("Saved {}".format(filepath))
-        if self.vflip:
-          filepath = os.path.join(generated_images_dir, "vflipped_sheared_" + ratio + "_" + image_basename)
-          cv2.imwrite(filepath, vflipped_image)
-          #print("Saved {}".format(filepath))
-          filepath = os.path.join(generated_masks_dir,  "vflipped_sheared_" + ratio + "_" + mask_basename)
-          cv2.imwrite(filepath, vflipped_mask)
-          #print("Saved {}".format(filepath))
-
-          filepath = os.path.join(generated_images_dir, "hvflipped_sheared_" + ratio + "_" + image_basename)
-          cv2.imwrite(filepath, hvflipped_image)
-          #print("Saved {}".format(filepath))
-          filepath = os.path.join(generated_masks_dir,  "hvflipped_sheared_" + ratio + "_" + mask_basename)
-          cv2.imwrite(filepath, hvflipped_mask)
-          #print("Saved {}".format(filepath))
+  # 2024/04 The flipped variants of sheared images are created by apply_batch method.
+  def shear(self, images, masks, shear):
+    H, W = images.shape[1:3]
+    M2 = np.float32([[1, 0, 0], [shear, 1,0]])
+    M2[0,2] = -M2[0,1] * H/2 
+    M2[1,2] = -M2[1,0] * W/2 
+    warp = lambda joint: cv2.warpAffine(joint, M2, (W, H))
+    return self.split(self.joint_map(warp, images, masks))
 
     
-  # This method has been taken from the following code.
+  # The original method had been taken from the following code.
   # https://github.com/MareArts/Elastic_Effect/blob/master/Elastic.py
   #
   # https://cognitivemedium.com/assets/rmnist/Simard.pdf
@@ -285,49 +255,12 @@ class ImageMaskAugmentor:
   # See also
   # https://www.kaggle.com/code/jiqiujia/elastic-transform-for-data-augmentation/notebook
 
-  def elastic_transform(self, IMAGES, MASKS, image, mask,
-                generated_images_dir, image_basename,
-                generated_masks_dir,  mask_basename ):
+  # 2024/04 Deform each image and its mask jointly by a cached displacement field of ElasticTransformer.
+  def elastic_transform(self, images, masks):
     """Elastic deformation of images as described in [Simard2003]_.
     .. [Simard2003] Simard, Steinkraus and Platt, "Best Practices for
        Convolutional Neural Networks applied to Visual Document Analysis", in
        Proc. of the International Conference on Document Analysis and
        Recognition, 2003.
     """
-    random_state = np.random.RandomState(self.seed)
-
-    shape = image.shape
-    dx = gaussian_filter((random_state.rand(*shape) * 2 - 1), self.sigmoid, mode="constant", cval=0) * self.alpha
-    dy = gaussian_filter((random_state.rand(*shape) * 2 - 1), self.sigmoid, mode="constant", cval=0) * self.alpha
-    #dz = np.zeros_like(dx)
-
-    x, y, z = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]), np.arange(shape[2]))
-    indices = np.reshape(y+dy, (-1, 1)), np.reshape(x+dx, (-1, 1)), np.reshape(z, (-1, 1))
-
-    deformed_image = map_coordinates(image, indices, order=1, mode='nearest')  
-    deformed_image = deformed_image.reshape(image.shape)
-
-    shape = mask.shape
-    dx = gaussian_filter((random_state.rand(*shape) * 2 - 1), self.sigmoid, mode="constant", cval=0) * self.alpha
-    dy = gaussian_filter((random_state.rand(*shape) * 2 - 1), self.sigmoid, mode="constant", cval=0) * self.alpha
-    #dz = np.zeros_like(dx)
-
-    x, y, z = np.meshgrid(np.arange(shape[1]), np.arange(shape[0]), np.arange(shape[2]))
-    indices = np.reshape(y+dy, (-1, 1)), np.reshape(x+dx, (-1, 1)), np.reshape(z, (-1, 1))
-    deformed_mask = map_coordinates(mask, indices, order=1, mode='nearest')  
-    deformed_mask = deformed_mask.reshape(mask.shape)
-
-    IMAGES.append(deformed_image)
-    MASKS.append(deformed_mask)
-
-    if self.debug:
-      image_filename = "elastic" + "_alpha_" + str(self.alpha) + "_sigmoid_" +str(self.sigmoid) + "_" + image_basename
-      image_filepath  = os.path.join(generated_images_dir, image_filename)
-      cv2.imwrite(image_filepath, deformed_image)
-      #print("=== Saved {}".format(image_filepath))
-    
-      mask_filename = "elastic" + "_alpha_" + str(self.alpha) + "_sigmoid_" +str(self.sigmoid) + "_" + mask_basename
-      mask_filepath  = os.path.join(generated_masks_dir, mask_filename)
-      cv2.imwrite(mask_filepath, deformed_mask)
-
-
+    return self.split(self.joint_map(self.elastic_transformer.deform, images, masks))
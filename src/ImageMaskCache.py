@@ -0,0 +1,115 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ImageMaskCache.py
+#
+# A cache of decoded, resized and preprocessed image and mask pairs for ImageMaskDatasetGenerator.
+# A pair is keyed by the paths and modification times of the image and mask files, and
+# a signature of the preprocessing config (size, binarize, threshold, blur, ...), so that
+# a changed file or config never hits a stale entry.
+#  "memory": an LRU cache in memory of which size is capped by cache_size (MB)
+#  "disk"  : .npy files in cache_dir, which are loaded as read-only memmaps
+#
+# Example of the settings in [generator] section.
+"""
+[generator]
+; "none", "memory" or "disk"
+cache      = "memory"
+cache_size = 2048
+cache_dir  = "./cache"
+"""
+
+import os
+import hashlib
+import threading
+import numpy as np
+from collections import OrderedDict
+
+from ConfigParser import ConfigParser
+
+GENERATOR = "generator"
+CACHES    = ["none", "memory", "disk"]
+
+class ImageMaskCache:
+
+  def __init__(self, config_file, signature):
+    config = ConfigParser(config_file)
+    self.cache      = config.get(GENERATOR, "cache",      dvalue="none")
+    self.cache_size = config.get(GENERATOR, "cache_size", dvalue=2048)
+    self.cache_dir  = config.get(GENERATOR, "cache_dir",  dvalue="./cache")
+    if not self.cache in CACHES:
+      raise Exception("Invalid [generator] cache " + str(self.cache))
+    self.signature  = str(signature)
+    self.max_bytes  = int(self.cache_size) * 1024 * 1024
+    self.entries    = OrderedDict()
+    self.nbytes     = 0
+    self.hits       = 0
+    self.misses     = 0
+    # The cache may be shared by the threads of a tf.data parallel map.
+    self.lock       = threading.Lock()
+    if self.cache == "disk" and not os.path.exists(self.cache_dir):
+      os.makedirs(self.cache_dir)
+
+  def enabled(self):
+    return self.cache != "none"
+
+  def key(self, image_file, mask_file):
+    stamps = [(os.path.abspath(file), os.path.getmtime(file)) for file in [image_file, mask_file]]
+    return hashlib.sha1((str(stamps) + self.signature).encode("utf-8")).hexdigest()
+
+  def paths(self, key):
+    return (os.path.join(self.cache_dir, key + "_image.npy"),
+            os.path.join(self.cache_dir, key + "_mask.npy"))
+
+  # Return a cached (image, mask) pair, or None.
+  def get(self, key):
+    pair = None
+    if self.cache == "memory":
+      with self.lock:
+        pair = self.entries.get(key)
+        if pair is not None:
+          self.entries.move_to_end(key)
+    elif self.cache == "disk":
+      (image_path, mask_path) = self.paths(key)
+      if os.path.exists(image_path) and os.path.exists(mask_path):
+        pair = (np.load(image_path, mmap_mode="r"), np.load(mask_path, mmap_mode="r"))
+    with self.lock:
+      if pair is None:
+        self.misses += 1
+      else:
+        self.hits   += 1
+    return pair
+
+  def put(self, key, image, mask):
+    if self.cache == "memory":
+      with self.lock:
+        if not key in self.entries:
+          self.entries[key] = (image, mask)
+          self.nbytes += image.nbytes + mask.nbytes
+        # Evict the least recently used pairs over the size cap.
+        while self.nbytes > self.max_bytes and len(self.entries) > 1:
+          (_, (evicted_image, evicted_mask)) = self.entries.popitem(last=False)
+          self.nbytes -= evicted_image.nbytes + evicted_mask.nbytes
+    elif self.cache == "disk":
+      for (path, array) in zip(self.paths(key), [image, mask]):
+        # Write to a temporary file and rename it, so that a reader never sees a partial file.
+        temp = path + "." + str(os.getpid()) + "_" + str(threading.get_ident()) + ".npy"
+        np.save(temp, array)
+        os.replace(temp, path)
+
+  def stats(self):
+    with self.lock:
+      return {"cache": self.cache, "hits": self.hits, "misses": self.misses,
+              "entries": len(self.entries), "bytes": self.nbytes}
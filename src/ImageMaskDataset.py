@@ -32,6 +32,8 @@ TRAIN = "train"
 DATASET = "dataset"
 
 class ImageMaskDataset(BaseImageMaskDataset):
+  # cv2's imread and resize release the GIL.
+  WORKER_POOL = "thread"
 
   def __init__(self, config_file):
     super().__init__(config_file)
@@ -40,6 +42,15 @@ class ImageMaskDataset(BaseImageMaskDataset):
     self.resize_interpolation = eval(self.config.get(DATASET, "resize_interpolation", dvalue="cv2.INTER_NEAREST"))
     print("--- self.resize_interpolation {}".format(self.resize_interpolation))
 
+  def signature(self):
+    return super().signature() + (self.resize_interpolation,)
+
+  def preprocessing(self):
+    return {"image_width": self.image_width, "image_height": self.image_height,
+            "image_channels": self.image_channels, "interpolation": self.resize_interpolation,
+            "binarize": self.binarize, "algorithm": self.algorithm, "threshold": self.threshold,
+            "blur": self.blur_mask, "blur_size": self.blur_size}
+
   def read_image_file(self, image_file):
     image = cv2.imread(image_file) 
     
@@ -27,6 +27,10 @@ import random
 import traceback
 from ConfigParser import ConfigParser
 from ImageMaskAugmentor import ImageMaskAugmentor
+from ImageMaskCache import ImageMaskCache
+from DebugImageSink import DebugImageSink
+from DatasetIndex import DatasetIndex
+from PreparedDataset import PreparedDataset
 
 MODEL  = "model"
 TRAIN  = "train"
@@ -37,7 +41,9 @@ AUGMENTOR = "augmentor"
 
 class ImageMaskDatasetGenerator:
 
-  def __init__(self, config_file, dataset=TRAIN, seed=137):
+  # 2024/04 Added clean parameter, which is False for the worker processes of SharedMemoryImageMaskGenerator
+  # not to remove the debug images written by the other workers.
+  def __init__(self, config_file, dataset=TRAIN, seed=137, clean=True):
     random.seed = seed
 
     config = ConfigParser(config_file)
@@ -68,26 +74,20 @@ class ImageMaskDatasetGenerator:
     if dataset == EVAL:
       [image_datapath, mask_datapath] = self.eval_dataset
 
-    image_files  = glob.glob(image_datapath + "/*.jpg")
-    image_files += glob.glob(image_datapath + "/*.png")
-    image_files += glob.glob(image_datapath + "/*.bmp")
-    image_files += glob.glob(image_datapath + "/*.tif")
-    image_files  = sorted(image_files)
-
-    mask_files   = None
-    if os.path.exists(mask_datapath):
-      mask_files  = glob.glob(mask_datapath + "/*.jpg")
-      mask_files += glob.glob(mask_datapath + "/*.png")
-      mask_files += glob.glob(mask_datapath + "/*.bmp")
-      mask_files += glob.glob(mask_datapath + "/*.tif")
-      mask_files  = sorted(mask_files)
-      
-      if len(image_files) != len(mask_files):
-        raise Exception("FATAL: Images and masks unmatched")
-      
-    num_images  = len(image_files)
-    if num_images == 0:
-      raise Exception("FATAL: Not found image files")
+    # 2024/04 Read the prepared copy written by TensorflowUNetDatasetPreparer.py instead of
+    # the source files if it has been prepared with the same preprocessing as this generator.
+    self.prepared_dataset = PreparedDataset(config_file)
+    self.prepared = False
+    prepared_datapaths = self.prepared_dataset.find(dataset, image_datapath, mask_datapath, self.preprocessing())
+    if prepared_datapaths != None:
+      [image_datapath, mask_datapath] = prepared_datapaths
+      self.prepared = True
+
+    # 2024/04 Take the sorted image and mask pairs from a persistent DatasetIndex
+    # instead of globbing the directories.
+    index       = DatasetIndex(config_file, image_datapath, mask_datapath)
+    image_files = index.image_files()
+    mask_files  = index.mask_files()
     
     self.image_datapath = image_datapath
     self.mask_datapath  = mask_datapath
@@ -98,7 +98,7 @@ class ImageMaskDatasetGenerator:
     self.generated_masks_dir   = config.get(GENERATOR, "generated_masks_dir",  dvalue="./generated_masks_dir")
     self.debug                 = config.get(GENERATOR, "debug",        dvalue=True)
     self.augmentation          = config.get(GENERATOR, "augmentation", dvalue=True)
-    if self.debug:
+    if self.debug and clean:
       if os.path.exists(self.generated_images_dir):
         shutil.rmtree(self.generated_images_dir) 
       if not os.path.exists(self.generated_images_dir):
@@ -109,18 +109,31 @@ class ImageMaskDatasetGenerator:
       if not os.path.exists(self.generated_masks_dir):
         os.makedirs(self.generated_masks_dir) 
 
-    self.image_mask_augmentor = ImageMaskAugmentor(config_file)
+    # 2024/04 The seed decorrelates the augmentation of the workers of SharedMemoryImageMaskGenerator.
+    self.image_mask_augmentor = ImageMaskAugmentor(config_file, seed=seed)
+    # 2024/04 Cache of the preprocessed images and masks keyed by the files and this preprocessing config.
+    signature = (self.image_width, self.image_height, self.image_channels, "INTER_NEAREST",
+                 self.binarize, self.threshold, self.blur_mask, self.blur_size)
+    self.image_mask_cache = ImageMaskCache(config_file, signature)
+    # 2024/04 Write debug images of some sampled examples per epoch on a background thread.
+    steps_per_epoch = config.get(TRAIN, "steps_per_epoch", dvalue=400)
+    if dataset == EVAL:
+      steps_per_epoch = config.get(TRAIN, "validation_steps", dvalue=800)
+    self.debug_sink = DebugImageSink(config_file, steps_per_epoch * self.batch_size,
+                                     log_file="./generate_" + dataset + "_images.txt")
 
   
   def random_sampling(self, batch_size):
-    if batch_size < len(self.master_image_files):
-      images_sample = random.sample(self.master_image_files, batch_size)
+    # 2024/04 Sample the indices of the pairs, which have been paired by DatasetIndex.
+    num_images = len(self.master_image_files)
+    if batch_size < num_images:
+      numbers = sorted(random.sample(range(num_images), batch_size))
     else:
       print("==- batch_size > the number of master_image_files")
       #if batch_size > the number of maste_image_files
       # we cannot apply random.sample function.
       #images_sample = random.sample(self.master_image_files, len_samples)
-      images_sample = self.master_image_files
+      numbers = range(num_images)
       # Force augmentation to be True
       self.augmentation = True
     
@@ -128,16 +141,8 @@ class ImageMaskDatasetGenerator:
       self.image_mask_augmentor.hflip   = True
       self.image_mask_augmentor.vflip   = True
       
-    masks_sample  = []
-    for image_file in images_sample:
-      basename  = os.path.basename(image_file)
-      mask_file = os.path.join(self.mask_datapath, basename)
-      if os.path.exists(mask_file):
-        masks_sample.append(mask_file)
-      else:
-        raise Exception("Not found " + mask_file)
-    images_sample = sorted(images_sample)
-    masks_sample  = sorted(masks_sample)
+    images_sample = [self.master_image_files[i] for i in numbers]
+    masks_sample  = [self.master_mask_files[i]  for i in numbers]
     #print("  {}".format(images_sample))
     #print("  {}".format(masks_sample))
 
@@ -145,67 +150,135 @@ class ImageMaskDatasetGenerator:
 
   def generate(self):
     print("---ImageMaskDatasetGenerator.generate batch_size {}".format(self.batch_size))
-    with open("./generate_images.txt", "w", encoding="utf-8") as f:
-      while True:
-        (self.image_files, self.mask_files) = self.random_sampling(self.batch_size)
-
-        IMAGES = []
-        MASKS  = []
-        for n, image_file in enumerate(self.image_files):
-          mask_file = self.mask_files[n]
-          image_basename = os.path.basename(image_file)
-          mask_basename  = os.path.basename(mask_file)
-          #print("ImageMaskDatasetGenerator {} {} {}".format(n, image_basename, mask_basename))
-
-          f.writelines(str(n) + image_basename + "_" + mask_basename + "\n")
-          image = cv2.imread(image_file)
-          image = cv2.resize(image, dsize= (self.image_height, self.image_width), interpolation=cv2.INTER_NEAREST)
-          IMAGES.append(image)
-          if self.debug:
-            filepath = os.path.join(self.generated_images_dir, image_basename)
-            cv2.imwrite(filepath, image)
-          mask  = cv2.imread(mask_file)
-          mask  = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-          mask  = cv2.resize(mask, dsize= (self.image_height, self.image_width),   interpolation=cv2.INTER_NEAREST)
-
-          # Binarize mask
-          if self.binarize:
-            mask[mask< self.threshold] =   0  
-            mask[mask>=self.threshold] = 255
-
-          # Blur mask 
-          if self.blur_mask:
-            mask = cv2.blur(mask, self.blur_size)
-  
-          mask  = np.expand_dims(mask, axis=-1) 
-          #print("mask shape {}".format(mask.shape))
-          MASKS.append(mask)
-          if self.debug:
-            filepath = os.path.join(self.generated_masks_dir, mask_basename) 
-            cv2.imwrite(filepath, mask)
-          if self.augmentation:
-            self.image_mask_augmentor.augment(IMAGES, MASKS, image, mask,
-                                             self.generated_images_dir, image_basename,
-                                             self.generated_masks_dir,  mask_basename )
-        num_images = len(IMAGES)
-        numbers = [i for i in range(num_images)]
-        random.shuffle(numbers)
-        
-        if self.batch_size < num_images:
-          target_numbers = random.sample(numbers, self.batch_size)
-        else:
-          target_numbers = numbers
-
-        SELECTED_IMAGES = []
-        SELECTED_MASKS  = [] 
-        #print("--- target_numbers_len  {}  {}".format(len(target_numbers), target_numbers) )
-        for i in target_numbers:
-          SELECTED_IMAGES.append(IMAGES[i])
-          SELECTED_MASKS.append(MASKS[i])
-        
-        (X, Y) = self.convert(SELECTED_IMAGES, SELECTED_MASKS)
-        yield (X, Y)
+    batches = 0
+    while True:
+      (self.image_files, self.mask_files) = self.random_sampling(self.batch_size)
+
+      # 2024/04 Sample (image, augmentation operation) pairs first from all the pairs of
+      # the sampled images and operations, which are the same candidates of the batch as
+      # augmenting all the sampled images, and compute only the sampled pairs.
+      OPS = [None]
+      if self.augmentation:
+        OPS += self.image_mask_augmentor.operations()
+      num_candidates = len(self.image_files) * len(OPS)
+      numbers = [i for i in range(num_candidates)]
+      random.shuffle(numbers)
+      if self.batch_size < num_candidates:
+        target_numbers = random.sample(numbers, self.batch_size)
+      else:
+        target_numbers = numbers
+
+      # Read each sampled image once, and group the sampled pairs by the operations
+      # with their positions in target_numbers.
+      PAIRS      = {}
+      OP_SAMPLES = {}
+      for (position, i) in enumerate(target_numbers):
+        n = i // len(OPS)
+        if not n in PAIRS:
+          PAIRS[n] = self.read(self.image_files[n], self.mask_files[n])
+        OP_SAMPLES.setdefault(i % len(OPS), []).append((position, n))
+
+      SELECTED_IMAGES = [None] * len(target_numbers)
+      SELECTED_MASKS  = [None] * len(target_numbers)
+      #print("--- target_numbers_len  {}  {}".format(len(target_numbers), target_numbers) )
+      # 2024/04 Apply each operation to the stack of its sampled images and masks at once.
+      # They are put back in the order of target_numbers, so that the operations are interleaved
+      # in the batch as they were when each pair was augmented one by one.
+      for (k, samples) in OP_SAMPLES.items():
+        op     = OPS[k]
+        images = np.stack([PAIRS[n][0] for (position, n) in samples])
+        masks  = np.stack([PAIRS[n][1] for (position, n) in samples])
+        if op != None:
+          (images, masks) = self.image_mask_augmentor.apply_batch(op, images, masks)
+        for (j, (position, n)) in enumerate(samples):
+          SELECTED_IMAGES[position] = images[j]
+          SELECTED_MASKS[position]  = masks[j]
+          if self.debug and self.debug_sink.accept():
+            self.save(op, images[j], masks[j], self.image_files[n], self.mask_files[n])
+      
+      (X, Y) = self.convert(SELECTED_IMAGES, SELECTED_MASKS)
+      batches += 1
+      if self.image_mask_cache.enabled() and batches % 100 == 0:
+        print("--- ImageMaskCache {}".format(self.image_mask_cache.stats()))
+      if self.debug and batches % 100 == 0:
+        print("--- DebugImageSink {}".format(self.debug_sink.stats()))
+      yield (X, Y)
+
+
+  # Read an image and its mask, and append them and their augmented ones to IMAGES and MASKS.
+  def read_image_mask(self, IMAGES, MASKS, image_file, mask_file):
+    (image, mask) = self.read(image_file, mask_file)
+    OPS = [None]
+    if self.augmentation:
+      OPS += self.image_mask_augmentor.operations()
+    for op in OPS:
+      (augmented_image, augmented_mask) = (image, mask)
+      if op != None:
+        (augmented_image, augmented_mask) = self.image_mask_augmentor.apply(op, image, mask)
+      IMAGES.append(augmented_image)
+      MASKS.append(augmented_mask)
+      # Each augmented example is sampled by debug_sink as generate does.
+      if self.debug and self.debug_sink.accept():
+        self.save(op, augmented_image, augmented_mask, image_file, mask_file)
+
+  # Write the queued debug examples, and stop the writer thread of debug_sink.
+  def close(self):
+    self.debug_sink.close()
+
+  # Queue an example augmented by op (None for the original) to debug_sink.
+  def save(self, op, image, mask, image_file, mask_file):
+    prefix = ""
+    if op != None:
+      prefix = self.image_mask_augmentor.prefix(op)
+    image_basename = os.path.basename(image_file)
+    mask_basename  = os.path.basename(mask_file)
+    self.debug_sink.write(os.path.join(self.generated_images_dir, prefix + image_basename), image,
+                          os.path.join(self.generated_masks_dir,  prefix + mask_basename),  mask,
+                          line = prefix + image_basename + "_" + mask_basename)
+
+  # Read an image and its mask, and return the resized image and the preprocessed mask.
+  # They are taken from image_mask_cache if it has been enabled by [generator] cache.
+  def read(self, image_file, mask_file):
+    if not self.image_mask_cache.enabled():
+      return self.load_pair(image_file, mask_file)
+    key  = self.image_mask_cache.key(image_file, mask_file)
+    pair = self.image_mask_cache.get(key)
+    if pair is None:
+      pair = self.load_pair(image_file, mask_file)
+      self.image_mask_cache.put(key, pair[0], pair[1])
+    return pair
+
+  def load_pair(self, image_file, mask_file):
+    if self.prepared:
+      return self.prepared_dataset.read(image_file, mask_file)
+    return self.preprocess(image_file, mask_file)
+
+  # Return the preprocessing config of preprocess method as a dict for PreparedDataset.
+  def preprocessing(self):
+    return {"image_width": self.image_width, "image_height": self.image_height,
+            "image_channels": self.image_channels, "interpolation": cv2.INTER_NEAREST,
+            "binarize": self.binarize, "algorithm": None, "threshold": self.threshold,
+            "blur": self.blur_mask, "blur_size": self.blur_size}
+
+  def preprocess(self, image_file, mask_file):
+    image = cv2.imread(image_file)
+    image = cv2.resize(image, dsize= (self.image_height, self.image_width), interpolation=cv2.INTER_NEAREST)
+    mask  = cv2.imread(mask_file)
+    mask  = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+    mask  = cv2.resize(mask, dsize= (self.image_height, self.image_width),   interpolation=cv2.INTER_NEAREST)
+
+    # Binarize mask
+    if self.binarize:
+      mask[mask< self.threshold] =   0  
+      mask[mask>=self.threshold] = 255
+
+    # Blur mask 
+    if self.blur_mask:
+      mask = cv2.blur(mask, self.blur_size)
 
+    mask  = np.expand_dims(mask, axis=-1) 
+    #print("mask shape {}".format(mask.shape))
+    return (image, mask)
 
   def convert(self, IMAGES, MASKS):
     ilen = len(IMAGES)
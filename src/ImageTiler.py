@@ -0,0 +1,181 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ImageTiler.py
+#
+# NumPy-native tiling and stitching for TensorflowUNet.infer_tiles.
+#
+# This replaces the PIL based Image.crop, Image.paste and Image.new("L") operations.
+# 1 An input image is zero-padded once into a canvas which covers all the tiles,
+#   and each tile is taken from the canvas as a view (no copy).
+# 2 Predicted tile masks are stitched into one preallocated uint8 canvas
+#   by in-place slice assignment.
+# The tile boxes and margins are the same as the previous PIL implementation.
+#
+# Weighted blending:
+# Instead of cropping the margins off each tile mask and pasting the hard-edged center,
+# the soft probabilities of whole tiles can be accumulated into float accumulators
+# with a precomputed "gaussian" or "cosine" window weight, and normalized once at the end.
+
+import numpy as np
+import cv2
+
+class ImageTiler:
+
+  BLENDINGS = ["gaussian", "cosine"]
+
+  def __init__(self, split_size, margin=0):
+    self.split_size = split_size
+    self.margin     = margin
+    # Cache of window weights keyed by (cw, ch, blending)
+    self.windows    = {}
+
+  def split_nums(self, w, h):
+    vert_split_num  = h // self.split_size
+    if h % self.split_size != 0:
+      vert_split_num += 1
+
+    horiz_split_num = w // self.split_size
+    if w % self.split_size != 0:
+      horiz_split_num += 1
+    return (vert_split_num, horiz_split_num)
+
+  # Return a list of tile boxes (j, i, left, upper, left_margin, upper_margin, cw, ch)
+  # for an image of size (w, h).
+  def boxes(self, w, h):
+    MARGIN = self.margin
+    (vert_split_num, horiz_split_num) = self.split_nums(w, h)
+    boxes = []
+    for j in range(vert_split_num):
+      for i in range(horiz_split_num):
+        left  = self.split_size * i
+        upper = self.split_size * j
+        right = left  + self.split_size
+        lower = upper + self.split_size
+
+        if left >=w or upper >=h:
+          continue
+
+        left_margin  = MARGIN
+        upper_margin = MARGIN
+        if left-MARGIN <0:
+          left_margin = 0
+        if upper-MARGIN <0:
+          upper_margin = 0
+
+        right_margin = MARGIN
+        lower_margin = MARGIN
+        if right + right_margin > w:
+          right_margin = 0
+        if lower + lower_margin > h:
+          lower_margin = 0
+        cw = self.split_size + left_margin + right_margin
+        ch = self.split_size + upper_margin + lower_margin
+        boxes.append((j, i, left, upper, left_margin, upper_margin, cw, ch))
+    return boxes
+
+  # Return a zero-padded image which covers all the tiles of the image.
+  # The image itself is returned if no padding is needed.
+  def pad(self, image):
+    h, w = image.shape[:2]
+    (vert_split_num, horiz_split_num) = self.split_nums(w, h)
+    ph = vert_split_num  * self.split_size
+    pw = horiz_split_num * self.split_size
+    if ph == h and pw == w:
+      return image
+    padded = np.zeros((ph, pw) + image.shape[2:], dtype=image.dtype)
+    padded[:h, :w] = image
+    return padded
+
+  # Return a list of (box, tile) where each tile is a view of the padded image.
+  def split(self, image):
+    h, w   = image.shape[:2]
+    padded = self.pad(image)
+    tiles  = []
+    for box in self.boxes(w, h):
+      (j, i, left, upper, left_margin, upper_margin, cw, ch) = box
+      x = left  - left_margin
+      y = upper - upper_margin
+      tiles.append((box, padded[y:y+ch, x:x+cw]))
+    return tiles
+
+  def new_canvas(self, w, h, bgcolor=0, dtype=np.uint8):
+    return np.full((h, w), bgcolor, dtype=dtype)
+
+  # Stitch a tile mask of the model size into the canvas in-place.
+  # The mask is resized to the cropped size (cw, ch) of the box, and its margins are excluded.
+  def stitch(self, canvas, mask, box, interpolation=cv2.INTER_CUBIC):
+    (j, i, left, upper, left_margin, upper_margin, cw, ch) = box
+    height, width = mask.shape[:2]
+    mask = cv2.resize(mask, (cw, ch), interpolation=interpolation)
+
+    right_position = min(left_margin + width, cw)
+    bottom_position = min(upper_margin + height, ch)
+    # Clip the region to the canvas as Image.paste did.
+    H, W = canvas.shape[:2]
+    iw   = min(right_position  - left_margin,  W - left)
+    ih   = min(bottom_position - upper_margin, H - upper)
+    if iw <= 0 or ih <= 0:
+      return None
+    region = mask[upper_margin:upper_margin+ih, left_margin:left_margin+iw]
+    canvas[upper:upper+ih, left:left+iw] = region
+    return region
+
+  # Return a float32 window weight of shape (ch, cw) which is high at the center of a tile
+  # and low at its borders. 
+  def window(self, cw, ch, blending="gaussian"):
+    key = (cw, ch, blending)
+    if key in self.windows:
+      return self.windows[key]
+    if not blending in self.BLENDINGS:
+      raise Exception("Invalid blending " + str(blending))
+    def window1d(n):
+      x = np.arange(n, dtype=np.float32) + 0.5
+      if blending == "gaussian":
+        sigma = n / 4.0
+        return np.exp(-0.5 * ((x - n / 2.0) / sigma) ** 2)
+      else:
+        return np.sin(np.pi * x / n) 
+    weight = np.outer(window1d(ch), window1d(cw)).astype(np.float32)
+    # Keep a small positive weight at the borders, because the tiles at the image borders
+    # are the only ones covering their outer edges.
+    weight = np.maximum(weight / weight.max(), 1e-3)
+    self.windows[key] = weight
+    return weight
+
+  # Return a pair of float32 accumulators (probability, weight) covering all the tiles of an image of size (w, h).
+  def new_accumulators(self, w, h):
+    (vert_split_num, horiz_split_num) = self.split_nums(w, h)
+    ph = vert_split_num  * self.split_size
+    pw = horiz_split_num * self.split_size
+    return (np.zeros((ph, pw), dtype=np.float32), np.zeros((ph, pw), dtype=np.float32))
+
+  # Accumulate the soft probability of a whole tile (including its margins) weighted by the window.
+  def accumulate(self, accumulators, prob, box, blending="gaussian"):
+    (acc, weights) = accumulators
+    (j, i, left, upper, left_margin, upper_margin, cw, ch) = box
+    prob   = prob.reshape(prob.shape[:2]).astype(np.float32)
+    prob   = cv2.resize(prob, (cw, ch), interpolation=cv2.INTER_LINEAR)
+    weight = self.window(cw, ch, blending)
+    x = left  - left_margin
+    y = upper - upper_margin
+    acc    [y:y+ch, x:x+cw] += prob * weight
+    weights[y:y+ch, x:x+cw] += weight
+
+  # Normalize the accumulators once, and return a uint8 mask of size (w, h).
+  def normalize(self, accumulators, w, h, factor=255.0):
+    (acc, weights) = accumulators
+    prob = acc[:h, :w] / np.maximum(weights[:h, :w], 1e-6)
+    return np.clip(prob * factor, 0, 255).astype(np.uint8)
@@ -0,0 +1,120 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ImageTilerBenchmark.py
+#
+# Compare the per-image latency of the tiling and stitching part of infer_tiles
+# between the previous PIL crop/paste implementation and the NumPy ImageTiler.
+# Both of them crop and resize each tile to the model input as infer_tiles does, but the model
+# prediction is replaced by a fixed mask, so this measures only the split, resize, stitch
+# and conversion overhead.
+# The stitched canvases of the two implementations are compared before the timing.
+# PIL resizes the masks with an antialiased bicubic filter, and ImageTiler with
+# cv2.INTER_CUBIC, so that they differ by 1 or 2 levels on about a fifth of the pixels,
+# and the benchmark fails if the maximum difference exceeds the tolerance.
+#
+# Usage:
+# python ImageTilerBenchmark.py [image_width] [image_height] [split_size] [overlapping] [model_size] [tolerance]
+
+import sys
+import time
+import traceback
+import numpy as np
+import cv2
+from PIL import Image
+
+from ImageTiler import ImageTiler
+
+def pil2cv(image):
+  new_image = np.array(image, dtype=np.uint8)
+  if new_image.ndim == 3 and new_image.shape[2] == 3:
+    new_image = cv2.cvtColor(new_image, cv2.COLOR_RGB2BGR)
+  return new_image
+
+def pil_tiling(image, pred, split_size, MARGIN, size):
+  w, h = image.size
+  tiler = ImageTiler(split_size, margin=MARGIN)
+  background = Image.new("L", (w, h), 0)
+  inputs = []
+  for (j, i, left, upper, left_margin, upper_margin, cw, ch) in tiler.boxes(w, h):
+    cropbox = (left - left_margin, upper - upper_margin,
+               left - left_margin + cw, upper - upper_margin + ch)
+    # The model input of the tile as the previous infer_tiles, which is not predicted here.
+    cropped = image.crop(cropbox).resize((size, size))
+    inputs.append(pil2cv(cropped))
+    mask    = Image.fromarray((pred * 255.0).reshape([size, size]).astype(np.uint8)).convert("RGB")
+    mask    = mask.resize((cw, ch))
+    mask    = mask.crop((left_margin, upper_margin,
+                         min(left_margin + size, cw), min(upper_margin + size, ch)))
+    background.paste(mask, (left, upper))
+  return (pil2cv(background), inputs)
+
+def numpy_tiling(image, pred, split_size, MARGIN, size):
+  h, w = image.shape[:2]
+  tiler = ImageTiler(split_size, margin=MARGIN)
+  background = tiler.new_canvas(w, h, 0)
+  inputs = []
+  for (box, tile) in tiler.split(image):
+    # The model input of the tile as infer_tiles, which is not predicted here.
+    inputs.append(cv2.resize(tile, (size, size), interpolation=cv2.INTER_CUBIC))
+    mask    = (pred * 255.0).reshape([size, size]).astype(np.uint8)
+    tiler.stitch(background, mask, box)
+  return (background, inputs)
+
+def measure(func, image, pred, split_size, MARGIN, size, repeat=10):
+  func(image, pred, split_size, MARGIN, size)
+  start = time.perf_counter()
+  for i in range(repeat):
+    func(image, pred, split_size, MARGIN, size)
+  return (time.perf_counter() - start) / repeat
+
+if __name__ == "__main__":
+  try:
+    w, h, split_size, MARGIN, size, tolerance = 3840, 2160, 512, 32, 512, 2
+    args = [int(arg) for arg in sys.argv[1:]]
+    if len(args) == 5:
+      w, h, split_size, MARGIN, size = args
+    if len(args) == 6:
+      w, h, split_size, MARGIN, size, tolerance = args
+
+    rng     = np.random.default_rng(137)
+    cvimage = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+    pilimage= Image.fromarray(cv2.cvtColor(cvimage, cv2.COLOR_BGR2RGB))
+    # A smooth probability map like the predictions of the model. Random noise or binary
+    # masks have sharp edges, on which the two bicubic filters differ much more.
+    pred    = cv2.GaussianBlur(rng.random((size, size), dtype=np.float32), (0, 0), 8)
+    pred    = ((pred - pred.min()) / (pred.max() - pred.min())).reshape(size, size, 1)
+
+    (pil_canvas,   pil_inputs)   = pil_tiling(pilimage, pred, split_size, MARGIN, size)
+    (numpy_canvas, numpy_inputs) = numpy_tiling(cvimage, pred, split_size, MARGIN, size)
+    if len(pil_inputs) != len(numpy_inputs):
+      raise Exception("Unmatched number of tiles {} {}".format(len(pil_inputs), len(numpy_inputs)))
+    if pil_canvas.shape != numpy_canvas.shape:
+      raise Exception("Unmatched canvas shapes {} {}".format(pil_canvas.shape, numpy_canvas.shape))
+    difference = np.abs(pil_canvas.astype(np.int16) - numpy_canvas.astype(np.int16))
+    if difference.max() > tolerance:
+      raise Exception("Stitched canvases differ by {} > tolerance {}".format(difference.max(), tolerance))
+
+    pil_time   = measure(pil_tiling,   pilimage, pred, split_size, MARGIN, size)
+    numpy_time = measure(numpy_tiling, cvimage,  pred, split_size, MARGIN, size)
+    print("=== image {}x{} split_size {} overlapping {} model_size {}".format(w, h, split_size, MARGIN, size))
+    print("--- PIL   tiling {:.4f} sec per image".format(pil_time))
+    print("--- NumPy tiling {:.4f} sec per image".format(numpy_time))
+    print("--- speedup      {:.2f}x".format(pil_time / numpy_time))
+    print("--- canvas max difference {} (tolerance {}), differing pixels {:.1%}".format(
+          difference.max(), tolerance, np.count_nonzero(difference) / difference.size))
+  except:
+    traceback.print_exc()
+
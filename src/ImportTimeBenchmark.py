@@ -0,0 +1,106 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ImportTimeBenchmark.py
+#
+# Measure the startup import time of each entry point
+#  legacy  : importing all the model modules as the entry points did before ModelRegistry
+#  registry: importing only the model (and dataset) module named in a config file by ModelRegistry
+# Each measurement runs in a fresh Python process, and the best of some repeats is reported.
+#
+# Usage:
+# python ImportTimeBenchmark.py [./train_eval_infer.config] [repeat]
+
+import os
+import sys
+import subprocess
+import traceback
+
+from ConfigParser import ConfigParser
+
+MODEL   = "model"
+DATASET = "dataset"
+
+LEGACY_MODELS = ["TensorflowUNet", "TensorflowAttentionUNet", "TensorflowEfficientUNet",
+                 "TensorflowMultiResUNet", "TensorflowSwinUNet", "TensorflowTransUNet",
+                 "TensorflowUNet3Plus", "TensorflowU2Net", "TensorflowSharpUNet",
+                 "TensorflowDeepLabV3Plus", "TensorflowEfficientNetB7UNet"]
+
+# entry point -> (legacy dataset imports, whether the entry point resolves a dataset class)
+ENTRY_POINTS = {
+  "TensorflowUNetTrainer.py"          : (["ImageMaskDataset", "BaseImageMaskDataset"], True),
+  "TensorflowUNetGeneratorTrainer.py" : (["ImageMaskDataset", "ImageMaskDatasetGenerator"], False),
+  "TensorflowUNetEvaluator.py"        : (["ImageMaskDataset", "BaseImageMaskDataset"], True),
+  "TensorflowUNetInferencer.py"       : (["ImageMaskDataset"], False),
+  "TensorflowUNetTiledInferencer.py"  : (["ImageMaskDataset"], False),
+  "TensorflowUNetModelInspector.py"   : ([], False),
+}
+
+TIMER = "import time\nstart = time.perf_counter()\n{}\nprint(time.perf_counter() - start)\n"
+
+class ImportTimeBenchmark:
+
+  def __init__(self, config_file, repeat=3):
+    config = ConfigParser(config_file)
+    self.model_name   = config.get(MODEL,   "model",        dvalue="TensorflowUNet")
+    self.dataset_name = config.get(DATASET, "datasetclass", dvalue="ImageMaskDataset")
+    self.repeat   = repeat
+    self.src_dir  = os.path.dirname(os.path.abspath(__file__))
+
+  def measure(self, code):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = self.src_dir + os.pathsep + env.get("PYTHONPATH", "")
+    times = []
+    for i in range(self.repeat):
+      output = subprocess.run([sys.executable, "-c", TIMER.format(code)], env=env,
+                              capture_output=True, text=True, check=True).stdout
+      times.append(float(output.strip().split("\n")[-1]))
+    return min(times)
+
+  def legacy_code(self, datasets):
+    return "\n".join(["import " + name for name in datasets + LEGACY_MODELS])
+
+  def registry_code(self, datasets, uses_dataset_class):
+    lines = ["from ModelRegistry import get_model_class, get_dataset_class",
+             "get_model_class('{}')".format(self.model_name)]
+    if uses_dataset_class:
+      lines.append("get_dataset_class('{}')".format(self.dataset_name))
+    # Modules imported directly by the entry point, not by the registry.
+    lines += ["import " + name for name in datasets if name == "ImageMaskDatasetGenerator"]
+    return "\n".join(lines)
+
+  def run(self):
+    print("=== ImportTimeBenchmark model {} dataset {} repeat {}".format(
+          self.model_name, self.dataset_name, self.repeat))
+    print("{:36s} {:>10s} {:>10s} {:>10s}".format("entry_point", "legacy", "registry", "saved"))
+    for (entry_point, (datasets, uses_dataset_class)) in ENTRY_POINTS.items():
+      legacy   = self.measure(self.legacy_code(datasets))
+      registry = self.measure(self.registry_code(datasets, uses_dataset_class))
+      print("{:36s} {:9.2f}s {:9.2f}s {:9.2f}s".format(entry_point, legacy, registry, legacy - registry))
+
+
+if __name__ == "__main__":
+  try:
+    config_file = "./train_eval_infer.config"
+    repeat      = 3
+    if len(sys.argv) >= 2:
+      config_file = sys.argv[1]
+    if len(sys.argv) >= 3:
+      repeat = int(sys.argv[2])
+    benchmark = ImportTimeBenchmark(config_file, repeat=repeat)
+    benchmark.run()
+  except:
+    traceback.print_exc()
+
@@ -0,0 +1,121 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# InferencePipeline.py
+#
+# A three-stage decode -> predict -> encode pipeline for TensorflowUNet.infer.
+#
+# 1 A reader thread pool decodes and resizes the input image files.
+# 2 The calling thread stacks the decoded images into batches and runs predict_func.
+#   Keras models should be called from the thread which created them, so this stage
+#   never leaves the calling thread.
+# 3 A writer thread pool encodes and saves the predicted masks and merged images.
+#
+# The stages are connected by bounded queues, so that the number of images held in memory
+# is bounded by queue_size rather than by the number of input files.
+
+import threading
+import traceback
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+class InferencePipeline:
+
+  def __init__(self, readers=4, writers=2, queue_size=8):
+    self.readers    = max(1, readers)
+    self.writers    = max(1, writers)
+    self.queue_size = max(1, queue_size)
+    print("=== InferencePipeline readers {} writers {} queue_size {}".format(
+          self.readers, self.writers, self.queue_size))
+
+  # read_func(item)                 -> (image, context)
+  # predict_func([image, ...])      -> [prediction, ...]
+  # write_func(item, image, prediction, context)
+  def run(self, items, read_func, predict_func, write_func, batch_size=1):
+    batch_size = max(1, batch_size)
+    # Futures of the reader pool in the order of items.
+    decoded    = queue.Queue(maxsize=self.queue_size)
+    # Predicted results waiting for the writer pool.
+    predicted  = queue.Queue(maxsize=self.queue_size)
+    errors     = []
+    stop       = threading.Event()
+
+    reader_pool = ThreadPoolExecutor(max_workers=self.readers)
+
+    def feed():
+      try:
+        for item in items:
+          if stop.is_set():
+            break
+          # put blocks while the queue is full, which bounds the decoded images in memory.
+          decoded.put((item, reader_pool.submit(read_func, item)))
+      finally:
+        decoded.put(None)
+
+    def write():
+      while True:
+        task = predicted.get()
+        if task == None:
+          break
+        try:
+          (item, image, prediction, context) = task
+          write_func(item, image, prediction, context)
+        except Exception as ex:
+          traceback.print_exc()
+          errors.append(ex)
+
+    feeder  = threading.Thread(target=feed, daemon=True)
+    writers = [threading.Thread(target=write, daemon=True) for i in range(self.writers)]
+    feeder.start()
+    for writer in writers:
+      writer.start()
+
+    try:
+      finished = False
+      while not finished:
+        batch = []
+        while len(batch) < batch_size:
+          task = decoded.get()
+          if task == None:
+            finished = True
+            break
+          (item, future) = task
+          (image, context) = future.result()
+          batch.append((item, image, context))
+        if len(batch) == 0:
+          break
+        predictions = predict_func([image for (_, image, _) in batch])
+        for n, (item, image, context) in enumerate(batch):
+          predicted.put((item, image, predictions[n], context))
+    except:
+      stop.set()
+      # Drain the decoded queue to unblock the feeder thread.
+      while feeder.is_alive():
+        try:
+          decoded.get(timeout=0.1)
+        except queue.Empty:
+          pass
+      raise
+    finally:
+      for writer in writers:
+        predicted.put(None)
+      for writer in writers:
+        writer.join()
+      feeder.join()
+      reader_pool.shutdown(wait=True)
+
+    if len(errors) > 0:
+      raise Exception("InferencePipeline: {} write error(s), the first one is {}".format(len(errors), errors[0]))
+
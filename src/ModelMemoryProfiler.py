@@ -0,0 +1,161 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ModelMemoryProfiler.py
+#
+# Measure the peak memory and the training step time of the model of a config file
+# for each pair of [model] rematerialize mode and batch_size, and write a report
+# of memory vs step time to a CSV file.
+# Each measurement runs train_on_batch on random images and masks in a fresh Python process,
+# because the peak memory of a process never decreases, and an out-of-memory batch_size
+# is reported as failed instead of killing the profiler.
+#  peak_rss_mbytes  : peak resident memory of the process (ru_maxrss)
+#  train_rss_mbytes : increase of the peak resident memory by the training steps,
+#                     which is mostly the activation memory
+#  peak_gpu_mbytes  : peak memory of GPU:0 if any
+#
+# Example of the settings in [inspect] section.
+"""
+[inspect]
+memory_report       = True
+memory_report_modes = [[], ["decoder"]]
+memory_report_batch_sizes = [4, 8, 16]
+memory_report_steps = 5
+memory_report_csv   = "./memory_report.csv"
+"""
+# The models are measured with [runtime] execution = "function", which rematerialization requires.
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import configparser
+import traceback
+
+from ConfigParser import ConfigParser
+
+MODEL   = "model"
+RUNTIME = "runtime"
+INSPECT = "inspect"
+
+MEASURE = "from ModelMemoryProfiler import measure\nmeasure({!r}, {}, {})\n"
+
+# The body of a measurement process.
+def measure(config_file, batch_size, steps):
+  import time
+  import resource
+  import numpy as np
+  import tensorflow as tf
+  from RuntimePolicy import RuntimePolicy
+  from ModelRegistry import get_model_class
+
+  config = ConfigParser(config_file)
+  RuntimePolicy(config_file).apply()
+  ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+  model = ModelClass(config_file)
+  shape = (batch_size, config.get(MODEL, "image_height"), config.get(MODEL, "image_width"))
+  X = np.random.randint(0, 256, size=shape + (config.get(MODEL, "image_channels"),), dtype=np.uint8)
+  Y = np.random.randint(0, 2,   size=shape + (1,)).astype(bool)
+
+  # ru_maxrss is in kilobytes on Linux.
+  built_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  # The first step traces and compiles the training function.
+  model.model.train_on_batch(X, Y)
+  times = []
+  for i in range(steps):
+    start = time.perf_counter()
+    model.model.train_on_batch(X, Y)
+    times.append(time.perf_counter() - start)
+  peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+  peak_gpu = 0.0
+  if len(tf.config.list_physical_devices("GPU")) > 0:
+    peak_gpu = tf.config.experimental.get_memory_info("GPU:0")["peak"] / (1024 * 1024)
+  print(json.dumps({"step_sec": float(np.median(times)), "peak_rss_mbytes": peak_rss,
+                    "train_rss_mbytes": peak_rss - built_rss, "peak_gpu_mbytes": peak_gpu}))
+
+
+class ModelMemoryProfiler:
+
+  def __init__(self, config_file):
+    config = ConfigParser(config_file)
+    self.config_file = config_file
+    self.modes       = config.get(INSPECT, "memory_report_modes",       dvalue=[[], ["decoder"]])
+    self.batch_sizes = config.get(INSPECT, "memory_report_batch_sizes", dvalue=[4, 8, 16])
+    self.steps       = config.get(INSPECT, "memory_report_steps",       dvalue=5)
+    self.csv_file    = config.get(INSPECT, "memory_report_csv",         dvalue="./memory_report.csv")
+    self.src_dir     = os.path.dirname(os.path.abspath(__file__))
+
+  # Write a copy of the config file with the rematerialize mode to a temporary file.
+  def write_config(self, mode):
+    parser = configparser.ConfigParser()
+    parser.read(self.config_file)
+    for section in [MODEL, RUNTIME]:
+      if not parser.has_section(section):
+        parser.add_section(section)
+    parser.set(MODEL,   "rematerialize", json.dumps(mode))
+    parser.set(RUNTIME, "execution",     "\"function\"")
+    (fd, temp_file) = tempfile.mkstemp(suffix=".config", dir=".")
+    with os.fdopen(fd, "w") as f:
+      parser.write(f)
+    return temp_file
+
+  def run_measure(self, config_file, batch_size):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = self.src_dir + os.pathsep + env.get("PYTHONPATH", "")
+    code = MEASURE.format(config_file, batch_size, self.steps)
+    result = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True)
+    if result.returncode != 0:
+      return None
+    for line in reversed(result.stdout.strip().split("\n")):
+      if line.startswith("{"):
+        return json.loads(line)
+    # The model or the training step failed, for example, by out of memory.
+    return None
+
+  def run(self):
+    print("=== ModelMemoryProfiler modes {} batch_sizes {} steps {}".format(self.modes, self.batch_sizes, self.steps))
+    header = "rematerialize,batch_size,step_sec,images_per_sec,peak_rss_mbytes,train_rss_mbytes,peak_gpu_mbytes"
+    lines  = [header]
+    print(header)
+    for mode in self.modes:
+      config_file = self.write_config(mode)
+      try:
+        for batch_size in self.batch_sizes:
+          measured = self.run_measure(config_file, batch_size)
+          name = "+".join(mode) if len(mode) > 0 else "none"
+          if measured is None:
+            line = "{},{},failed,,,,".format(name, batch_size)
+          else:
+            line = "{},{},{:.3f},{:.2f},{:.0f},{:.0f},{:.0f}".format(name, batch_size,
+                    measured["step_sec"], batch_size / measured["step_sec"], measured["peak_rss_mbytes"],
+                    measured["train_rss_mbytes"], measured["peak_gpu_mbytes"])
+          print(line)
+          lines.append(line)
+      finally:
+        os.remove(config_file)
+    with open(self.csv_file, "w") as f:
+      f.write("\n".join(lines) + "\n")
+    print("=== Saved memory report as a csv_file {}".format(self.csv_file))
+
+
+if __name__ == "__main__":
+  try:
+    config_file = "./train_eval_infer.config"
+    if len(sys.argv) == 2:
+      config_file = sys.argv[1]
+    ModelMemoryProfiler(config_file).run()
+  except:
+    traceback.print_exc()
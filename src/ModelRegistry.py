@@ -0,0 +1,62 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ModelRegistry.py
+#
+# A registry of model and dataset classes which imports only the module
+# of the class named in a config file on demand.
+#
+# Previously each entry point imported all the model modules
+# (TensorflowSwinUNet, TensorflowTransUNet, TensorflowU2Net, ...) so that
+#   ModelClass = eval(config.get(MODEL, "model"))
+# could resolve one name. Now it is
+#   ModelClass = get_model_class(config.get(MODEL, "model"))
+
+import importlib
+
+# class name -> module name
+MODELS = {
+  "TensorflowUNet"               : "TensorflowUNet",
+  "TensorflowAttentionUNet"      : "TensorflowAttentionUNet",
+  "TensorflowEfficientUNet"      : "TensorflowEfficientUNet",
+  "TensorflowMultiResUNet"       : "TensorflowMultiResUNet",
+  "TensorflowSwinUNet"           : "TensorflowSwinUNet",
+  "TensorflowTransUNet"          : "TensorflowTransUNet",
+  "TensorflowUNet3Plus"          : "TensorflowUNet3Plus",
+  "TensorflowU2Net"              : "TensorflowU2Net",
+  "TensorflowSharpUNet"          : "TensorflowSharpUNet",
+  "TensorflowBASNet"             : "TensorflowBASNet",
+  "TensorflowDeepLabV3Plus"      : "TensorflowDeepLabV3Plus",
+  "TensorflowEfficientNetB7UNet" : "TensorflowEfficientNetB7UNet",
+  "TensorflowUNetInferenceModel" : "TensorflowUNetInferenceModel",
+}
+
+DATASETS = {
+  "ImageMaskDataset"     : "ImageMaskDataset",
+  "BaseImageMaskDataset" : "BaseImageMaskDataset",
+}
+
+def get_class(registry, name):
+  if not name in registry:
+    raise Exception("Unknown class name " + str(name) + " , registered classes are " + str(list(registry.keys())))
+  module = importlib.import_module(registry[name])
+  return getattr(module, name)
+
+def get_model_class(name):
+  return get_class(MODELS, name)
+
+def get_dataset_class(name):
+  return get_class(DATASETS, name)
+
@@ -0,0 +1,148 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# PreparedDataset.py
+#
+# An offline prepared copy of the train, eval and test datasets, which is written by
+# TensorflowUNetDatasetPreparer.py and detected by BaseImageMaskDataset and ImageMaskDatasetGenerator.
+#   output_dir/{dataset}_{key}/images/*.png : images resized to image_width x image_height
+#   output_dir/{dataset}_{key}/masks/*.png  : resized and preprocessed (binarized, blurred) grayscale masks
+#   output_dir/{dataset}_{key}/manifest.json: the source files with their content hashes,
+#                                             and the preprocessing config of the copy
+# where key is a hash of the preprocessing config, because ImageMaskDataset and
+# ImageMaskDatasetGenerator may resize the images with different interpolations.
+# The images and masks are written as PNG files of compression level 1, which are fast to decode.
+# A consumer uses the copy only if the source files and its preprocessing config are the same as
+# those of the manifest, otherwise it reads the source files as before.
+#
+# Example of the settings in [prepare] section.
+"""
+[prepare]
+output_dir      = "./prepared_dataset"
+png_compression = 1
+; Number of threads to read and write the files
+num_workers     = 8
+"""
+
+import os
+import glob
+import json
+import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+
+from ConfigParser import ConfigParser
+from DatasetIndex import DatasetIndex
+
+PREPARE = "prepare"
+VERSION = 2
+
+class PreparedDataset:
+
+  def __init__(self, config_file):
+    config = ConfigParser(config_file)
+    self.config_file     = config_file
+    self.output_dir      = config.get(PREPARE, "output_dir",      dvalue="./prepared_dataset")
+    self.png_compression = config.get(PREPARE, "png_compression", dvalue=1)
+    self.num_workers     = config.get(PREPARE, "num_workers",     dvalue=8)
+
+  def dir(self, dataset, preprocessing):
+    key = hashlib.sha1(json.dumps(self.normalize(preprocessing), sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return os.path.join(self.output_dir, dataset + "_" + key)
+
+  def dirs(self, dataset, preprocessing):
+    dir = self.dir(dataset, preprocessing)
+    return (os.path.join(dir, "images"), os.path.join(dir, "masks"))
+
+  def manifest_file(self, dataset, preprocessing):
+    return os.path.join(self.dir(dataset, preprocessing), "manifest.json")
+
+  def sources(self, index):
+    return [[image["sha1"], mask["sha1"]] for (image, mask) in index.pairs]
+
+  # Return (image_datapath, mask_datapath) of the prepared copy of the source datapaths,
+  # if it has been prepared with the preprocessing config of the preprocessing dict, or None.
+  def find(self, dataset, image_datapath, mask_datapath, preprocessing, ordered=False):
+    manifest_file = self.manifest_file(dataset, preprocessing)
+    if not os.path.exists(manifest_file):
+      return None
+    with open(manifest_file, "r", encoding="utf-8") as f:
+      manifest = json.load(f)
+    if manifest.get("version") != VERSION or manifest["preprocessing"] != self.normalize(preprocessing):
+      print("=== PreparedDataset {} has another preprocessing config, not used".format(manifest_file))
+      return None
+    index = DatasetIndex(self.config_file, image_datapath, mask_datapath, ordered=ordered)
+    if manifest["image_datapath"] != index.image_datapath or manifest["sources"] != self.sources(index):
+      print("=== PreparedDataset {} is out of date, not used".format(manifest_file))
+      return None
+    (images_dir, masks_dir) = self.dirs(dataset, preprocessing)
+    for dir in [images_dir, masks_dir]:
+      if len(glob.glob(os.path.join(dir, "*.png"))) != len(manifest["sources"]):
+        print("=== PreparedDataset {} has unmatched files in {}, not used".format(manifest_file, dir))
+        return None
+    print("=== Using PreparedDataset {}".format(manifest_file))
+    return (images_dir, masks_dir)
+
+  # Make a preprocessing dict comparable with the one loaded from a manifest.
+  def normalize(self, preprocessing):
+    return json.loads(json.dumps(preprocessing))
+
+  # Write the prepared copy of the source datapaths by read_pair function of a consumer,
+  # which returns the resized image and the preprocessed mask of an image file and a mask file.
+  def prepare(self, dataset, image_datapath, mask_datapath, preprocessing, read_pair, ordered=False):
+    (images_dir, masks_dir) = self.dirs(dataset, preprocessing)
+    manifest_file = self.manifest_file(dataset, preprocessing)
+    # Remove the manifest first, so that an interrupted preparation is never used.
+    if os.path.exists(manifest_file):
+      os.remove(manifest_file)
+    # Remove the files of a previous preparation, which may have other source files.
+    for dir in [images_dir, masks_dir]:
+      if os.path.exists(dir):
+        shutil.rmtree(dir)
+      os.makedirs(dir)
+
+    index       = DatasetIndex(self.config_file, image_datapath, mask_datapath, ordered=ordered)
+    image_files = index.image_files()
+    mask_files  = index.mask_files()
+    params = [cv2.IMWRITE_PNG_COMPRESSION, self.png_compression]
+
+    def write(image_file, mask_file):
+      (image, mask) = read_pair(image_file, mask_file)
+      # The mask is saved with the basename of the image to be paired by DatasetIndex.
+      # The basename keeps the extension of the image, so that a.jpg and a.bmp are not overwritten.
+      name = os.path.basename(image_file) + ".png"
+      cv2.imwrite(os.path.join(images_dir, name), image, params)
+      cv2.imwrite(os.path.join(masks_dir,  name), mask,  params)
+
+    # cv2 releases the GIL, so that the files are read and written by threads in parallel.
+    with ThreadPoolExecutor(max_workers=max(1, self.num_workers)) as executor:
+      for n, _ in enumerate(executor.map(write, image_files, mask_files)):
+        if (n + 1) % 100 == 0:
+          print("--- Prepared {}/{}".format(n + 1, len(image_files)))
+
+    manifest = {"version": VERSION, "dataset": dataset,
+                "image_datapath": index.image_datapath, "mask_datapath": index.mask_datapath,
+                "preprocessing": self.normalize(preprocessing), "sources": self.sources(index)}
+    with open(manifest_file, "w", encoding="utf-8") as f:
+      json.dump(manifest, f, indent=1)
+    print("=== Prepared {} images of {} in {}".format(len(image_files), dataset, os.path.dirname(manifest_file)))
+
+  # Read a prepared image and mask, which need no resizing and no preprocessing.
+  def read(self, image_file, mask_file):
+    image = cv2.imread(image_file, cv2.IMREAD_COLOR)
+    mask  = cv2.imread(mask_file,  cv2.IMREAD_GRAYSCALE)
+    return (image, np.expand_dims(mask, axis=-1))
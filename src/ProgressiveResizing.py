@@ -0,0 +1,95 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# ProgressiveResizing.py
+#
+# A progressive resizing schedule of TensorflowUNet.train.
+# The model is trained on smaller images in the first stages, and on the images of
+# [model] image_width x image_height in the last stage. For each stage, TensorflowUNet
+# rebuilds the fully convolutional model of the stage size, and carries the weights of
+# the previous stage over, and the batches of the generators or the arrays of the dataset
+# are resized to the stage size.
+#
+# Example of the settings in [train] section.
+"""
+[train]
+epochs = 100
+; (size, epochs) of the stages before the last stage, in which the remaining epochs run at
+; [model] image_width x image_height. A size is an int for a square or (width, height).
+progressive_resizing = [(256, 10), (384, 10)]
+"""
+# The sizes should be multiples of 32 for the five downsamplings of the UNet encoders.
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from ConfigParser import ConfigParser
+
+MODEL = "model"
+TRAIN = "train"
+
+class ProgressiveResizing:
+
+  def __init__(self, config_file):
+    config = ConfigParser(config_file)
+    self.image_width  = config.get(MODEL, "image_width")
+    self.image_height = config.get(MODEL, "image_height")
+    self.epochs       = config.get(TRAIN, "epochs")
+    self.schedule     = config.get(TRAIN, "progressive_resizing", dvalue=[])
+
+  # Return a list of (width, height, initial_epoch, epochs) of the stages before the last stage,
+  # where initial_epoch and epochs are the parameters of model.fit of the stage.
+  def stages(self):
+    stages = []
+    epoch  = 0
+    for (size, epochs) in self.schedule:
+      (width, height) = (size, size)
+      if isinstance(size, (list, tuple)):
+        (width, height) = size
+      if width % 32 != 0 or height % 32 != 0:
+        raise Exception("[train] progressive_resizing size should be a multiple of 32 " + str(size))
+      stages.append((width, height, epoch, min(epoch + epochs, self.epochs)))
+      epoch += epochs
+    if epoch >= self.epochs:
+      raise Exception("[train] progressive_resizing leaves no epoch for the last stage")
+    return stages
+
+  # Return the batches of a Python generator or a tf.data.Dataset resized to width x height.
+  def resize_batches(self, batches, width, height):
+    if isinstance(batches, tf.data.Dataset):
+      return batches.map(lambda X, Y: self.resize_tensors(X, Y, width, height),
+                         num_parallel_calls=tf.data.AUTOTUNE)
+    return self.generate(batches, width, height)
+
+  def generate(self, batches, width, height):
+    for (X, Y) in batches:
+      yield self.resize_arrays(X, Y, width, height)
+
+  def resize_tensors(self, X, Y, width, height):
+    X = tf.cast(tf.image.resize(X, (height, width), method="area"), tf.uint8)
+    Y = tf.image.resize(tf.cast(Y, tf.uint8), (height, width), method="nearest") > 0
+    return (X, Y)
+
+  # Resize uint8 images X and bool masks Y of the model size to width x height.
+  def resize_arrays(self, X, Y, width, height):
+    RX = np.zeros((len(X), height, width, X.shape[-1]), dtype=np.uint8)
+    RY = np.zeros((len(Y), height, width, 1), dtype=bool)
+    for i in range(len(X)):
+      image = cv2.resize(X[i], (width, height), interpolation=cv2.INTER_AREA)
+      mask  = cv2.resize(Y[i].astype(np.uint8), (width, height), interpolation=cv2.INTER_NEAREST)
+      RX[i] = image.reshape(height, width, -1)
+      RY[i] = mask.reshape(height, width, 1) > 0
+    return (RX, RY)
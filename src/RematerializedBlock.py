@@ -0,0 +1,94 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# RematerializedBlock.py
+#
+# A Keras layer which runs a block function of some layers under tf.recompute_grad.
+# The intermediate activations of the block are not kept for the backward pass, but
+# recomputed from the inputs of the block when its gradients are computed, which trades
+# one more forward pass of the block for the activation memory of it.
+#
+# The layers of the block are the layers of a model created without rematerialization,
+# and RematerializedModel, of which outputs are computed through the blocks, saves and loads
+# the weights of that model, so that the checkpoints have the same layout with and without
+# rematerialization.
+#
+# Notes:
+#  - tf.recompute_grad requires TF2 behavior, [runtime] execution = "function" or "eager".
+#  - The BatchNormalization layers of the block update their moving statistics only in the
+#    forward pass, and not in the recomputation of the backward pass.
+
+import tensorflow as tf
+
+class RematerializedBlock(tf.keras.layers.Layer):
+
+  # block is a function of a list of input tensors and training, which calls block_layers.
+  def __init__(self, block, block_layers, **kwargs):
+    super().__init__(**kwargs)
+    self.block        = block
+    self.block_layers = block_layers
+
+  def call(self, inputs, training=None):
+    if not isinstance(inputs, (list, tuple)):
+      inputs = [inputs]
+    # forward is called by the forward pass first, and called again by the gradient function
+    # of tf.recompute_grad to recompute the activations.
+    calls = [0]
+    def forward(*args):
+      calls[0] += 1
+      if calls[0] == 1:
+        return self.block(list(args), training)
+      return self.recompute(list(args), training)
+    return tf.recompute_grad(forward)(*inputs)
+
+  # Run the block with the momentum 1.0 of the BatchNormalization layers, which normalize
+  # the batch by its statistics as the forward pass, but keep their moving statistics.
+  def recompute(self, inputs, training):
+    batch_norms = [layer for layer in self.block_layers
+                   if isinstance(layer, tf.keras.layers.BatchNormalization)]
+    momentums   = [layer.momentum for layer in batch_norms]
+    for layer in batch_norms:
+      layer.momentum = 1.0
+    try:
+      return self.block(inputs, training)
+    finally:
+      for (layer, momentum) in zip(batch_norms, momentums):
+        layer.momentum = momentum
+
+
+# A plain Python object which Keras never tracks, to keep the model without rematerialization
+# out of the layers of RematerializedModel.
+class PlainModelHolder:
+
+  def __init__(self, model):
+    self.model = model
+
+
+# A functional model of which outputs are computed through RematerializedBlocks sharing the
+# layers of a model without rematerialization, which save, save_weights and load_weights use.
+class RematerializedModel(tf.keras.Model):
+
+  def __init__(self, inputs, outputs, plain_model, name=None):
+    super().__init__(inputs=inputs, outputs=outputs, name=name)
+    self.plain = PlainModelHolder(plain_model)
+
+  def save(self, *args, **kwargs):
+    return self.plain.model.save(*args, **kwargs)
+
+  def save_weights(self, *args, **kwargs):
+    return self.plain.model.save_weights(*args, **kwargs)
+
+  def load_weights(self, *args, **kwargs):
+    return self.plain.model.load_weights(*args, **kwargs)
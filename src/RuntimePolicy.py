@@ -0,0 +1,104 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# RuntimePolicy.py
+#
+# TensorFlow threading and execution-mode policy read from [runtime] section of a config file.
+# This replaces the following hard-coded settings at import time of TensorflowUNet.py
+#   tf.compat.v1.disable_eager_execution()
+#   tf.config.threading.set_inter_op_parallelism_threads(1)
+#   tf.config.threading.set_intra_op_parallelism_threads(1)
+# The default values below keep those settings.
+"""
+[runtime]
+; "graph"   : tf.compat.v1 graph mode (disable_eager_execution)
+; "function": eager mode, and Keras runs train/predict steps as tf.function
+; "eager"   : eager mode, and Keras runs train/predict steps eagerly (for debugging)
+execution        = "graph"
+; Number of threads, 0 means the number of the CPU cores decided by TensorFlow.
+intra_op_threads = 1
+inter_op_threads = 1
+; XLA JIT compilation
+jit_compile      = False
+; Deterministic mode for reproducibility runs: single thread, deterministic ops and no XLA
+deterministic    = False
+"""
+# The policy must be applied before any model is constructed, because TensorFlow cannot
+# change the threading and execution mode once its runtime has been initialized.
+
+import os
+import traceback
+import tensorflow as tf
+
+from ConfigParser import ConfigParser
+
+RUNTIME    = "runtime"
+EXECUTIONS = ["graph", "function", "eager"]
+
+class RuntimePolicy:
+  # The policy is applied only once in a process.
+  applied = None
+
+  def __init__(self, config_file):
+    config = ConfigParser(config_file)
+    self.execution        = config.get(RUNTIME, "execution",        dvalue="graph")
+    self.intra_op_threads = config.get(RUNTIME, "intra_op_threads", dvalue=1)
+    self.inter_op_threads = config.get(RUNTIME, "inter_op_threads", dvalue=1)
+    self.jit_compile      = config.get(RUNTIME, "jit_compile",      dvalue=False)
+    self.deterministic    = config.get(RUNTIME, "deterministic",    dvalue=False)
+    if not self.execution in EXECUTIONS:
+      raise Exception("Invalid [runtime] execution " + str(self.execution))
+
+    if self.deterministic:
+      self.intra_op_threads = 1
+      self.inter_op_threads = 1
+      self.jit_compile      = False
+
+  def apply(self):
+    if RuntimePolicy.applied != None:
+      return RuntimePolicy.applied
+    print("=== RuntimePolicy execution {} intra_op_threads {} inter_op_threads {} jit_compile {} deterministic {}".format(
+          self.execution, self.intra_op_threads, self.inter_op_threads, self.jit_compile, self.deterministic))
+
+    if self.deterministic:
+      os.environ['TF_DETERMINISTIC_OPS']   = '1'
+      os.environ['TF_CUDNN_DETERMINISTIC'] = '1'
+      if hasattr(tf.config.experimental, "enable_op_determinism"):
+        tf.config.experimental.enable_op_determinism()
+    try:
+      # See https://www.tensorflow.org/api_docs/python/tf/config/threading/set_intra_op_parallelism_threads
+      tf.config.threading.set_inter_op_parallelism_threads(self.inter_op_threads)
+      tf.config.threading.set_intra_op_parallelism_threads(self.intra_op_threads)
+    except RuntimeError:
+      print("=== WARNING: RuntimePolicy could not set the threads, TensorFlow runtime has already been initialized")
+      traceback.print_exc()
+
+    if self.execution == "graph":
+      tf.compat.v1.disable_eager_execution()
+
+    if self.jit_compile:
+      # In graph mode, this enables XLA auto-clustering of the session.
+      tf.config.optimizer.set_jit(True)
+    RuntimePolicy.applied = self
+    return self
+
+  # Keyword arguments for tf.keras.Model.compile.
+  def compile_options(self):
+    if self.execution == "eager":
+      return {"run_eagerly": True}
+    if self.execution == "function" and self.jit_compile:
+      return {"jit_compile": True}
+    return {}
+
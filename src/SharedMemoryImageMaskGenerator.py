@@ -0,0 +1,239 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# SharedMemoryImageMaskGenerator.py
+#
+# A multi-process version of ImageMaskDatasetGenerator.
+# ImageMaskDatasetGenerator.generate runs on one core of the training process.
+# This starts num_workers processes, each of which runs ImageMaskDatasetGenerator.generate
+# with its own seed, and writes the finished (X, Y) batches into a ring of
+# multiprocessing.shared_memory slots.
+#
+# With [runtime] execution = "graph", the training process yields the batches as views of
+# the slots without copying them. A yielded slot is given back to the workers only after hold
+# more batches have been yielded, because the Keras GeneratorEnqueuer of the graph mode model.fit
+# keeps up to max_queue_size (10) batches ahead of the training step, so that hold must be
+# larger than 10.
+# With execution = "function" or "eager", model.fit feeds the generator through
+# tf.data.Dataset.from_generator and its prefetch, of which tensors may share the memory of
+# the yielded arrays, and the number of batches in flight is not bounded by hold. The batches
+# are yielded as copies of the slots in these modes, so that a worker never overwrites a batch
+# which has not been trained on.
+# A slot holds up to batch_size images and masks, and a shorter batch fills the head of the slot,
+# of which length is passed to the training process with the slot.
+#
+# You can select this by the following setting in [generator] section.
+"""
+[generator]
+loader      = "shared_memory"
+num_workers = 4
+; Number of slots of the ring, 0 means num_workers * 2 + hold
+ring_size   = 0
+hold        = 12
+"""
+
+import os
+import sys
+import time
+import queue
+import random
+import atexit
+import traceback
+import numpy as np
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+from ConfigParser import ConfigParser
+
+MODEL     = "model"
+TRAIN     = "train"
+RUNTIME   = "runtime"
+EVAL      = "eval"
+GENERATOR = "generator"
+
+# The default max_queue_size of the GeneratorEnqueuer of model.fit
+ENQUEUER_QUEUE_SIZE = 10
+
+# The body of a worker process.
+def run_worker(config_file, dataset, seed, worker_id, x_names, y_names, x_shape, y_shape,
+               free_slots, ready_slots):
+  from ImageMaskDatasetGenerator import ImageMaskDatasetGenerator
+  random.seed(seed)
+  np.random.seed(seed)
+  generator = ImageMaskDatasetGenerator(config_file, dataset=dataset, seed=seed, clean=False)
+  # Only the first worker writes the debug images.
+  generator.debug = generator.debug and worker_id == 0
+  x_shms = [shared_memory.SharedMemory(name=name) for name in x_names]
+  y_shms = [shared_memory.SharedMemory(name=name) for name in y_names]
+  batches = generator.generate()
+  while True:
+    slot = free_slots.get()
+    if slot is None:
+      break
+    start  = time.perf_counter()
+    (X, Y) = next(batches)
+    length = len(X)
+    np.ndarray(x_shape, dtype=np.uint8, buffer=x_shms[slot].buf)[:length] = X
+    np.ndarray(y_shape, dtype=bool,     buffer=y_shms[slot].buf)[:length] = Y
+    ready_slots.put((slot, worker_id, length, time.perf_counter() - start))
+  for shm in x_shms + y_shms:
+    shm.close()
+  generator.close()
+
+
+class SharedMemoryImageMaskGenerator:
+
+  def __init__(self, config_file, dataset=TRAIN, seed=137):
+    config = ConfigParser(config_file)
+    self.config_file    = config_file
+    self.dataset        = dataset
+    self.seed           = seed
+    self.image_width    = config.get(MODEL, "image_width")
+    self.image_height   = config.get(MODEL, "image_height")
+    self.image_channels = config.get(MODEL, "image_channels")
+    self.batch_size     = config.get(TRAIN, "batch_size")
+    self.num_workers    = config.get(GENERATOR, "num_workers", dvalue=4)
+    self.hold           = config.get(GENERATOR, "hold",        dvalue=12)
+    self.ring_size      = config.get(GENERATOR, "ring_size",   dvalue=0)
+    # The views of the slots are yielded without copying only in the graph mode.
+    self.zero_copy      = config.get(RUNTIME, "execution", dvalue="graph") == "graph"
+    if self.ring_size <= 0:
+      self.ring_size = self.num_workers * 2 + self.hold
+    if self.hold <= ENQUEUER_QUEUE_SIZE:
+      raise Exception("[generator] hold must be larger than the queue size {} of model.fit".format(
+                      ENQUEUER_QUEUE_SIZE))
+    if self.ring_size <= self.hold:
+      raise Exception("[generator] ring_size must be larger than hold")
+
+    self.x_shape = (self.batch_size, self.image_height, self.image_width, self.image_channels)
+    self.y_shape = (self.batch_size, self.image_height, self.image_width, 1)
+    self.x_shms  = []
+    self.y_shms  = []
+    self.workers = []
+    # Per worker statistics
+    self.batches = [0] * self.num_workers
+    self.seconds = [0.0] * self.num_workers
+    self.waited  = 0.0
+    self.started = None
+
+  def start(self):
+    # Create the directories of the debug images and clear them only once in this process.
+    from ImageMaskDatasetGenerator import ImageMaskDatasetGenerator
+    ImageMaskDatasetGenerator(self.config_file, dataset=self.dataset, seed=self.seed)
+
+    x_bytes = int(np.prod(self.x_shape))
+    y_bytes = int(np.prod(self.y_shape))
+    for i in range(self.ring_size):
+      self.x_shms.append(shared_memory.SharedMemory(create=True, size=x_bytes))
+      self.y_shms.append(shared_memory.SharedMemory(create=True, size=y_bytes))
+    atexit.register(self.close)
+
+    # Spawn the workers, because forking a process which has initialized TensorFlow is unsafe.
+    context = mp.get_context("spawn")
+    self.free_slots  = context.Queue()
+    self.ready_slots = context.Queue()
+    for slot in range(self.ring_size - self.hold):
+      self.free_slots.put(slot)
+    # The hold slots are given to the workers as the yielded slots are released.
+    self.spare_slots = list(range(self.ring_size - self.hold, self.ring_size))
+    for worker_id in range(self.num_workers):
+      worker = context.Process(target=run_worker, daemon=True,
+                 args=(self.config_file, self.dataset, self.seed + worker_id, worker_id,
+                       [shm.name for shm in self.x_shms], [shm.name for shm in self.y_shms],
+                       self.x_shape, self.y_shape, self.free_slots, self.ready_slots))
+      worker.start()
+      self.workers.append(worker)
+    self.started = time.perf_counter()
+
+  def generate(self):
+    print("---SharedMemoryImageMaskGenerator.generate batch_size {} num_workers {} ring_size {} hold {} zero_copy {}".format(
+          self.batch_size, self.num_workers, self.ring_size, self.hold, self.zero_copy))
+    if self.started is None:
+      self.start()
+    yielded = []
+    n = 0
+    while True:
+      start = time.perf_counter()
+      (slot, worker_id, length, seconds) = self.ready_slots.get()
+      self.waited += time.perf_counter() - start
+      self.batches[worker_id] += 1
+      self.seconds[worker_id] += seconds
+
+      X = np.ndarray(self.x_shape, dtype=np.uint8, buffer=self.x_shms[slot].buf)[:length]
+      Y = np.ndarray(self.y_shape, dtype=bool,     buffer=self.y_shms[slot].buf)[:length]
+      if not self.zero_copy:
+        (X, Y) = (np.array(X), np.array(Y))
+      yielded.append(slot)
+      if len(yielded) > self.hold:
+        self.free_slots.put(yielded.pop(0))
+      elif len(self.spare_slots) > 0:
+        self.free_slots.put(self.spare_slots.pop())
+      n += 1
+      if n % 100 == 0:
+        print("--- SharedMemoryImageMaskGenerator {}".format(self.stats()))
+      yield (X, Y)
+
+  def stats(self):
+    elapsed = time.perf_counter() - self.started
+    workers = []
+    for i in range(self.num_workers):
+      rate = 0.0
+      if self.seconds[i] > 0:
+        rate = round(self.batches[i] / self.seconds[i], 2)
+      workers.append({"worker": i, "batches": self.batches[i], "batches_per_sec": rate})
+    try:
+      depth = self.ready_slots.qsize()
+    except NotImplementedError:
+      # qsize is not implemented on macOS.
+      depth = -1
+    return {"batches_per_sec": round(sum(self.batches) / elapsed, 2), "queue_depth": depth,
+            "consumer_wait_sec": round(self.waited, 2), "workers": workers}
+
+  # Stop the workers, which write their queued debug images, and free the slots.
+  def close(self):
+    if len(self.workers) > 0:
+      # Take the free slots back, so that the workers get None next.
+      try:
+        while True:
+          self.free_slots.get_nowait()
+      except queue.Empty:
+        pass
+    for worker in self.workers:
+      self.free_slots.put(None)
+    for worker in self.workers:
+      worker.join(timeout=10)
+      if worker.is_alive():
+        worker.terminate()
+    self.workers = []
+    for shm in self.x_shms + self.y_shms:
+      shm.close()
+      shm.unlink()
+    self.x_shms = []
+    self.y_shms = []
+
+
+if __name__ == "__main__":
+  try:
+    config_file = "./train_eval_infer.config"
+    if len(sys.argv) == 2:
+      config_file = sys.argv[1]
+    generator = SharedMemoryImageMaskGenerator(config_file, dataset=TRAIN)
+    batches   = generator.generate()
+    for i in range(200):
+      (X, Y) = next(batches)
+    print(generator.stats())
+    generator.close()
+  except:
+    traceback.print_exc()
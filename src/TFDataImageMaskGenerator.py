@@ -0,0 +1,124 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TFDataImageMaskGenerator.py
+#
+# A tf.data version of ImageMaskDatasetGenerator.
+# ImageMaskDatasetGenerator.generate runs file I/O, decoding, resizing and augmentation
+# on the training thread. This runs them in a parallel map of a tf.data pipeline, and
+# prefetches the batches, so that they overlap with the training step.
+#
+# The batches have the same semantics as ImageMaskDatasetGenerator.generate:
+#  each image file is read with its mask and augmented by ImageMaskAugmentor,
+#  the original and augmented pairs are shuffled, and batch_size pairs of them make a batch
+#   X: uint8 [batch_size, image_height, image_width, image_channels]
+#   Y: bool  [batch_size, image_height, image_width, 1]
+#
+# You can select this by the following setting in [generator] section.
+"""
+[generator]
+loader             = "tf.data"
+; 0 means tf.data.AUTOTUNE
+num_parallel_calls = 0
+; 0 means batch_size * 16
+shuffle_buffer     = 0
+seed               = 137
+; Keep the order of the parallel map results to reproduce the same batches by the seed
+deterministic      = False
+"""
+
+import os
+import sys
+import numpy as np
+import traceback
+
+import tensorflow as tf
+
+from ConfigParser import ConfigParser
+from ImageMaskDatasetGenerator import ImageMaskDatasetGenerator
+
+MODEL     = "model"
+TRAIN     = "train"
+EVAL      = "eval"
+GENERATOR = "generator"
+
+class TFDataImageMaskGenerator(ImageMaskDatasetGenerator):
+
+  def __init__(self, config_file, dataset=TRAIN, seed=137):
+    super().__init__(config_file, dataset=dataset, seed=seed)
+    config = ConfigParser(config_file)
+    self.num_parallel_calls = config.get(GENERATOR, "num_parallel_calls", dvalue=0)
+    self.shuffle_buffer     = config.get(GENERATOR, "shuffle_buffer",     dvalue=0)
+    self.seed               = config.get(GENERATOR, "seed",               dvalue=seed)
+    self.deterministic      = config.get(GENERATOR, "deterministic",      dvalue=False)
+    if self.num_parallel_calls <= 0:
+      self.num_parallel_calls = tf.data.AUTOTUNE
+    if self.shuffle_buffer <= 0:
+      self.shuffle_buffer = self.batch_size * 16
+
+    # The masks have been paired with the images by DatasetIndex.
+    self.mask_files = self.master_mask_files
+
+  # Read an image file and its mask file, and return the original and augmented pairs of them.
+  def load(self, image_file, mask_file):
+    IMAGES = []
+    MASKS  = []
+    self.read_image_mask(IMAGES, MASKS, image_file.decode("utf-8"), mask_file.decode("utf-8"))
+    return self.convert(IMAGES, MASKS)
+
+  def load_map(self, image_file, mask_file):
+    (X, Y) = tf.numpy_function(self.load, [image_file, mask_file], [tf.uint8, tf.bool])
+    X.set_shape([None, self.image_height, self.image_width, self.image_channels])
+    Y.set_shape([None, self.image_height, self.image_width, 1])
+    return tf.data.Dataset.from_tensor_slices((X, Y))
+
+  def create(self):
+    print("---TFDataImageMaskGenerator.create batch_size {} num_parallel_calls {} shuffle_buffer {} seed {} deterministic {}".format(
+          self.batch_size, self.num_parallel_calls, self.shuffle_buffer, self.seed, self.deterministic))
+    files = tf.data.Dataset.from_tensor_slices((self.master_image_files, self.mask_files))
+    files = files.shuffle(len(self.master_image_files), seed=self.seed, reshuffle_each_iteration=True)
+    files = files.repeat()
+    # Each file pair is expanded to the original and augmented pairs, and they are interleaved
+    # from num_parallel_calls files loaded in parallel.
+    dataset = files.interleave(self.load_map,
+                  cycle_length       = self.batch_size,
+                  num_parallel_calls = self.num_parallel_calls,
+                  deterministic      = self.deterministic)
+    dataset = dataset.shuffle(self.shuffle_buffer, seed=self.seed, reshuffle_each_iteration=True)
+    dataset = dataset.batch(self.batch_size, drop_remainder=True)
+    return dataset.prefetch(tf.data.AUTOTUNE)
+
+  # Return a tf.data.Dataset which can be passed to model.fit in place of the Python generator.
+  def generate(self):
+    return self.create()
+
+
+if __name__ == "__main__":
+  try:
+    config_file = "./train_eval_infer.config"
+    if len(sys.argv) == 2:
+      config_file = sys.argv[1]
+    # Run the python loader and this tf.data loader on the same config,
+    # which share read, load_pair and preprocess methods of ImageMaskDatasetGenerator.
+    python_generator = ImageMaskDatasetGenerator(config_file, dataset=TRAIN)
+    (X, Y) = next(python_generator.generate())
+    print("python  X {} {}  Y {} {}".format(X.shape, X.dtype, Y.shape, Y.dtype))
+
+    generator = TFDataImageMaskGenerator(config_file, dataset=TRAIN)
+    for (X, Y) in generator.generate().take(10):
+      print("tf.data X {} {}  Y {} {}".format(X.shape, X.dtype, Y.shape, Y.dtype))
+
+  except:
+    traceback.print_exc()
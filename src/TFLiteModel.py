@@ -0,0 +1,74 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TFLiteModel.py
+#
+# A thin wrapper of tf.lite.Interpreter which provides a Keras-like predict method
+# for a TFLite model exported by TensorflowUNetTFLiteConverter.py.
+# It handles both float (float32/float16) and integer quantized input and output tensors.
+
+import os
+import numpy as np
+import tensorflow as tf
+
+class TFLiteModel:
+
+  def __init__(self, tflite_file, num_threads=None):
+    if not os.path.exists(tflite_file):
+      raise Exception("Not found a tflite_file " + tflite_file)
+    self.tflite_file = tflite_file
+    self.interpreter = tf.lite.Interpreter(model_path=tflite_file, num_threads=num_threads)
+    self.interpreter.allocate_tensors()
+    self.input_detail  = self.interpreter.get_input_details()[0]
+    self.output_detail = self.interpreter.get_output_details()[0]
+    self.batch_size    = self.input_detail["shape"][0]
+    print("=== TFLiteModel {} input {} {} output {} {}".format(tflite_file,
+          self.input_detail["shape"],  self.input_detail["dtype"],
+          self.output_detail["shape"], self.output_detail["dtype"]))
+
+  def resize(self, batch_size):
+    if batch_size != self.batch_size:
+      shape = list(self.input_detail["shape"])
+      shape[0] = batch_size
+      self.interpreter.resize_tensor_input(self.input_detail["index"], shape)
+      self.interpreter.allocate_tensors()
+      self.input_detail  = self.interpreter.get_input_details()[0]
+      self.output_detail = self.interpreter.get_output_details()[0]
+      self.batch_size    = batch_size
+
+  def quantize(self, batch):
+    dtype = self.input_detail["dtype"]
+    (scale, zero_point) = self.input_detail["quantization"]
+    if dtype in [np.int8, np.uint8] and scale != 0:
+      batch = np.round(batch / scale + zero_point)
+      info  = np.iinfo(dtype)
+      batch = np.clip(batch, info.min, info.max)
+    return batch.astype(dtype)
+
+  def dequantize(self, output):
+    (scale, zero_point) = self.output_detail["quantization"]
+    if self.output_detail["dtype"] in [np.int8, np.uint8] and scale != 0:
+      output = (output.astype(np.float32) - zero_point) * scale
+    return output.astype(np.float32)
+
+  # Predict a batch of images of shape (N, H, W, C), and return an array of shape (N, H, W, num_classes).
+  def predict(self, batch, batch_size=None):
+    batch = np.asarray(batch, dtype=np.float32)
+    self.resize(len(batch))
+    self.interpreter.set_tensor(self.input_detail["index"], self.quantize(batch))
+    self.interpreter.invoke()
+    output = self.interpreter.get_tensor(self.output_detail["index"])
+    return self.dequantize(output)
+
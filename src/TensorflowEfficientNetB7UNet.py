@@ -20,16 +20,32 @@
 This code is based on the following github web-site.
 https://github.com/ahmed-470/Segmentation_EfficientNetB7_Unet/blob/main/efficientnetb7_Unet.py
 """
+# 2024/04 Added rematerialize to [model] section to recompute the activations of
+# the decoder blocks in the backward pass instead of keeping them, which allows a larger
+# batch_size on the same memory.
+# The encoder is not rematerialized, because only the last 61 layers of EfficientNetB7 are
+# trainable, and their activations at 1/32 of the image size are small. The large activations
+# of the frozen blocks at higher resolutions are not needed for their gradients.
+# The rematerialized decoder blocks share the layers of the decoder blocks of the model without
+# rematerialization, and the checkpoints are saved from that model, so that they can be loaded
+# by the model without rematerialize, for example, of the evaluator in the graph mode.
+# This requires [runtime] execution = "function" or "eager".
+"""
+[model]
+; ["decoder"] or [] which means no rematerialization
+rematerialize = ["decoder"]
+"""
 import tensorflow as tf
 
 from tensorflow.keras.layers import Conv2D, BatchNormalization, Activation, MaxPool2D, Conv2DTranspose, Concatenate, Input
 from tensorflow.keras.models import Model
 from tensorflow.keras.applications import EfficientNetB0
 from TensorflowUNet import TensorflowUNet
+from RematerializedBlock import RematerializedBlock, RematerializedModel
 
 print("TF Version: ", tf.__version__)
 
-ODEL = "model"
+MODEL = "model"
 EVAL  = "eval"
 INFER = "infer"
 
@@ -39,32 +55,63 @@ class TensorflowEfficientNetB7UNet(TensorflowUNet):
     super().__init__(config_file)
     
     
+  """Defining the layers of the Convolution Block"""
+  def conv_block_layers(self, num_filters):
+      return [Conv2D(num_filters, 3, padding="same", kernel_initializer="he_normal"),
+              BatchNormalization(),
+              Activation("relu"),
+              Conv2D(num_filters, 3, padding="same", kernel_initializer="he_normal"),
+              BatchNormalization(),
+              Activation("relu")]
+
   """Defining the Convolution Block"""
   def conv_block(self, input, num_filters):
-      x = Conv2D(num_filters, 3, padding="same", kernel_initializer="he_normal")(input)
-      x = BatchNormalization()(x)
-      x = Activation("relu")(x)
-
-      x = Conv2D(num_filters, 3, padding="same", kernel_initializer="he_normal")(x)
-      x = BatchNormalization()(x)
-      x = Activation("relu")(x)
+      x = input
+      for layer in self.conv_block_layers(num_filters):
+        x = layer(x)
+      return x
 
+  """Defining the layers of the Transpose Convolution Block"""
+  def decoder_layers(self, num_filters):
+      #Dropout(0.05) after Concatenate
+      return [Conv2DTranspose(num_filters, (2, 2), strides=2, padding="same"),
+              Concatenate()] + self.conv_block_layers(num_filters)
+
+  """Applying the layers of the Transpose Convolution Block to [input, skip_features]"""
+  def apply_decoder_layers(self, layers, inputs, training=None):
+      (input, skip_features) = inputs
+      x = layers[0](input, training=training)
+      x = layers[1]([x, skip_features])
+      for layer in layers[2:]:
+        x = layer(x, training=training)
       return x
 
   """Defining the Transpose Convolution Block"""
   def decoder_block(self, input, skip_features, num_filters):
-      x = Conv2DTranspose(num_filters, (2, 2), strides=2, padding="same")(input)
-      x = Concatenate()([x, skip_features])
-      #x = Dropout(0.05)(x)
-      x = self.conv_block(x, num_filters)
-      return x
+      return self.apply_decoder_layers(self.decoder_layers(num_filters), [input, skip_features])
+
+  """Defining the Transpose Convolution Block sharing the layers of a decoder block,
+     of which activations are recomputed in the backward pass"""
+  def rematerialized_decoder_block(self, layers, input, skip_features):
+      block = lambda inputs, training: self.apply_decoder_layers(layers, inputs, training=training)
+      return RematerializedBlock(block, layers,
+                                 name="decoder_block_" + str(layers[0].filters) + "_remat")([input, skip_features])
 
   """Building the EfficientNetB7_UNet"""
   def create(self, num_classes, image_height, image_width, image_channels,
                base_filters = 16, num_layers = 6):            
-      input_shape = (image_width, image_height, image_channels)
+      # 2024/04 (height, width) for the non-square stages of [train] progressive_resizing
+      input_shape = (image_height, image_width, image_channels)
       
       
+      rematerialize = self.config.get(MODEL, "rematerialize", dvalue=[])
+      print("--- rematerialize {}".format(rematerialize))
+      for mode in rematerialize:
+        if mode != "decoder":
+          raise Exception("Invalid [model] rematerialize " + str(mode) + ", only \"decoder\" is supported")
+      if len(rematerialize) > 0 and self.runtime.execution == "graph":
+        raise Exception("[model] rematerialize requires [runtime] execution = \"function\" or \"eager\"")
+
       """ Input """
       inputs = Input(shape=input_shape, name='input_image')
       #inputs = tf.keras.layers.Lambda(lambda x: x / 255)(inputs)
@@ -89,19 +136,35 @@ class TensorflowEfficientNetB7UNet(TensorflowUNet):
       b1 = effNetB7.get_layer("block7a_activation").output  ## (16 x 16)
 
       """ Decoder """
-      d1 = self.decoder_block(b1, s5, 512)                     ## (32 x 32)
-      d2 = self.decoder_block(d1, s4, 256)                     ## (64 x 64)
-      d3 = self.decoder_block(d2, s3, 128)                     ## (128 x 128)
-      d4 = self.decoder_block(d3, s2, 64)                      ## (256 x 256)
-      d5 = self.decoder_block(d4, s1, 32)                      ## (512 x 512)
+      # The layers of the decoder blocks are kept to be shared by the rematerialized blocks.
+      DECODER_LAYERS = []
+      def decoder_block(input, skip_features, num_filters):
+        layers = self.decoder_layers(num_filters)
+        DECODER_LAYERS.append(layers)
+        return self.apply_decoder_layers(layers, [input, skip_features])
+      d1 = decoder_block(b1, s5, 512)                     ## (32 x 32)
+      d2 = decoder_block(d1, s4, 256)                     ## (64 x 64)
+      d3 = decoder_block(d2, s3, 128)                     ## (128 x 128)
+      d4 = decoder_block(d3, s2, 64)                      ## (256 x 256)
+      d5 = decoder_block(d4, s1, 32)                      ## (512 x 512)
 
       """ Output """
       activation = "softmax"
       if num_classes == 1:
         activation = "sigmoid"
         
-      outputs = Conv2D(1, 1, padding="same", activation=activation)(d5)
+      # 2024/04 The output layer is computed in float32 under [model] mixed_precision policy,
+      # because sigmoid and softmax in float16 or bfloat16 are numerically unstable.
+      output_layer = Conv2D(1, 1, padding="same", activation=activation, dtype="float32")
+      outputs = output_layer(d5)
 
       model = Model(inputs, outputs, name="EfficientNetB7_U-Net")
+      if "decoder" in rematerialize:
+        # The same layers computed through the rematerialized decoder blocks. The model saves and
+        # loads the weights of the model above, so that the checkpoints have the same layout.
+        d = b1
+        for (layers, skip_features) in zip(DECODER_LAYERS, [s5, s4, s3, s2, s1]):
+          d = self.rematerialized_decoder_block(layers, d, skip_features)
+        model = RematerializedModel(inputs, output_layer(d), model, name=model.name)
       return model
 
@@ -78,8 +78,19 @@ Added 'plot_line_graphs' method to <a href="./src/TensorflowUNet.py">TensorflowU
 to plot line_graphs for <i>train_eval.csv</i> and <i>train_losses.csv</i> generated through the training-process.</li>
 """
 
+# 2024/04
+# Added mixed_precision to [model] section.
+"""
+[model]
+; "none", "mixed_float16" or "mixed_bfloat16"(for CPUs with AVX512_BF16/AMX and recent GPUs)
+; The output layers and the losses are computed in float32, and "mixed_float16" uses
+; a loss-scaled optimizer. This requires [runtime] execution = "function" or "eager".
+mixed_precision = "mixed_bfloat16"
+"""
+
 import os
 import sys
+import time
 import datetime
 
 os.environ["TF_FORCE_GPU_ALLOW_GROWTH"] = "true"
@@ -113,7 +124,9 @@ from ConfigParser import ConfigParser
 
 import tensorflow as tf
 
-tf.compat.v1.disable_eager_execution()
+# 2024/04 tf.compat.v1.disable_eager_execution() has been moved to RuntimePolicy,
+# which is applied by [runtime] execution setting before a model is constructed.
+from RuntimePolicy import RuntimePolicy
 
 from PIL import Image, ImageFilter, ImageOps
 from tensorflow.keras.layers import Lambda
@@ -141,6 +154,12 @@ from losses import iou_coef, iou_loss, bce_iou_loss, dice_loss,  bce_dice_loss
 from mish import mish
 
 from LineGraphPlotter import LineGraphPlotter
+from InferencePipeline import InferencePipeline
+from GradientAccumulationModel import GradientAccumulationModel, AccumulationFlushCallback
+from CustomTrainingLoop import CustomTrainingLoop
+from ProgressiveResizing import ProgressiveResizing
+from ImageTiler import ImageTiler
+from TFLiteModel import TFLiteModel
 
 
 gpus = tf.config.list_physical_devices('GPU')
@@ -149,8 +168,7 @@ for gpu in gpus:
 
 # 2023/10/31
 # See https://www.tensorflow.org/api_docs/python/tf/config/threading/set_intra_op_parallelism_threads
-tf.config.threading.set_inter_op_parallelism_threads(1)
-tf.config.threading.set_intra_op_parallelism_threads(1)
+# The number of threads is set by RuntimePolicy from [runtime] intra_op_threads and inter_op_threads.
 
 # 2023/10/23
 random.seed    = SEED
@@ -184,6 +202,7 @@ MASK   = "mask"
 SEGMENTATION = "segmentation"
 TILEDINFER = "tiledinfer"
 BEST_MODEL_FILE = "best_model.h5"
+MIXED_PRECISIONS = ["none", "mixed_float16", "mixed_bfloat16"]
 
 class TensorflowUNet:
   def __init__(self, config_file):
@@ -192,15 +211,15 @@ class TensorflowUNet:
     self.config_file = config_file
     self.config    = ConfigParser(config_file)
     self.config.dump_all()
+    # Apply [runtime] threading and execution-mode policy before the model is created,
+    # if it has not been applied by an entry point yet.
+    self.runtime   = RuntimePolicy(config_file).apply()
 
     image_height   = self.config.get(MODEL, "image_height")
     image_width    = self.config.get(MODEL, "image_width")
     image_channels = self.config.get(MODEL, "image_channels")
     num_classes    = self.config.get(MODEL, "num_classes")
-    # 204/03/30
-    self.num_classes = num_classes
-    self.tiledinfer_binarize =self.config.get(TILEDINFER,   "binarize", dvalue=True) 
-    self.tiledinfer_threshold = self.config.get(TILEDINFER, "threshold", dvalue=60)
+    self.read_inference_config()
 
     base_filters   = self.config.get(MODEL, "base_filters")
     num_layers     = self.config.get(MODEL, "num_layers")
@@ -209,28 +228,16 @@ class TensorflowUNet:
     self.activation = eval(activatation)
     print("=== activation {}".format(activatation))
 
+    # 2024/04 The mixed precision policy must be set before the layers are created.
+    self.mixed_precision = self.config.get(MODEL, "mixed_precision", dvalue="none")
+    self.set_mixed_precision_policy()
+
     self.model     = self.create(num_classes, image_height, image_width, image_channels, 
                             base_filters = base_filters, num_layers = num_layers)  
+    self.model     = self.float32_outputs(self.model)
     learning_rate  = self.config.get(MODEL, "learning_rate")
-    clipvalue      = self.config.get(MODEL, "clipvalue", 0.2)
-    print("--- clipvalue {}".format(clipvalue))
-  
-    optimizer = self.config.get(MODEL, "optimizer", dvalue="Adam")
-    if optimizer == "Adam":
-      self.optimizer = tf.keras.optimizers.Adam(learning_rate = learning_rate,
-         beta_1=0.9, 
-         beta_2=0.999, 
-         clipvalue=clipvalue, 
-         amsgrad=False)
-      print("=== Optimizer Adam learning_rate {} clipvalue {} ".format(learning_rate, clipvalue))
-    
-    elif optimizer == "AdamW":
-      # 2023/11/10  Adam -> AdamW (tensorflow 2.14.0~)
-      self.optimizer = tf.keras.optimizers.AdamW(learning_rate = learning_rate,
-         clipvalue=clipvalue,
-         )
-      print("=== Optimizer AdamW learning_rate {} clipvalue {} ".format(learning_rate, clipvalue))
-            
+    self.optimizer = self.create_optimizer(learning_rate)
+
     self.model_loaded = False
 
     binary_crossentropy = tf.keras.metrics.binary_crossentropy
@@ -251,13 +258,81 @@ class TensorflowUNet:
     print("--- loss    {}".format(self.loss))
     print("--- metrics {}".format(self.metrics))
     
-    self.model.compile(optimizer = self.optimizer, loss= self.loss, metrics = self.metrics)
+    self.model.compile(optimizer = self.optimizer, loss= self.loss, metrics = self.metrics,
+                       **self.runtime.compile_options())
    
     show_summary = self.config.get(MODEL, "show_summary")
     if show_summary:
       self.model.summary()
     self.show_history = self.config.get(TRAIN, "show_history", dvalue=False)
 
+  # 2024/04 Moved from the constructor to create an optimizer for each model rebuilt by
+  # [train] progressive_resizing.
+  def create_optimizer(self, learning_rate):
+    clipvalue      = self.config.get(MODEL, "clipvalue", 0.2)
+    print("--- clipvalue {}".format(clipvalue))
+  
+    name      = self.config.get(MODEL, "optimizer", dvalue="Adam")
+    if name == "Adam":
+      optimizer = tf.keras.optimizers.Adam(learning_rate = learning_rate,
+         beta_1=0.9, 
+         beta_2=0.999, 
+         clipvalue=clipvalue, 
+         amsgrad=False)
+      print("=== Optimizer Adam learning_rate {} clipvalue {} ".format(learning_rate, clipvalue))
+    
+    elif name == "AdamW":
+      # 2023/11/10  Adam -> AdamW (tensorflow 2.14.0~)
+      optimizer = tf.keras.optimizers.AdamW(learning_rate = learning_rate,
+         clipvalue=clipvalue,
+         )
+      print("=== Optimizer AdamW learning_rate {} clipvalue {} ".format(learning_rate, clipvalue))
+
+    if self.mixed_precision == "mixed_float16":
+      # Scale the loss to keep small float16 gradients from underflowing to zero.
+      # bfloat16 has the same exponent range as float32, and needs no loss scaling.
+      optimizer = tf.keras.mixed_precision.LossScaleOptimizer(optimizer)
+      print("=== Optimizer LossScaleOptimizer")
+    return optimizer
+
+  def set_mixed_precision_policy(self):
+    if not self.mixed_precision in MIXED_PRECISIONS:
+      raise Exception("Invalid [model] mixed_precision " + str(self.mixed_precision))
+    if self.mixed_precision == "none":
+      return
+    if self.runtime.execution == "graph":
+      raise Exception("[model] mixed_precision requires [runtime] execution = \"function\" or \"eager\"")
+    tf.keras.mixed_precision.set_global_policy(self.mixed_precision)
+    print("=== mixed_precision policy {}".format(tf.keras.mixed_precision.global_policy().name))
+
+  # Return the model of which outputs are cast to float32, so that the losses and metrics
+  # are computed in float32 under a mixed precision policy.
+  # A subclass may create its output layer with dtype="float32" instead.
+  def float32_outputs(self, model):
+    if self.mixed_precision == "none":
+      return model
+    if all(output.dtype == tf.float32 for output in model.outputs):
+      return model
+    outputs = []
+    for (i, output) in enumerate(model.outputs):
+      if output.dtype != tf.float32:
+        output = tf.keras.layers.Activation("linear", dtype="float32", name="float32_output_" + str(i))(output)
+      outputs.append(output)
+    return tf.keras.Model(inputs=model.inputs, outputs=outputs, name=model.name)
+
+  # Read the parameters used by infer, infer_tiles and predict methods.
+  # This is also called by TensorflowUNetInferenceModel which never creates a Keras model.
+  def read_inference_config(self):
+    # 204/03/30
+    self.num_classes = self.config.get(MODEL, "num_classes")
+    self.tiledinfer_binarize =self.config.get(TILEDINFER,   "binarize", dvalue=True) 
+    self.tiledinfer_threshold = self.config.get(TILEDINFER, "threshold", dvalue=60)
+    # Number of images to be stacked into one tensor on a forward pass in predict method.
+    self.infer_batch_size = self.config.get(INFER, "batch_size", dvalue=1)
+    # Inference backend "keras" (default), "tflite" or "saved_model" 
+    self.backend          = self.config.get(INFER, "backend", dvalue="keras")
+    self.tflite_model     = None
+
   def create(self, num_classes, image_height, image_width, image_channels,
             base_filters = 16, num_layers = 5):
     # inputs
@@ -434,6 +509,9 @@ class TensorflowUNet:
     except:
       pass
     self.create_dirs(eval_dir, model_dir)
+    self.accumulate_gradients()
+    # 2024/04 [train] loop = "custom" runs CustomTrainingLoop in place of model.fit.
+    training_loop = self.create_training_loop()
     # Copy current config_file to model_dir
     shutil.copy2(self.config_file, model_dir)
     print("-- Copied {} to {}".format(self.config_file, model_dir))
@@ -469,8 +547,19 @@ class TensorflowUNet:
       print("=== Added SeedResetCallback")
       seedercb = SeedResetCallback(seed=self.seed)
       callbacks += [seedercb]
+
+    # 2024/04 Apply the gradients accumulated in the last steps of each epoch of [train] accumulation_steps.
+    if isinstance(self.model, GradientAccumulationModel):
+      callbacks = [AccumulationFlushCallback()] + callbacks
+
+    # 2024/04 Train the stages of [train] progressive_resizing on smaller images, and rebuild
+    # the model of the full size for the last stage, which starts at initial_epoch.
+    initial_epoch = self.train_progressive_stages(train_generator, valid_generator, callbacks, check_point)
+    if initial_epoch > 0:
+      training_loop = self.create_training_loop()
  
-    if type(train_generator) == np.ndarray and type(valid_generator) == np.ndarray:
+    # 2024/04 isinstance to accept np.memmap arrays created by [dataset] store = "memmap"
+    if isinstance(train_generator, np.ndarray) and isinstance(valid_generator, np.ndarray):
       x_train = train_generator
       y_train = valid_generator
  
@@ -490,10 +579,15 @@ class TensorflowUNet:
         valid_y = y_train[train_size:]
 
         print("--- split the master into train(0.8) and valid(0.2)")
-        print("=== Start model.fit ")
-        history = self.model.fit(train_x, train_y, 
+        if training_loop != None:
+          history = self.fit_arrays(training_loop, train_x, train_y, valid_x, valid_y, batch_size, epochs, callbacks,
+                                    initial_epoch=initial_epoch)
+        else:
+          print("=== Start model.fit ")
+          history = self.model.fit(train_x, train_y, 
                     batch_size=batch_size, 
                     epochs=epochs, 
+                    initial_epoch=initial_epoch,
                     validation_data= (valid_x, valid_y),
                     shuffle=False,
                     callbacks=callbacks,
@@ -502,10 +596,18 @@ class TensorflowUNet:
       else:
         # By the parameter setting : validation_split=0.2,
         # x_train and y_train will be split into real_train (0.8) and 0.2 real_valid (0.2) 
-        history = self.model.fit(x_train, y_train, 
+        if training_loop != None:
+          # The same split as validation_split of model.fit, which takes the last samples.
+          split = int(len(x_train) * 0.8)
+          history = self.fit_arrays(training_loop, x_train[:split], y_train[:split],
+                                    x_train[split:], y_train[split:], batch_size, epochs, callbacks,
+                                    initial_epoch=initial_epoch)
+        else:
+          history = self.model.fit(x_train, y_train, 
                     validation_split=0.2, 
                     batch_size=batch_size, 
                     epochs=epochs, 
+                    initial_epoch=initial_epoch,
                     shuffle=False,
                     callbacks=callbacks,
                     verbose=1)
@@ -516,9 +618,20 @@ class TensorflowUNet:
       steps_per_epoch  = self.config.get(TRAIN, "steps_per_epoch",  dvalue=400)
       validation_steps = self.config.get(TRAIN, "validation_steps", dvalue=800)
   
-      history = self.model.fit(train_generator, 
+      if training_loop != None:
+        history = training_loop.fit(train_generator,
+                    steps_per_epoch=steps_per_epoch,
+                    epochs=epochs,
+                    initial_epoch=initial_epoch,
+                    validation_data=valid_generator,
+                    validation_steps=validation_steps,
+                    callbacks=callbacks,
+                    verbose=1)
+      else:
+        history = self.model.fit(train_generator, 
                     steps_per_epoch=steps_per_epoch,
                     epochs=epochs, 
+                    initial_epoch=initial_epoch,
                     validation_data=valid_generator,
                     validation_steps= validation_steps,
                     shuffle = False,
@@ -526,6 +639,127 @@ class TensorflowUNet:
                     verbose=1)
       self.plot_line_graphs(history)
 
+  # 2024/04 Added [train] accumulation_steps to apply the mean of the gradients of
+  # accumulation_steps batches of batch_size by GradientAccumulationModel.
+  def accumulate_gradients(self):
+    accumulation_steps = self.config.get(TRAIN, "accumulation_steps", dvalue=1)
+    if accumulation_steps <= 1 or isinstance(self.model, GradientAccumulationModel):
+      return
+    if self.runtime.execution == "graph":
+      raise Exception("[train] accumulation_steps requires [runtime] execution = \"function\" or \"eager\"")
+    print("=== GradientAccumulationModel accumulation_steps {} effective batch_size {}".format(
+          accumulation_steps, accumulation_steps * self.config.get(TRAIN, "batch_size")))
+    self.model = GradientAccumulationModel(self.model, accumulation_steps)
+    self.model.compile(optimizer = self.optimizer, loss= self.loss, metrics = self.metrics,
+                       **self.runtime.compile_options())
+    self.model.build_optimizer()
+
+  # Return a CustomTrainingLoop for [train] loop = "custom", or None for model.fit.
+  def create_training_loop(self):
+    loop = self.config.get(TRAIN, "loop", dvalue="fit")
+    if not loop in ["fit", "custom"]:
+      raise Exception("Invalid [train] loop " + str(loop))
+    if loop == "fit":
+      return None
+    if self.runtime.execution == "graph":
+      raise Exception("[train] loop = \"custom\" requires [runtime] execution = \"function\" or \"eager\"")
+    print("=== CustomTrainingLoop jit_compile {}".format(self.runtime.jit_compile))
+    return CustomTrainingLoop(self.model, jit_compile=self.runtime.jit_compile)
+
+  def fit_arrays(self, training_loop, train_x, train_y, valid_x, valid_y, batch_size, epochs, callbacks,
+                 initial_epoch=0):
+    (train_batches, steps_per_epoch)  = CustomTrainingLoop.batches(train_x, train_y, batch_size)
+    (valid_batches, validation_steps) = CustomTrainingLoop.batches(valid_x, valid_y, batch_size)
+    return training_loop.fit(train_batches,
+                    steps_per_epoch=steps_per_epoch,
+                    epochs=epochs,
+                    initial_epoch=initial_epoch,
+                    validation_data=valid_batches,
+                    validation_steps=validation_steps,
+                    callbacks=callbacks,
+                    verbose=1)
+
+  # Rebuild the model of width x height for [train] progressive_resizing, and carry the weights
+  # of the current model over, which have the same shapes for a fully convolutional model.
+  # The optimizer is created again for the new variables with the current learning rate.
+  def rebuild(self, width, height):
+    print("=== Rebuild the model of image_width {} image_height {}".format(width, height))
+    learning_rate = float(tf.keras.backend.get_value(self.model.optimizer.learning_rate))
+    previous   = self.model
+    self.model = self.create(self.config.get(MODEL, "num_classes"), height, width,
+                            self.config.get(MODEL, "image_channels"),
+                            base_filters = self.config.get(MODEL, "base_filters"),
+                            num_layers   = self.config.get(MODEL, "num_layers"))
+    self.model = self.float32_outputs(self.model)
+    if len(self.model.layers) != len(previous.layers):
+      raise Exception("The rebuilt model has different layers from the previous model")
+    for (layer, previous_layer) in zip(self.model.layers, previous.layers):
+      layer.set_weights(previous_layer.get_weights())
+    self.optimizer = self.create_optimizer(learning_rate)
+    self.model.compile(optimizer = self.optimizer, loss= self.loss, metrics = self.metrics,
+                       **self.runtime.compile_options())
+    self.accumulate_gradients()
+
+  # Train the stages of [train] progressive_resizing before the last stage, and
+  # return the initial_epoch of the last stage, or 0 if there is no stage.
+  def train_progressive_stages(self, train_generator, valid_generator, callbacks, check_point):
+    progressive_resizing = ProgressiveResizing(self.config_file)
+    stages = progressive_resizing.stages()
+    if len(stages) == 0:
+      return 0
+    batch_size = self.config.get(TRAIN, "batch_size")
+    arrays = isinstance(train_generator, np.ndarray) and isinstance(valid_generator, np.ndarray)
+    for (width, height, initial_epoch, epochs) in stages:
+      print("=== Progressive resizing stage image_width {} image_height {} epochs {}-{}".format(
+            width, height, initial_epoch, epochs))
+      self.rebuild(width, height)
+      training_loop = self.create_training_loop()
+      # The best val_loss of another image size is not comparable with this stage.
+      check_point.best = np.inf
+      if arrays:
+        # The last 20% of the master dataset is the validation data as dataset_splitter and validation_split.
+        (x, y) = progressive_resizing.resize_arrays(train_generator, valid_generator, width, height)
+        split  = int(0.8 * len(x))
+        if training_loop != None:
+          self.fit_arrays(training_loop, x[:split], y[:split], x[split:], y[split:], batch_size, epochs, callbacks,
+                          initial_epoch=initial_epoch)
+        else:
+          self.model.fit(x[:split], y[:split],
+                    batch_size=batch_size,
+                    epochs=epochs,
+                    initial_epoch=initial_epoch,
+                    validation_data= (x[split:], y[split:]),
+                    shuffle=False,
+                    callbacks=callbacks,
+                    verbose=1)
+      else:
+        steps_per_epoch  = self.config.get(TRAIN, "steps_per_epoch",  dvalue=400)
+        validation_steps = self.config.get(TRAIN, "validation_steps", dvalue=800)
+        train_batches = progressive_resizing.resize_batches(train_generator, width, height)
+        valid_batches = progressive_resizing.resize_batches(valid_generator, width, height)
+        if training_loop != None:
+          training_loop.fit(train_batches,
+                    steps_per_epoch=steps_per_epoch,
+                    epochs=epochs,
+                    initial_epoch=initial_epoch,
+                    validation_data=valid_batches,
+                    validation_steps=validation_steps,
+                    callbacks=callbacks,
+                    verbose=1)
+        else:
+          self.model.fit(train_batches,
+                    steps_per_epoch=steps_per_epoch,
+                    epochs=epochs,
+                    initial_epoch=initial_epoch,
+                    validation_data=valid_batches,
+                    validation_steps= validation_steps,
+                    shuffle = False,
+                    callbacks=callbacks,
+                    verbose=1)
+    self.rebuild(progressive_resizing.image_width, progressive_resizing.image_height)
+    check_point.best = np.inf
+    return stages[-1][3]
+
   def plot_line_graphs(self, history):
     print("=== plot_line_graph")
     eval_dir   = self.config.get(TRAIN, "eval_dir")
@@ -553,6 +787,15 @@ class TensorflowUNet:
       #print("== Already loaded a weight file.")
     return rc
   
+  # Load a TFLite model exported by TensorflowUNetTFLiteConverter.py for [infer] backend = "tflite".
+  def load_tflite_model(self):
+    if self.tflite_model == None:
+      tflite_file = self.config.get(INFER, "tflite_model", dvalue="./tflite_models/model_int8.tflite")
+      num_threads = self.config.get(INFER, "tflite_threads", dvalue=None)
+      self.tflite_model = TFLiteModel(tflite_file, num_threads=num_threads)
+      print("=== Loaded a tflite_file {}".format(tflite_file))
+    return self.tflite_model
+
   def infer(self, input_dir, output_dir, expand=True):
     colorize = self.config.get(SEGMENTATION, "colorize", dvalue=False)
     black    = self.config.get(SEGMENTATION, "black",    dvalue="black")
@@ -577,39 +820,98 @@ class TensorflowUNet:
     except:
       traceback.print_exc()
 
-    for image_file in image_files:
-      basename = os.path.basename(image_file)
-      name     = basename.split(".")[0]    
-      img      = cv2.imread(image_file)
-      # img = BGR format
-      h = img.shape[0]
-      w = img.shape[1]
-      # Any way, we have to resize input image to match the input size of our TensorflowUNet model.
-      img         = cv2.resize(img, (width, height))
-      predictions = self.predict([img], expand=expand)
-      prediction  = predictions[0]
-      image       = prediction[0]    
-      # Resize the predicted image to be the original image size (w, h), and save it as a grayscale image.
-      # Probably, this is a natural way for all humans. 
-      mask = writer.save_resized(image, (w, h), output_dir, name)
-      print("--- image_file {}".format(image_file))
-      if merged_dir !=None:
-        img   = cv2.resize(img, (w, h))
-        if blursize:
-          img   = cv2.blur(img, blursize)
-        img += mask
-        merged_file = os.path.join(merged_dir, basename)
-        cv2.imwrite(merged_file, img)
-
-  def predict(self, images, expand=True):
-    self.load_model()
+    # Run decoding, prediction and encoding in a pipeline of reader and writer thread pools
+    # if [infer] pipeline = True.
+    pipeline = self.config.get(INFER, "pipeline", dvalue=False)
+    if pipeline:
+      self.infer_pipelined(image_files, writer, width, height, output_dir, merged_dir, blursize, expand=expand)
+      return
+
+    # Read the image_files in chunks of infer_batch_size, and predict each chunk at once.
+    batch_size = max(1, self.infer_batch_size)
+    for i in range(0, len(image_files), batch_size):
+      batch_files = image_files[i:i+batch_size]
+      images = []
+      sizes  = []
+      for image_file in batch_files:
+        img      = cv2.imread(image_file)
+        # img = BGR format
+        h = img.shape[0]
+        w = img.shape[1]
+        sizes.append((w, h))
+        # Any way, we have to resize input image to match the input size of our TensorflowUNet model.
+        img      = cv2.resize(img, (width, height))
+        images.append(img)
+      predictions = self.predict(images, expand=expand)
+
+      for n, image_file in enumerate(batch_files):
+        prediction = predictions[n]
+        self.save_prediction(writer, image_file, images[n], prediction[0], sizes[n], 
+                             output_dir, merged_dir, blursize)
+
+  def infer_pipelined(self, image_files, writer, width, height, output_dir, merged_dir, blursize, expand=True):
+    readers    = self.config.get(INFER, "readers",    dvalue=4)
+    writers    = self.config.get(INFER, "writers",    dvalue=2)
+    queue_size = self.config.get(INFER, "queue_size", dvalue=max(8, 2 * self.infer_batch_size))
+
+    def read(image_file):
+      img = cv2.imread(image_file)
+      h   = img.shape[0]
+      w   = img.shape[1]
+      img = cv2.resize(img, (width, height))
+      return (img, (w, h))
+
+    def predict(images):
+      return self.predict(images, expand=expand)
+
+    def write(image_file, img, prediction, size):
+      self.save_prediction(writer, image_file, img, prediction[0], size, 
+                           output_dir, merged_dir, blursize)
+
+    pipeline = InferencePipeline(readers=readers, writers=writers, queue_size=queue_size)
+    pipeline.run(image_files, read, predict, write, batch_size=self.infer_batch_size)
+
+  def save_prediction(self, writer, image_file, img, image, size, output_dir, merged_dir, blursize=None):
+    basename = os.path.basename(image_file)
+    name     = basename.split(".")[0]    
+    (w, h)   = size
+    # Resize the predicted image to be the original image size (w, h), and save it as a grayscale image.
+    # Probably, this is a natural way for all humans. 
+    mask = writer.save_resized(image, (w, h), output_dir, name)
+    print("--- image_file {}".format(image_file))
+    if merged_dir !=None:
+      img   = cv2.resize(img, (w, h))
+      if blursize:
+        img   = cv2.blur(img, blursize)
+      img += mask
+      merged_file = os.path.join(merged_dir, basename)
+      cv2.imwrite(merged_file, img)
+
+  # Predict the images in batches of batch_size, which defaults to [infer] batch_size.
+  # The returned list has one prediction for each image, which has a shape (1, H, W, C) as before.
+  def predict(self, images, expand=True, batch_size=None):
+    if self.backend == "tflite":
+      model = self.load_tflite_model()
+    else:
+      self.load_model()
+      model = self.model
     predictions = []
-    for image in images:
-      #print("=== Input image shape {}".format(image.shape))
-      if expand:
-        image = np.expand_dims(image, 0)
-      pred = self.model.predict(image)
-      predictions.append(pred)
+    if not expand:
+      # Each image has already been expanded to a batch by a caller.
+      for image in images:
+        pred = model.predict(image)
+        predictions.append(pred)
+      return predictions
+
+    if batch_size == None:
+      batch_size = self.infer_batch_size
+    batch_size = max(1, batch_size)
+    for i in range(0, len(images), batch_size):
+      batch = np.stack(images[i:i+batch_size])
+      preds = model.predict(batch, batch_size=len(batch))
+      # Split the batched outputs back to each image.
+      for pred in preds:
+        predictions.append(np.expand_dims(pred, 0))
     return predictions    
 
   def pil2cv(self, image):
@@ -627,6 +929,8 @@ class TensorflowUNet:
   # 2 Infer segmentation regions on those images 
   # 3 Merge detected regions into one image
   # Added MARGIN to cropping 
+  # The tiles are split from and stitched into NumPy canvases by ImageTiler 
+  # instead of PIL Image.crop and Image.paste.
   def infer_tiles(self, input_dir, output_dir, expand=True):    
     image_files  = glob.glob(input_dir + "/*.png")
     image_files += glob.glob(input_dir + "/*.jpg")
@@ -663,27 +967,27 @@ class TensorflowUNet:
     bitwise_blending  = self.config.get(TILEDINFER, "bitwise_blending", dvalue=True)
     bgcolor = self.config.get(TILEDINFER, "background", dvalue=0)  
 
-    for image_file in image_files:
-      image   = Image.open(image_file)
-      w, h    = image.size
+    # Number of tiles to be predicted on one forward pass. 
+    # 0 means that all the tiles of an image are predicted at once.
+    tiles_batch_size = self.config.get(TILEDINFER, "batch_size", dvalue=0)
 
-      # Resize the image to the input size (width, height) of our UNet model.      
-      resized = image.resize((width, height))
+    # Blending of overlapped tiles: "none" (default) pastes the hard-edged centers of the tiles,
+    # "gaussian" or "cosine" accumulates the weighted soft probabilities of the whole tiles.
+    blending = self.config.get(TILEDINFER, "blending", dvalue="none")
+    print("--- blending {}".format(blending))
+    weighted = blending in ImageTiler.BLENDINGS
 
-      # Make a prediction to the whole image not tiled image of the image_file 
-      cv_image= self.pil2cv(resized)
-      predictions = self.predict([cv_image], expand=expand)
-          
-      prediction  = predictions[0]
-      whole_mask  = prediction[0]    
-
-      #whole_mask_pil = self.mask_to_image(whole_mask)
-      #whole_mask  = self.pil2cv(whole_mask_pil)
-      whole_mask  = self.normalize_mask(whole_mask)
-      # 2024/03/30
-      whole_mask  = self.binarize(whole_mask)
+    tiler   = ImageTiler(split_size, margin=MARGIN)
+    elapsed = 0.0
+    for image_file in image_files:
+      start   = time.perf_counter()
+      # image = BGR format
+      image   = cv2.imread(image_file)
+      h, w    = image.shape[:2]
 
-      whole_mask  = cv2.resize(whole_mask, (w, h))
+      # Resize the image to the input size (width, height) of our UNet model.      
+      # The whole image not tiled image of the image_file is predicted in the same batch of its tiles. 
+      cv_image = cv2.resize(image, (width, height), interpolation=cv2.INTER_CUBIC)
                 
       basename = os.path.basename(image_file)
       self.tiledinfer_log = None
@@ -699,119 +1003,90 @@ class TensorflowUNet:
           shutil.rmtree(tiled_masks_output_dir)
         if not os.path.exists(tiled_masks_output_dir):
           os.makedirs(tiled_masks_output_dir)
-         
-      w, h  = image.size
-
-      vert_split_num  = h // split_size
-      if h % split_size != 0:
-        vert_split_num += 1
-
-      horiz_split_num = w // split_size
-      if w % split_size != 0:
-        horiz_split_num += 1
-      background = Image.new("L", (w, h), bgcolor)
-
-      # Tiled image segmentation
-      for j in range(vert_split_num):
-        for i in range(horiz_split_num):
-          left  = split_size * i
-          upper = split_size * j
-          right = left  + split_size
-          lower = upper + split_size
-
-          if left >=w or upper >=h:
-            continue 
-      
-          left_margin  = MARGIN
-          upper_margin = MARGIN
-          if left-MARGIN <0:
-            left_margin = 0
-          if upper-MARGIN <0:
-            upper_margin = 0
-
-          right_margin = MARGIN
-          lower_margin = MARGIN 
-          if right + right_margin > w:
-            right_margin = 0
-          if lower + lower_margin > h:
-            lower_margin = 0
-
-          cropbox = (left  - left_margin,  upper - upper_margin, 
-                     right + right_margin, lower + lower_margin )
-          
-          # Crop a region specified by the cropbox from the whole image to create a tiled image segmentation.      
-          cropped = image.crop(cropbox)
-
-          # Get the size of the cropped image.
-          cw, ch  = cropped.size
-
-          # Resize the cropped image to the model image size (width, height) for a prediction.
-          cropped = cropped.resize((width, height))
-          if tiledinfer_debug:
-            #line = "image file {}x{} : x:{} y:{} width: {} height:{}\n".format(j, i, left, upper, cw, ch)
-            #print(line)            
-            cropped_image_filename = str(j) + "x" + str(i) + ".jpg"
-            cropped.save(os.path.join(tiled_images_output_dir, cropped_image_filename))
-
-          cvimage  = self.pil2cv(cropped)
-          predictions = self.predict([cvimage], expand=expand)
+
+      background = tiler.new_canvas(w, h, bgcolor)
+
+      # Split all the tiles of the image first, and gather them into one batch. 
+      tiles    = tiler.split(image)
+      cvimages = [cv_image]
+      for (box, tile) in tiles:
+        (j, i, left, upper, left_margin, upper_margin, cw, ch) = box
+        # Resize the tile to the model image size (width, height) for a prediction.
+        cropped = cv2.resize(tile, (width, height), interpolation=cv2.INTER_CUBIC)
+        if tiledinfer_debug:
+          cropped_image_filename = str(j) + "x" + str(i) + ".jpg"
+          cv2.imwrite(os.path.join(tiled_images_output_dir, cropped_image_filename), cropped)
+        cvimages.append(cropped)
+
+      # Predict the whole image and all the tiles by a single forward pass (or in chunks of tiles_batch_size).
+      batch_size  = tiles_batch_size
+      if batch_size <= 0:
+        batch_size = len(cvimages)
+      predictions = self.predict(cvimages, expand=expand, batch_size=batch_size)
           
-          prediction  = predictions[0]
-          mask        = prediction[0]    
-          mask        = self.mask_to_image(mask)
-          # Resize the mask to the same size of the corresponding the cropped_size (cw, ch)
-          mask        = mask.resize((cw, ch))
-
-          right_position = left_margin + width
-          if right_position > cw:
-             right_position = cw
-
-          bottom_position = upper_margin + height
-          if bottom_position > ch:
-             bottom_position = ch
-
-          # Excluding margins of left, upper, right and bottom from the mask. 
-          mask         = mask.crop((left_margin, upper_margin, 
-                                  right_position, bottom_position)) 
-          iw, ih = mask.size
-          if tiledinfer_debug:
-            #line = "mask  file {}x{} : x:{} y:{} width: {} height:{}\n".format(j, i,  left, upper, iw, ih)
-            #print(line)
-            cropped_mask_filename = str(j) + "x" + str(i) + ".jpg"
-            mask.save(os.path.join(tiled_masks_output_dir , cropped_mask_filename))
-          # Paste the tiled mask to the background. 
-          background.paste(mask, (left, upper))
+      prediction  = predictions[0]
+      whole_mask  = prediction[0]    
+
+      whole_mask  = self.normalize_mask(whole_mask)
+      # 2024/03/30
+      whole_mask  = self.binarize(whole_mask)
+
+      whole_mask  = cv2.resize(whole_mask, (w, h))
+
+      # Stitch the predicted tiles into the background.
+      accumulators = None
+      if weighted:
+        accumulators = tiler.new_accumulators(w, h)
+      for n, (box, tile) in enumerate(tiles):
+        (j, i, left, upper, left_margin, upper_margin, cw, ch) = box
+        prediction  = predictions[n + 1]
+        if weighted:
+          tiler.accumulate(accumulators, prediction[0], box, blending)
+          continue
+        mask        = self.normalize_mask(prediction[0])
+        # Resize the mask to the cropped size (cw, ch), exclude the margins, 
+        # and paste it to the background. 
+        mask        = tiler.stitch(background, mask, box)
+        if tiledinfer_debug and mask is not None:
+          cropped_mask_filename = str(j) + "x" + str(i) + ".jpg"
+          cv2.imwrite(os.path.join(tiled_masks_output_dir , cropped_mask_filename), mask)
+
+      if weighted:
+        background = tiler.normalize(accumulators, w, h)
 
-      basename = os.path.basename(image_file)
       output_file = os.path.join(output_dir, basename)
-      cv_background = self.pil2cv(background)
 
       bitwised = None
       if bitwise_blending:
         # Blend the non-tiled whole_mask and the tiled-backcround
-        bitwised = cv2.bitwise_and(whole_mask, cv_background)
+        bitwised = cv2.bitwise_and(whole_mask, background)
         # 2024/03/30
         bitwised = self.binarize(bitwised)
         bitwized_output_file =  os.path.join(output_dir, basename)
         cv2.imwrite(bitwized_output_file, bitwised)
       else:
         # Save the tiled-background. 
-        background.save(output_file)
+        cv2.imwrite(output_file, background)
 
       print("=== Saved outputfile {}".format(output_file))
       if merged_dir !=None:
-        img   = np.array(image)
-        img   = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+        img   = image
         #2024/03/10
         if bitwise_blending:
           mask = bitwised
         else:
-          mask  = cv_background 
+          mask  = background 
  
         mask  = cv2.cvtColor(mask, cv2.COLOR_GRAY2BGR)
         img += mask
         merged_file = os.path.join(merged_dir, basename)
         cv2.imwrite(merged_file, img)     
+      image_elapsed = time.perf_counter() - start
+      elapsed += image_elapsed
+      print("=== Elapsed time {:.3f} sec for {}".format(image_elapsed, image_file))
+
+    if len(image_files) > 0:
+      print("=== Average elapsed time {:.3f} sec per image".format(elapsed / len(image_files)))
 
   def mask_to_image(self, data, factor=255.0, format="RGB"):
     h = data.shape[0]
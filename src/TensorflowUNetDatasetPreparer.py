@@ -0,0 +1,76 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TensorflowUNetDatasetPreparer.py
+#
+# Write the prepared copies (PreparedDataset) of [train], [eval] and [test] datasets of
+# a train_eval_infer.config, which are resized and mask-preprocessed once, so that
+# TensorflowUNetTrainer.py, TensorflowUNetGeneratorTrainer.py and TensorflowUNetEvaluator.py
+# read them without decoding, resizing and preprocessing the source files on every run.
+#
+# The copies are prepared for the preprocessing of [dataset] datasetclass, and also for
+# that of ImageMaskDatasetGenerator if [model] generator is True.
+# Please run this again after changing the source files or the preprocessing settings,
+# otherwise the trainers read the source files as before.
+
+import os
+import sys
+import traceback
+
+from ConfigParser import ConfigParser
+from ModelRegistry import get_dataset_class
+from PreparedDataset import PreparedDataset
+
+MODEL   = "model"
+TRAIN   = "train"
+EVAL    = "eval"
+TEST    = "test"
+DATASET = "dataset"
+
+if __name__ == "__main__":
+  try:
+    config_file    = "./train_eval_infer.config"
+    if len(sys.argv) == 2:
+      config_file = sys.argv[1]
+
+    config   = ConfigParser(config_file)
+    prepared_dataset = PreparedDataset(config_file)
+
+    DatasetClass = get_dataset_class(config.get(DATASET, "datasetclass", dvalue="ImageMaskDataset"))
+    dataset = DatasetClass(config_file)
+    print("=== DatasetClass {}".format(dataset))
+    if dataset.preprocessing() is None:
+      raise Exception("DatasetClass {} cannot be prepared".format(DatasetClass.__name__))
+
+    for name in [TRAIN, EVAL, TEST]:
+      image_datapath = config.get(name, "image_datapath")
+      mask_datapath  = config.get(name, "mask_datapath")
+      if image_datapath is None or mask_datapath is None:
+        continue
+      prepared_dataset.prepare(name, image_datapath, mask_datapath, dataset.preprocessing(), dataset.read_pair,
+                               ordered=True)
+
+    if config.get(MODEL, "generator", dvalue=False):
+      from ImageMaskDatasetGenerator import ImageMaskDatasetGenerator
+      for name in [TRAIN, EVAL]:
+        generator = ImageMaskDatasetGenerator(config_file, dataset=name, clean=False)
+        if generator.preprocessing() == dataset.preprocessing():
+          # Already prepared above.
+          continue
+        prepared_dataset.prepare(name, config.get(name, "image_datapath"), config.get(name, "mask_datapath"),
+                                 generator.preprocessing(), generator.preprocess)
+
+  except:
+    traceback.print_exc()
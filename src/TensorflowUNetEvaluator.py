@@ -30,21 +30,8 @@ os.environ["TF_ENABLE_GPU_GARBAGE_COLLECTION"]="true"
 import traceback
 
 from ConfigParser import ConfigParser
-from ImageMaskDataset import ImageMaskDataset
-from BaseImageMaskDataset import BaseImageMaskDataset
-
-from TensorflowUNet import TensorflowUNet
-from TensorflowAttentionUNet import TensorflowAttentionUNet 
-from TensorflowEfficientUNet import TensorflowEfficientUNet
-from TensorflowMultiResUNet import TensorflowMultiResUNet
-from TensorflowSwinUNet import TensorflowSwinUNet
-from TensorflowTransUNet import TensorflowTransUNet
-from TensorflowUNet3Plus import TensorflowUNet3Plus
-from TensorflowU2Net import TensorflowU2Net
-from TensorflowSharpUNet import TensorflowSharpUNet
-#from TensorflowBASNet    import TensorflowBASNet
-from TensorflowDeepLabV3Plus import TensorflowDeepLabV3Plus
-from TensorflowEfficientNetB7UNet import TensorflowEfficientNetB7UNet
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class, get_dataset_class
 
 MODEL  = "model"
 TRAIN  = "train"
@@ -60,17 +47,19 @@ if __name__ == "__main__":
       config_file = sys.argv[1]
 
     config = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
     generator  = config.get(MODEL, "generator", dvalue=False)
     print("=== TensorflowUNetEvaluator")
     print("=== config generator {}".format(generator))
 
-    ModelClass = eval(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
     print("=== ModelClass {}".format(ModelClass))
     model     = ModelClass(config_file)
 
     # Create a DatasetClass
     # 2024/03/05 MODEL -> DATASETCLASS
-    DatasetClass = eval(config.get(DATASETCLASS, "datasetclass", dvalue="ImageMaskDataset"))
+    DatasetClass = get_dataset_class(config.get(DATASETCLASS, "datasetclass", dvalue="ImageMaskDataset"))
     print("=== DatasetClass {}".format(DatasetClass))
     dataset = DatasetClass(config_file)
 
@@ -27,27 +27,30 @@ import sys
 import traceback
 
 from ConfigParser import ConfigParser
-from ImageMaskDataset import ImageMaskDataset
-
-from TensorflowUNet import TensorflowUNet
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class
 
 from ImageMaskDatasetGenerator import ImageMaskDatasetGenerator
 
-from TensorflowAttentionUNet import TensorflowAttentionUNet 
-from TensorflowEfficientUNet import TensorflowEfficientUNet
-from TensorflowMultiResUNet import TensorflowMultiResUNet
-from TensorflowSwinUNet import TensorflowSwinUNet
-from TensorflowTransUNet import TensorflowTransUNet
-from TensorflowUNet3Plus import TensorflowUNet3Plus
-from TensorflowU2Net import TensorflowU2Net
-from TensorflowSharpUNet import TensorflowSharpUNet
-#from TensorflowBASNet    import TensorflowBASNet
-from TensorflowDeepLabV3Plus import TensorflowDeepLabV3Plus
-from TensorflowEfficientNetB7UNet import TensorflowEfficientNetB7UNet
-
 MODEL  = "model"
 TRAIN  = "train"
 EVAL   = "eval"
+GENERATOR = "generator"
+
+# [generator] loader
+#  "python" : ImageMaskDatasetGenerator, a Python generator
+#  "tf.data": TFDataImageMaskGenerator, a tf.data pipeline with a parallel map and prefetch
+#  "shared_memory": SharedMemoryImageMaskGenerator, worker processes writing batches to shared memory
+def get_generator_class(loader):
+  if loader == "tf.data":
+    from TFDataImageMaskGenerator import TFDataImageMaskGenerator
+    return TFDataImageMaskGenerator
+  if loader == "shared_memory":
+    from SharedMemoryImageMaskGenerator import SharedMemoryImageMaskGenerator
+    return SharedMemoryImageMaskGenerator
+  if loader != "python":
+    raise Exception("Invalid [generator] loader " + str(loader))
+  return ImageMaskDatasetGenerator
 
 if __name__ == "__main__":
   try:
@@ -55,19 +58,28 @@ if __name__ == "__main__":
     if len(sys.argv) == 2:
       config_file = sys.argv[1]
     config   = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
 
     # Create a UNetModel and compile
-    ModelClass = eval(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
     print("=== ModelClass {}".format(ModelClass))
     model     = ModelClass(config_file)
         
-    train_gen = ImageMaskDatasetGenerator(config_file, dataset=TRAIN)
+    GeneratorClass = get_generator_class(config.get(GENERATOR, "loader", dvalue="python"))
+    print("=== GeneratorClass {}".format(GeneratorClass))
+    train_gen = GeneratorClass(config_file, dataset=TRAIN)
     train_generator = train_gen.generate()
 
-    valid_gen = ImageMaskDatasetGenerator(config_file, dataset=EVAL)
+    valid_gen = GeneratorClass(config_file, dataset=EVAL)
     valid_generator = valid_gen.generate()
 
-    model.train(train_generator, valid_generator)
+    try:
+      model.train(train_generator, valid_generator)
+    finally:
+      # Write the queued debug images, and stop the workers of the generators.
+      train_gen.close()
+      valid_gen.close()
 
   except:
     traceback.print_exc()
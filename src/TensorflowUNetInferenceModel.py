@@ -0,0 +1,101 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TensorflowUNetInferenceModel.py
+#
+# A lean inference-only model which provides infer, infer_tiles and predict methods
+# of TensorflowUNet without calling create, compile and building an optimizer.
+#
+# [infer] backend = "saved_model"
+#   loads a SavedModel exported by TensorflowUNetSavedModelExporter.py directly.
+# [infer] backend = "tflite"
+#   runs a TFLite model exported by TensorflowUNetTFLiteConverter.py.
+
+import os
+import traceback
+import numpy as np
+import tensorflow as tf
+
+from ConfigParser import ConfigParser
+from RuntimePolicy import RuntimePolicy
+from TensorflowUNet import TensorflowUNet
+
+MODEL  = "model"
+INFER  = "infer"
+
+SIGNATURE = "serving_default"
+INPUTS    = "images"
+OUTPUTS   = "masks"
+
+# Keras-like predict wrapper of the serving signature of a SavedModel.
+class SavedModelPredictor:
+
+  def __init__(self, saved_model_dir):
+    if not os.path.exists(saved_model_dir):
+      raise Exception("Not found a saved_model_dir " + saved_model_dir)
+    self.eager = tf.executing_eagerly()
+    if self.eager:
+      self.loaded    = tf.saved_model.load(saved_model_dir)
+      self.signature = self.loaded.signatures[SIGNATURE]
+    else:
+      # Load the graph and variables into a dedicated session in graph mode.
+      self.graph   = tf.Graph()
+      self.session = tf.compat.v1.Session(graph=self.graph)
+      meta_graph   = tf.compat.v1.saved_model.loader.load(self.session,
+                          [tf.compat.v1.saved_model.tag_constants.SERVING], saved_model_dir)
+      signature    = meta_graph.signature_def[SIGNATURE]
+      self.inputs  = self.graph.get_tensor_by_name(signature.inputs[INPUTS].name)
+      self.outputs = self.graph.get_tensor_by_name(signature.outputs[OUTPUTS].name)
+
+  def predict(self, batch, batch_size=None):
+    batch = np.asarray(batch, dtype=np.uint8)
+    if self.eager:
+      return self.signature(**{INPUTS: tf.constant(batch)})[OUTPUTS].numpy()
+    return self.session.run(self.outputs, feed_dict={self.inputs: batch})
+
+
+class TensorflowUNetInferenceModel(TensorflowUNet):
+
+  # Please note that this never calls TensorflowUNet.__init__.
+  def __init__(self, config_file):
+    self.config_file = config_file
+    self.config      = ConfigParser(config_file)
+    self.runtime     = RuntimePolicy(config_file).apply()
+    self.read_inference_config()
+    self.model        = None
+    self.model_loaded = False
+    print("=== TensorflowUNetInferenceModel backend {}".format(self.backend))
+    if self.backend == "saved_model":
+      self.load_model()
+    elif self.backend != "tflite":
+      raise Exception("TensorflowUNetInferenceModel supports [infer] backend saved_model or tflite")
+
+  def load_model(self):
+    if not self.model_loaded and self.backend == "saved_model":
+      saved_model_dir = self.config.get(INFER, "saved_model_dir", dvalue="./saved_model")
+      self.model = SavedModelPredictor(saved_model_dir)
+      self.model_loaded = True
+      print("=== Loaded a saved_model {}".format(saved_model_dir))
+    return self.model_loaded
+
+  def train(self, train_generator, valid_generator):
+    raise Exception("TensorflowUNetInferenceModel cannot be trained")
+
+  def evaluate(self, x_test, y_test):
+    raise Exception("TensorflowUNetInferenceModel cannot be evaluated, use TensorflowUNetEvaluator.py")
+
+  def inspect(self, image_file='./model.png', summary_file="./summary.txt"):
+    raise Exception("TensorflowUNetInferenceModel cannot be inspected, use TensorflowUNetModelInspector.py")
+
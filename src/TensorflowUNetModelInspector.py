@@ -15,6 +15,8 @@
 
 # TensorflowUNetModelInspector.py
 # 2023/07/10 to-arai
+# 2024/04 Added [inspect] memory_report to write a report of the peak memory and the training
+#         step time for [model] rematerialize modes and batch sizes by ModelMemoryProfiler.
 
 
 
@@ -28,19 +30,8 @@ import sys
 import traceback
 
 from ConfigParser import ConfigParser
-from TensorflowUNet import TensorflowUNet
-from TensorflowAttentionUNet import TensorflowAttentionUNet 
-from TensorflowEfficientUNet import TensorflowEfficientUNet
-from TensorflowMultiResUNet import TensorflowMultiResUNet
-from TensorflowSwinUNet import TensorflowSwinUNet
-from TensorflowTransUNet import TensorflowTransUNet
-from TensorflowUNet3Plus import TensorflowUNet3Plus
-from TensorflowU2Net import TensorflowU2Net
-from TensorflowSharpUNet import TensorflowSharpUNet
-#from TensorflowBASNet    import TensorflowBASNet
-from TensorflowDeepLabV3Plus import TensorflowDeepLabV3Plus
-from TensorflowEfficientNetB7UNet import TensorflowEfficientNetB7UNet
-
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class
 
 MODEL   = "model"
 TRAIN   = "train"
@@ -54,10 +45,12 @@ if __name__ == "__main__":
     if not os.path.exists(config_file):
       raise Exception("Not found " + config_file)
     config   = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
 
     # Create a UNetMolde and compile
     #model   = TensorflowUNet(config_file)
-    ModelClass = eval(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
     print("=== ModelClass {}".format(ModelClass))
 
     model     = ModelClass(config_file)
@@ -67,6 +60,10 @@ if __name__ == "__main__":
     # Inspect the model.
     model.inspect(model_graph, summary)
 
+    if config.get(INSPECT, "memory_report", dvalue=False):
+      from ModelMemoryProfiler import ModelMemoryProfiler
+      ModelMemoryProfiler(config_file).run()
+
   except:
     traceback.print_exc()
     
@@ -0,0 +1,127 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TensorflowUNetSavedModelExporter.py
+#
+# Export a trained TensorflowUNet model (best_model.h5) to a self-contained SavedModel.
+# The serving signature "serving_default" takes a batch of uint8 BGR images of the model size,
+#   images: uint8 [N, image_height, image_width, image_channels]
+# casts them to float32 as the Keras model did, and returns the output of the final
+# sigmoid (or softmax) layer of the model
+#   masks:  float32 [N, image_height, image_width, num_classes]
+#
+# The exported SavedModel can be loaded by TensorflowUNetInferenceModel without creating
+# and compiling a Keras model by the following setting.
+"""
+[infer]
+backend         = "saved_model"
+saved_model_dir = "./saved_model"
+"""
+
+import os
+
+os.environ["TF_FORCE_GPU_ALLOW_GROWTH"] = "true"
+os.environ["TF_ENABLE_GPU_GARBAGE_COLLECTION"]="true"
+
+import sys
+import shutil
+import traceback
+
+from ConfigParser import ConfigParser
+
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class
+
+import tensorflow as tf
+
+MODEL  = "model"
+INFER  = "infer"
+
+SIGNATURE = "serving_default"
+INPUTS    = "images"
+OUTPUTS   = "masks"
+
+class TensorflowUNetSavedModelExporter:
+
+  def __init__(self, config_file, unet):
+    self.config          = ConfigParser(config_file)
+    # unet is an instance of TensorflowUNet or its subclass of which weights have been loaded.
+    self.unet            = unet
+    self.saved_model_dir = self.config.get(INFER, "saved_model_dir", dvalue="./saved_model")
+    self.image_height    = self.config.get(MODEL, "image_height")
+    self.image_width     = self.config.get(MODEL, "image_width")
+    self.image_channels  = self.config.get(MODEL, "image_channels")
+
+  def export(self):
+    if os.path.exists(self.saved_model_dir):
+      shutil.rmtree(self.saved_model_dir)
+    if tf.executing_eagerly():
+      self.export_v2()
+    else:
+      self.export_v1()
+    print("=== Exported a SavedModel to {}".format(self.saved_model_dir))
+
+  # Export by tf.saved_model.save in eager mode.
+  def export_v2(self):
+    model = self.unet.model
+    input_spec = tf.TensorSpec([None, self.image_height, self.image_width, self.image_channels],
+                               dtype=tf.uint8, name=INPUTS)
+    @tf.function(input_signature=[input_spec])
+    def serve(images):
+      x = tf.cast(images, tf.float32)
+      return {OUTPUTS: tf.cast(model(x, training=False), tf.float32)}
+
+    module = tf.Module()
+    module.model = model
+    module.serve = serve
+    tf.saved_model.save(module, self.saved_model_dir, signatures={SIGNATURE: serve})
+
+  # Export by SavedModelBuilder with the Keras session in graph mode (tf.compat.v1.disable_eager_execution).
+  def export_v1(self):
+    model   = self.unet.model
+    session = tf.compat.v1.keras.backend.get_session()
+    images  = tf.compat.v1.placeholder(tf.uint8,
+                   [None, self.image_height, self.image_width, self.image_channels], name=INPUTS)
+    x       = tf.cast(images, tf.float32)
+    masks   = tf.cast(model(x, training=False), tf.float32)
+    signature = tf.compat.v1.saved_model.predict_signature_def(
+                   inputs={INPUTS: images}, outputs={OUTPUTS: masks})
+    builder = tf.compat.v1.saved_model.Builder(self.saved_model_dir)
+    builder.add_meta_graph_and_variables(session, [tf.compat.v1.saved_model.tag_constants.SERVING],
+                   signature_def_map={SIGNATURE: signature},
+                   strip_default_attrs=True)
+    builder.save()
+
+
+if __name__ == "__main__":
+  try:
+    config_file    = "./train_eval_infer.config"
+    if len(sys.argv) == 2:
+      config_file = sys.argv[1]
+    config     = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
+
+    ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    print("=== ModelClass {}".format(ModelClass))
+    model     = ModelClass(config_file)
+    model.load_model()
+
+    exporter  = TensorflowUNetSavedModelExporter(config_file, model)
+    exporter.export()
+
+  except:
+    traceback.print_exc()
+
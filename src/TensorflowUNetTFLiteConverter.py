@@ -0,0 +1,187 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TensorflowUNetTFLiteConverter.py
+#
+# Convert a trained TensorflowUNet model (best_model.h5) to TFLite models for CPU inference.
+#  float16: float16 weight quantization
+#  int8   : post-training integer quantization calibrated with images of [eval] dataset
+# and write a dice drift report of the TFLite models against the float Keras model.
+#
+# You can run inference on the converted model by TensorflowUNetInferencer.py
+# and TensorflowUNetTiledInferencer.py with the following setting.
+"""
+[infer]
+backend      = "tflite"
+tflite_model = "./tflite_models/model_int8.tflite"
+"""
+# Example of a [tflite] section
+"""
+[tflite]
+output_dir          = "./tflite_models"
+quantizations       = ["float16", "int8"]
+calibration_samples = 100
+; The first calibration_samples of [eval] dataset calibrate the int8 model, and the next
+; evaluation_samples evaluate the dice drift.
+evaluation_samples  = 200
+evaluation_csv      = "./tflite_evaluation.csv"
+"""
+
+import os
+
+os.environ["TF_FORCE_GPU_ALLOW_GROWTH"] = "true"
+os.environ["TF_ENABLE_GPU_GARBAGE_COLLECTION"]="true"
+
+import sys
+import traceback
+import numpy as np
+
+from ConfigParser import ConfigParser
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class, get_dataset_class
+
+import tensorflow as tf
+from TFLiteModel import TFLiteModel
+
+MODEL   = "model"
+EVAL    = "eval"
+DATASET = "dataset"
+TFLITE  = "tflite"
+
+class TensorflowUNetTFLiteConverter:
+
+  def __init__(self, config_file, unet):
+    self.config     = ConfigParser(config_file)
+    # unet is an instance of TensorflowUNet or its subclass of which weights have been loaded.
+    self.unet       = unet
+    self.output_dir = self.config.get(TFLITE, "output_dir", dvalue="./tflite_models")
+    self.quantizations       = self.config.get(TFLITE, "quantizations",       dvalue=["float16", "int8"])
+    self.calibration_samples = self.config.get(TFLITE, "calibration_samples", dvalue=100)
+    self.evaluation_samples  = self.config.get(TFLITE, "evaluation_samples",  dvalue=200)
+    self.evaluation_csv      = self.config.get(TFLITE, "evaluation_csv",      dvalue="./tflite_evaluation.csv")
+    self.batch_size          = self.config.get(EVAL,   "batch_size",          dvalue=4)
+    if not os.path.exists(self.output_dir):
+      os.makedirs(self.output_dir)
+
+  def create_converter(self):
+    model = self.unet.model
+    if tf.executing_eagerly():
+      return tf.lite.TFLiteConverter.from_keras_model(model)
+    # In graph mode (tf.compat.v1.disable_eager_execution), convert the graph in the Keras session.
+    session = tf.compat.v1.keras.backend.get_session()
+    return tf.compat.v1.lite.TFLiteConverter.from_session(session, model.inputs, model.outputs)
+
+  def convert(self, quantization, x_calibration):
+    converter = self.create_converter()
+    if quantization == "float16":
+      converter.optimizations = [tf.lite.Optimize.DEFAULT]
+      converter.target_spec.supported_types = [tf.float16]
+
+    elif quantization == "int8":
+      converter.optimizations = [tf.lite.Optimize.DEFAULT]
+      def representative_dataset():
+        for x in x_calibration:
+          yield [np.expand_dims(x, 0).astype(np.float32)]
+      converter.representative_dataset = representative_dataset
+      # Keep float32 input and output, so that the model can be used in place of the float model.
+      converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8,
+                                             tf.lite.OpsSet.TFLITE_BUILTINS]
+    elif quantization != "float32":
+      raise Exception("Invalid quantization " + str(quantization))
+
+    tflite_model = converter.convert()
+    tflite_file  = os.path.join(self.output_dir, "model_" + quantization + ".tflite")
+    with open(tflite_file, "wb") as f:
+      f.write(tflite_model)
+    print("=== Saved {} ({} bytes)".format(tflite_file, len(tflite_model)))
+    return tflite_file
+
+  def dice(self, y_true, y_pred, threshold=0.5):
+    y_true = y_true.reshape(-1) > 0
+    y_pred = y_pred.reshape(-1) >= threshold
+    intersection = np.logical_and(y_true, y_pred).sum()
+    return (2.0 * intersection + 1.0) / (y_true.sum() + y_pred.sum() + 1.0)
+
+  def mean_dice(self, y_true, y_pred):
+    return float(np.mean([self.dice(y_true[i], y_pred[i]) for i in range(len(y_true))]))
+
+  def predict_tflite(self, tflite_model, x):
+    preds = []
+    for i in range(0, len(x), self.batch_size):
+      preds.append(tflite_model.predict(x[i:i+self.batch_size]))
+    return np.concatenate(preds)
+
+  # Split the [eval] dataset into the disjoint calibration and evaluation samples, so that
+  # the int8 model is never evaluated on the images which calibrated it.
+  def split(self, x_eval, y_eval):
+    (c, e) = (self.calibration_samples, self.evaluation_samples)
+    if len(x_eval) <= c:
+      raise Exception("Too few [eval] samples {} for calibration_samples {} and evaluation_samples {}".format(
+                      len(x_eval), c, e))
+    if len(x_eval) < c + e:
+      print("--- Warning: [eval] samples {} < calibration_samples {} + evaluation_samples {}, evaluating on {}".format(
+            len(x_eval), c, e, len(x_eval) - c))
+    return (x_eval[:c], x_eval[c:c+e], y_eval[c:c+e])
+
+  def run(self, x_eval, y_eval):
+    (x_calibration, x_test, y_test) = self.split(x_eval, y_eval)
+    print("=== calibration samples {}  evaluation samples {}".format(len(x_calibration), len(x_test)))
+
+    float_preds = self.unet.model.predict(x_test, batch_size=self.batch_size)
+    float_dice  = self.mean_dice(y_test, float_preds)
+
+    results = [("keras_float32", float_dice, 0.0, 0.0)]
+    for quantization in self.quantizations:
+      tflite_file  = self.convert(quantization, x_calibration)
+      tflite_model = TFLiteModel(tflite_file)
+      tflite_preds = self.predict_tflite(tflite_model, x_test)
+      tflite_dice  = self.mean_dice(y_test, tflite_preds)
+      max_diff     = float(np.max(np.abs(tflite_preds - float_preds)))
+      results.append(("tflite_" + quantization, tflite_dice, tflite_dice - float_dice, max_diff))
+
+    with open(self.evaluation_csv, "w") as f:
+      f.writelines("model,dice,dice_drift,max_abs_diff\n")
+      for (name, dice, drift, max_diff) in results:
+        line = "{},{},{},{}".format(name, round(dice, 4), round(drift, 4), round(max_diff, 4))
+        print("--- {}".format(line))
+        f.writelines(line + "\n")
+    print("--- Saved {}".format(self.evaluation_csv))
+
+
+if __name__ == "__main__":
+  try:
+    config_file    = "./train_eval_infer.config"
+    if len(sys.argv) == 2:
+      config_file = sys.argv[1]
+    config     = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
+
+    ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    print("=== ModelClass {}".format(ModelClass))
+    model     = ModelClass(config_file)
+    model.load_model()
+
+    DatasetClass = get_dataset_class(config.get(DATASET, "datasetclass", dvalue="ImageMaskDataset"))
+    print("=== DatasetClass {}".format(DatasetClass))
+    dataset = DatasetClass(config_file)
+    x_eval, y_eval = dataset.create(dataset=EVAL)
+
+    converter = TensorflowUNetTFLiteConverter(config_file, model)
+    converter.run(x_eval, y_eval)
+
+  except:
+    traceback.print_exc()
+
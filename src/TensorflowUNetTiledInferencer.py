@@ -27,20 +27,8 @@ import sys
 import traceback
 
 from ConfigParser import ConfigParser
-from ImageMaskDataset import ImageMaskDataset
-
-from TensorflowUNet import TensorflowUNet
-from TensorflowAttentionUNet import TensorflowAttentionUNet 
-from TensorflowEfficientUNet import TensorflowEfficientUNet
-from TensorflowMultiResUNet import TensorflowMultiResUNet
-from TensorflowSwinUNet import TensorflowSwinUNet
-from TensorflowTransUNet import TensorflowTransUNet
-from TensorflowUNet3Plus import TensorflowUNet3Plus
-from TensorflowU2Net import TensorflowU2Net
-from TensorflowSharpUNet import TensorflowSharpUNet
-#from TensorflowBASNet    import TensorflowBASNet
-from TensorflowDeepLabV3Plus import TensorflowDeepLabV3Plus
-from TensorflowEfficientNetB7UNet import TensorflowEfficientNetB7UNet
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class
 
 MODEL  = "model"
 TRAIN  = "train"
@@ -56,12 +44,20 @@ if __name__ == "__main__":
     if len(sys.argv) == 2:
       config_file = sys.argv[1]
     config     = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
     images_dir = config.get(TILEDINFER, "images_dir")
     output_dir = config.get(TILEDINFER, "output_dir")
  
     # Create a UNetMolde and compile
     #model          = TensorflowUNet(config_file)
-    ModelClass = eval(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    # Use a lean inference model which never creates and compiles a Keras model
+    # for the exported saved_model or tflite backend.
+    backend    = config.get(INFER, "backend", dvalue="keras")
+    if backend in ["saved_model", "tflite"]:
+      ModelClass = get_model_class("TensorflowUNetInferenceModel")
+    else:
+      ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
     print("=== ModelClass {}".format(ModelClass))
     model     = ModelClass(config_file)
       
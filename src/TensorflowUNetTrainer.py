@@ -32,22 +32,8 @@ import sys
 import traceback
 
 from ConfigParser import ConfigParser
-from ImageMaskDataset import ImageMaskDataset
-from BaseImageMaskDataset import BaseImageMaskDataset
-
-from TensorflowUNet import TensorflowUNet
-
-from TensorflowAttentionUNet import TensorflowAttentionUNet 
-from TensorflowEfficientUNet import TensorflowEfficientUNet
-from TensorflowMultiResUNet import TensorflowMultiResUNet
-from TensorflowSwinUNet import TensorflowSwinUNet
-from TensorflowTransUNet import TensorflowTransUNet
-from TensorflowUNet3Plus import TensorflowUNet3Plus
-from TensorflowU2Net import TensorflowU2Net
-from TensorflowSharpUNet import TensorflowSharpUNet
-#from TensorflowBASNet    import TensorflowBASNet
-from TensorflowDeepLabV3Plus import TensorflowDeepLabV3Plus
-from TensorflowEfficientNetB7UNet import TensorflowEfficientNetB7UNet
+from RuntimePolicy import RuntimePolicy
+from ModelRegistry import get_model_class, get_dataset_class
 
 MODEL   = "model"
 TRAIN   = "train"
@@ -60,14 +46,16 @@ if __name__ == "__main__":
       config_file = sys.argv[1]
 
     config   = ConfigParser(config_file)
+    # Apply [runtime] threading and execution-mode policy before any model is constructed.
+    RuntimePolicy(config_file).apply()
 
     # Create a UNetModel and compile
-    ModelClass = eval(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+    ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
     print("=== ModelClass {}".format(ModelClass))
     model     = ModelClass(config_file)
 
     # Create a DatasetClass
-    DatasetClass = eval(config.get(DATASET, "datasetclass", dvalue="ImageMaskDataset"))
+    DatasetClass = get_dataset_class(config.get(DATASET, "datasetclass", dvalue="ImageMaskDataset"))
     dataset = DatasetClass(config_file)
     print("=== DatasetClass {}".format(dataset))
     # Create a TRAIN dataset
@@ -0,0 +1,147 @@
+# Copyright 2024 antillia.com Toshiyuki Arai
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+# TrainingLoopBenchmark.py
+#
+# Compare the training steps/sec of the model and the [generator] loader of a config file
+#  fit/graph   : model.fit in the graph mode ([runtime] execution = "graph"), the default
+#  fit/function: model.fit with tf.function steps ([runtime] execution = "function")
+#  custom      : CustomTrainingLoop ([train] loop = "custom", [runtime] execution = "function")
+# [runtime] jit_compile of the config file applies to fit/function and custom.
+# Each variant runs in a fresh Python process, because the execution mode is global to a process.
+# It trains two epochs of steps batches, and reports the steps/sec of the second epoch,
+# excluding the tracing and compilation in the first epoch.
+#
+# Usage:
+# python TrainingLoopBenchmark.py [./train_eval_infer.config] [steps]
+
+import os
+import sys
+import json
+import tempfile
+import subprocess
+import configparser
+import traceback
+
+from ConfigParser import ConfigParser
+
+MODEL     = "model"
+TRAIN     = "train"
+RUNTIME   = "runtime"
+GENERATOR = "generator"
+
+# name -> ([train] loop, [runtime] execution)
+VARIANTS = {
+  "fit/graph"   : ("fit",    "graph"),
+  "fit/function": ("fit",    "function"),
+  "custom"      : ("custom", "function"),
+}
+
+MEASURE = "from TrainingLoopBenchmark import measure\nmeasure({!r}, {})\n"
+
+# The body of a measurement process.
+def measure(config_file, steps):
+  import time
+  import tensorflow as tf
+  from RuntimePolicy import RuntimePolicy
+  from ModelRegistry import get_model_class
+  from TensorflowUNetGeneratorTrainer import get_generator_class
+
+  class EpochTimer(tf.keras.callbacks.Callback):
+    def __init__(self):
+      super().__init__()
+      self.times = []
+    def on_epoch_begin(self, epoch, logs=None):
+      self.start = time.perf_counter()
+    def on_epoch_end(self, epoch, logs=None):
+      self.times.append(time.perf_counter() - self.start)
+
+  config = ConfigParser(config_file)
+  RuntimePolicy(config_file).apply()
+  ModelClass = get_model_class(config.get(MODEL, "model", dvalue="TensorflowUNet"))
+  model = ModelClass(config_file)
+  GeneratorClass = get_generator_class(config.get(GENERATOR, "loader", dvalue="python"))
+  generator = GeneratorClass(config_file, dataset=TRAIN).generate()
+
+  timer = EpochTimer()
+  training_loop = model.create_training_loop()
+  if training_loop != None:
+    training_loop.fit(generator, steps_per_epoch=steps, epochs=2, callbacks=[timer], verbose=0)
+  else:
+    model.model.fit(generator, steps_per_epoch=steps, epochs=2, callbacks=[timer], verbose=0)
+  print(json.dumps({"steps_per_sec": steps / timer.times[-1]}))
+
+
+class TrainingLoopBenchmark:
+
+  def __init__(self, config_file, steps=20):
+    self.config_file = config_file
+    self.steps   = steps
+    self.src_dir = os.path.dirname(os.path.abspath(__file__))
+
+  # Write a copy of the config file with the loop and the execution to a temporary file.
+  def write_config(self, loop, execution):
+    parser = configparser.ConfigParser()
+    parser.read(self.config_file)
+    for section in [TRAIN, RUNTIME]:
+      if not parser.has_section(section):
+        parser.add_section(section)
+    parser.set(TRAIN,   "loop",      "\"" + loop + "\"")
+    parser.set(RUNTIME, "execution", "\"" + execution + "\"")
+    (fd, temp_file) = tempfile.mkstemp(suffix=".config", dir=".")
+    with os.fdopen(fd, "w") as f:
+      parser.write(f)
+    return temp_file
+
+  def run_measure(self, config_file):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = self.src_dir + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run([sys.executable, "-c", MEASURE.format(config_file, self.steps)],
+                            env=env, capture_output=True, text=True)
+    for line in reversed(result.stdout.strip().split("\n")):
+      if line.startswith("{"):
+        return json.loads(line)["steps_per_sec"]
+    print(result.stderr[-2000:])
+    return None
+
+  def run(self):
+    print("=== TrainingLoopBenchmark steps {}".format(self.steps))
+    print("{:16s} {:>14s} {:>10s}".format("variant", "steps/sec", "speedup"))
+    baseline = None
+    for (name, (loop, execution)) in VARIANTS.items():
+      config_file = self.write_config(loop, execution)
+      try:
+        steps_per_sec = self.run_measure(config_file)
+      finally:
+        os.remove(config_file)
+      if steps_per_sec is None:
+        print("{:16s} {:>14s}".format(name, "failed"))
+        continue
+      if baseline is None:
+        baseline = steps_per_sec
+      print("{:16s} {:14.3f} {:9.2f}x".format(name, steps_per_sec, steps_per_sec / baseline))
+
+
+if __name__ == "__main__":
+  try:
+    config_file = "./train_eval_infer.config"
+    steps       = 20
+    if len(sys.argv) >= 2:
+      config_file = sys.argv[1]
+    if len(sys.argv) >= 3:
+      steps = int(sys.argv[2])
+    TrainingLoopBenchmark(config_file, steps=steps).run()
+  except:
+    traceback.print_exc()
@@ -68,11 +68,15 @@ from tensorflow.keras.losses import binary_crossentropy, BinaryCrossentropy
 
 
 def sensitivity(y_true, y_pred):
+    y_true = K.cast(y_true, 'float32')
+    y_pred = K.cast(y_pred, 'float32')
     true_positives = K.sum(K.round(K.clip(y_true * y_pred, 0, 1)))
     possible_positives = K.sum(K.round(K.clip(y_true, 0, 1)))
     return true_positives / (possible_positives + K.epsilon())
 
 def specificity(y_true, y_pred):
+    y_true = K.cast(y_true, 'float32')
+    y_pred = K.cast(y_pred, 'float32')
     true_negatives = K.sum(K.round(K.clip((1 - y_true) * (1 - y_pred), 0, 1)))
     possible_negatives = K.sum(K.round(K.clip(1 - y_true, 0, 1)))
     return true_negatives / (possible_negatives + K.epsilon())
@@ -94,6 +98,9 @@ def dice_loss(y_true, y_pred):
    
  
 def bce_dice_loss(y_true, y_pred):
+    # 2024/04 Compute the losses in float32 under a mixed precision policy.
+    y_true = K.cast(y_true, 'float32')
+    y_pred = K.cast(y_pred, 'float32')
     loss = binary_crossentropy(y_true, y_pred) + dice_loss(y_true, y_pred)
     return loss / 2.0
 
@@ -139,6 +146,9 @@ def basnet_hybrid_loss(y_true, y_pred):
     and intersection-over-union losses, which guide the network to learn
     three-level (i.e., pixel-, patch- and map- level) hierarchy representations.
     """
+    # 2024/04 Compute the losses in float32 under a mixed precision policy.
+    y_true = K.cast(y_true, 'float32')
+    y_pred = K.cast(y_pred, 'float32')
     bce_loss = BinaryCrossentropy(from_logits=False)
     bce_loss = bce_loss(y_true, y_pred)
 
@@ -151,6 +161,9 @@ def basnet_hybrid_loss(y_true, y_pred):
 
 # 2023/06/07 
 def bce_iou_loss(y_true, y_pred):
+    # 2024/04 Compute the losses in float32 under a mixed precision policy.
+    y_true = K.cast(y_true, 'float32')
+    y_pred = K.cast(y_pred, 'float32')
     bce_loss = BinaryCrossentropy(from_logits=False)
     loss1 = bce_loss(y_true, y_pred)
     loss2 = iou_loss(y_true, y_pred)